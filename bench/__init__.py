@@ -0,0 +1,9 @@
+"""
+NanoAnalytics benchmark suite.
+
+  python -m bench.generate bench/data/1m.db --rows 1m      # synthetic dataset
+  python -m bench.run --db bench/data/1m.db --out run.json # measure
+  python -m bench.compare baseline.json run.json           # fail on regressions
+
+Not part of the installed package; run from the repository root.
+"""
@@ -0,0 +1,110 @@
+"""
+Compare two bench.run result files; exit 1 if anything regressed.
+
+  python -m bench.compare baseline.json current.json
+  python -m bench.compare baseline.json current.json --p50 0.10 --p99 0.30 --min-ms 2
+
+A latency case regresses when its p50 (or p99) grows by more than the given
+fraction AND by more than --min-ms, so sub-millisecond noise never fails a
+run.  Ingest regresses when hits_per_s drops by more than --throughput, or
+when fewer hits were stored than sent.  Cases present on only one side are
+listed but do not fail.
+"""
+
+import argparse
+import json
+import sys
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _change(old, new):
+    return (new - old) / old if old else 0.0
+
+
+def compare(base, cur, p50=0.15, p99=0.30, min_ms=1.0, throughput=0.15):
+    """Return (regressions, improvements, notes) as lists of printable lines."""
+    regressions, improvements, notes = [], [], []
+
+    base_api, cur_api = base.get("api", {}), cur.get("api", {})
+    for key in sorted(base_api.keys() | cur_api.keys()):
+        if key not in cur_api or key not in base_api:
+            notes.append(f"api {key}: only in {'baseline' if key in base_api else 'current'}")
+            continue
+        b, c = base_api[key], cur_api[key]
+        if c.get("status", 200) != 200:
+            regressions.append(f"api {key}: HTTP {c['status']}")
+            continue
+        for stat, limit in (("p50_ms", p50), ("p99_ms", p99)):
+            old, new = b[stat], c[stat]
+            delta    = _change(old, new)
+            line     = f"api {key} {stat[:3]}: {old:.2f} → {new:.2f} ms ({delta:+.0%})"
+            if delta > limit and new - old > min_ms:
+                regressions.append(line)
+            elif delta < -limit and old - new > min_ms:
+                improvements.append(line)
+
+    base_in, cur_in = base.get("ingest", {}), cur.get("ingest", {})
+    for key in sorted(base_in.keys() | cur_in.keys()):
+        b, c = base_in.get(key, {}), cur_in.get(key, {})
+        if "hits_per_s" not in b or "hits_per_s" not in c:
+            notes.append(f"ingest {key}: not measured on both sides")
+            continue
+        old, new = b["hits_per_s"], c["hits_per_s"]
+        delta    = _change(old, new)
+        line     = f"ingest {key}: {old:,.0f} → {new:,.0f} hits/s ({delta:+.0%})"
+        if delta < -throughput:
+            regressions.append(line)
+        elif delta > throughput:
+            improvements.append(line)
+        if c.get("stored", c["hits"]) < c["hits"]:
+            regressions.append(f"ingest {key}: stored {c['stored']} of {c['hits']} hits")
+
+    header = []
+    for side, data in (("baseline", base), ("current", cur)):
+        meta = data.get("meta", {})
+        header.append(f"{side}: {meta.get('revision')} "
+                      f"({meta.get('dataset', {}).get('hits', '?')} hits, "
+                      f"{meta.get('started_at')})")
+    return regressions, improvements, header + notes
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.compare", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("baseline")
+    ap.add_argument("current")
+    ap.add_argument("--p50", type=float, default=0.15,
+                    help="allowed p50 latency growth as a fraction (default 0.15)")
+    ap.add_argument("--p99", type=float, default=0.30,
+                    help="allowed p99 latency growth as a fraction (default 0.30)")
+    ap.add_argument("--min-ms", type=float, default=1.0,
+                    help="ignore latency changes smaller than this (default 1.0)")
+    ap.add_argument("--throughput", type=float, default=0.15,
+                    help="allowed hits/s drop as a fraction (default 0.15)")
+    args = ap.parse_args(argv)
+
+    regressions, improvements, notes = compare(
+        _load(args.baseline), _load(args.current),
+        p50=args.p50, p99=args.p99, min_ms=args.min_ms, throughput=args.throughput,
+    )
+    for line in notes:
+        print(line)
+    if improvements:
+        print(f"\n{len(improvements)} improvement(s):")
+        for line in improvements:
+            print(f"  {line}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
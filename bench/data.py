@@ -0,0 +1,206 @@
+"""
+Synthetic traffic model shared by the dataset generator and the /hit benchmark.
+
+Everything is driven by one random.Random(seed), so the same arguments always
+produce the same dataset.  Distributions are skewed the way real traffic is:
+
+  sites      — Zipf over N root domains; each has a root and a www. host, some
+               also blog./app. subdomains
+  paths      — Zipf over a per-site vocabulary ("/" and a few pages dominate)
+  referrers  — about half direct; external ones Zipf over search/social/long
+               tail; later hits of a session refer to the previous page
+  UAs        — weighted browser/OS mix plus ~6 % crawlers and scripts
+  sessions   — geometric hits per session (mean ≈ 3), exponential gaps
+  time       — diurnal curve over the requested number of days
+"""
+
+import heapq
+import math
+import random
+import time
+from itertools import accumulate
+
+from nano_analytics.routes import _is_bot
+from nano_analytics.ua_parser import classify
+
+DAY  = 86400
+HOUR = 3600
+
+# (user agent, weight)
+USER_AGENTS = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/124.0.0.0 Safari/537.36", 30),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 "
+     "(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1", 18),
+    ("Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/124.0.0.0 Mobile Safari/537.36", 14),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 "
+     "(KHTML, like Gecko) Version/17.4 Safari/605.1.15", 10),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0", 6),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/124.0.0.0 Safari/537.36 Edg/124.0.0.0", 6),
+    ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/124.0.0.0 Safari/537.36", 3),
+    ("Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 "
+     "(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1", 3),
+    ("Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/124.0.0.0 Safari/537.36", 2),
+    ("Mozilla/5.0 (Windows NT 6.1; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+     "Chrome/120.0.0.0 Safari/537.36", 2),
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", 3),
+    ("Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)", 1),
+    ("python-requests/2.31.0", 1),
+    ("curl/8.5.0", 1),
+]
+
+EXTERNAL_REFS = [
+    "https://www.google.com/", "https://www.bing.com/", "https://duckduckgo.com/",
+    "https://t.co/", "https://news.ycombinator.com/", "https://www.reddit.com/",
+    "https://github.com/", "https://www.linkedin.com/", "https://www.facebook.com/",
+] + [f"https://blog{i}.example.net/post" for i in range(200)]
+
+LANGS     = [("en-US", 45), ("en-GB", 10), ("de-DE", 9), ("fr-FR", 8), ("es-ES", 7),
+             ("pt-BR", 6), ("ja-JP", 5), ("zh-CN", 4), ("nl-NL", 3), ("", 3)]
+COUNTRIES = [("US", 38), ("GB", 9), ("DE", 8), ("IN", 8), ("FR", 6), ("BR", 5),
+             ("CA", 5), ("JP", 4), ("NL", 3), ("AU", 3), (None, 11)]
+WIDTHS    = {
+    "mobile":  [(390, 40), (412, 30), (375, 20), (360, 10)],
+    "tablet":  [(768, 50), (820, 30), (1024, 20)],
+    "desktop": [(1920, 40), (1440, 25), (1536, 15), (1280, 12), (2560, 8)],
+}
+
+
+def _zipf(n, s):
+    """Cumulative Zipf(s) weights over ranks 1..n."""
+    return list(accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+
+
+def _cum(pairs):
+    return [v for v, _ in pairs], list(accumulate(w for _, w in pairs))
+
+
+def _path(rank):
+    if rank < 6:
+        return ("/", "/pricing", "/about", "/blog", "/docs", "/signup")[rank]
+    if rank % 50 == 0:
+        return f"/static/img/{rank}.png"   # a few non-page hits (bounce rates skip them)
+    if rank % 2:
+        return f"/blog/post-{rank}"
+    return f"/docs/page-{rank}"
+
+
+class Traffic:
+    def __init__(self, seed=1, sites=200, paths=2000, days=90, end=None):
+        self.rng   = random.Random(seed)
+        self.days  = days
+        self.end   = int(end or time.time())
+        self.start = self.end - days * DAY
+
+        self.sites     = [f"site{i}.com" for i in range(sites)]
+        self._site_cw  = _zipf(sites, 1.1)
+        self._hosts    = {}
+        for i, root in enumerate(self.sites):
+            hosts = [(root, 40), (f"www.{root}", 55)]
+            if i % 5 == 0:
+                hosts += [(f"blog.{root}", 10), (f"app.{root}", 5)]
+            self._hosts[root] = _cum(hosts)
+
+        self.paths    = [_path(r) for r in range(paths)]
+        self._path_cw = _zipf(paths, 1.1)
+        self._ref_cw  = _zipf(len(EXTERNAL_REFS), 1.0)
+
+        self._uas, self._ua_cw       = _cum(USER_AGENTS)
+        self._langs, self._lang_cw   = _cum(LANGS)
+        self._countries, self._cc_cw = _cum(COUNTRIES)
+        self._widths  = {d: _cum(pairs) for d, pairs in WIDTHS.items()}
+        self._ua_info = {ua: (_is_bot(ua), classify(ua)) for ua in self._uas}
+
+        # Mean hits per visit: crawlers send one, people a geometric number
+        bot_share       = sum(w for ua, w in USER_AGENTS if _is_bot(ua)) / self._ua_cw[-1]
+        self._per_visit = bot_share + (1 - bot_share) / 0.35
+
+        # Diurnal curve: quiet around 04:00 UTC, busiest around 16:00 UTC
+        self._hour_w = [1.0 + 0.8 * math.sin((h - 10) / 24 * 2 * math.pi) for h in range(24)]
+
+    # ── Single events ─────────────────────────────────────────────────────────
+
+    def _pick(self, values, cum_weights):
+        return self.rng.choices(values, cum_weights=cum_weights)[0]
+
+    def site(self):
+        return self._pick(self.sites, self._site_cw)
+
+    def host(self, root):
+        return self._pick(*self._hosts[root])
+
+    def path(self):
+        return self._pick(self.paths, self._path_cw)
+
+    def external_ref(self):
+        return "" if self.rng.random() < 0.5 else self._pick(EXTERNAL_REFS, self._ref_cw)
+
+    def user_agent(self):
+        return self._pick(self._uas, self._ua_cw)
+
+    def width(self, device):
+        return self._pick(*self._widths.get(device or "desktop", self._widths["desktop"]))
+
+    # ── Sessions ──────────────────────────────────────────────────────────────
+
+    def session(self, start_ts):
+        """One visit: a list of hit tuples in db.HIT_COLUMNS order."""
+        rng     = self.rng
+        root    = self.site()
+        host    = self.host(root)
+        ua      = self.user_agent()
+        bot, (device, browser, os_) = self._ua_info[ua]
+        lang    = self._pick(self._langs, self._lang_cw)
+        country = self._pick(self._countries, self._cc_cw)
+        w       = None if bot else self.width(device)
+        sid     = "" if bot else "%016x" % rng.getrandbits(64)
+        ref     = self.external_ref()
+        n       = 1 if bot else 1 + int(math.log(1 - rng.random()) / math.log(0.65))
+        ts      = start_ts
+        rows    = []
+        for _ in range(n):
+            path = self.path()
+            rows.append((ts, host, path, ref, ua, lang, w, sid, country, int(bot),
+                         device, browser, os_))
+            ref = f"https://{host}{path}"
+            ts += min(1800, 1 + int(rng.expovariate(1 / 45)))
+        return rows
+
+    def hits(self, rows):
+        """Yield about `rows` hit tuples spread over the time range, in ts order."""
+        hours     = self.days * 24
+        total_w   = sum(self._hour_w) * self.days
+        pending   = []                # heap of (ts, seq, row) not yet emitted
+        seq       = 0
+        emitted   = 0
+        for h in range(hours):
+            lo     = self.start + h * HOUR
+            target = rows * self._hour_w[(lo // HOUR) % 24] / total_w
+            visits = int(target / self._per_visit + self.rng.random())
+            for _ in range(visits):
+                for row in self.session(lo + self.rng.randrange(HOUR)):
+                    heapq.heappush(pending, (row[0], seq, row))
+                    seq += 1
+            while pending and pending[0][0] < lo + HOUR:
+                row = heapq.heappop(pending)[2]
+                if row[0] >= self.end or emitted >= rows:
+                    continue
+                emitted += 1
+                yield row
+        while pending and emitted < rows:
+            row = heapq.heappop(pending)[2]
+            if row[0] < self.end:
+                emitted += 1
+                yield row
+
+    def beacon(self):
+        """Query string and User-Agent for one /hit request."""
+        ts, site, path, ref, ua, lang, w, sid, *_ = self.session(self.end)[0]
+        params = {"site": site, "path": path, "ref": ref, "lang": lang, "s": sid}
+        if w:
+            params["w"] = str(w)
+        return params, ua
@@ -0,0 +1,106 @@
+"""
+Build a synthetic NanoAnalytics database for benchmarking.
+
+  python -m bench.generate bench/data/1m.db --rows 1m
+  python -m bench.generate bench/data/10m.db --rows 10m --sites 2000 --days 365
+
+The schema comes from create_app(), hits are bulk-loaded in timestamp order,
+then the rollup and sessions tables are rebuilt so the database looks like
+one that was filled through /hit.  --raw-only skips the rebuild and marks the
+aggregates as not covering anything, so every query reads raw hits (useful to
+measure the raw paths, or to load 100M rows quickly).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from nano_analytics import create_app, interning, rollups, sessions
+from nano_analytics.db import HIT_COLUMNS, connect, encode_hits
+
+from .data import Traffic
+
+_INSERT = (
+    f"INSERT INTO hits ({', '.join(map(interning.stored, HIT_COLUMNS))}, root_site) "
+    f"VALUES ({','.join('?' * (len(HIT_COLUMNS) + 1))})"
+)
+_SIZES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_rows(text: str) -> int:
+    """'250k' / '1m' / '100m' / '5000' -> int."""
+    text = text.strip().lower()
+    if text[-1:] in _SIZES:
+        return int(float(text[:-1]) * _SIZES[text[-1]])
+    return int(text)
+
+
+def generate(path, rows, seed=1, sites=200, days=90, raw_only=False, chunk=50_000,
+             echo=print):
+    for suffix in ("", "-wal", "-shm", "-cache", "-flood"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    create_app({"DB_PATH": path, "CACHE_BACKEND": "memory"})
+
+    db = connect(path)
+    db.execute("PRAGMA synchronous=OFF")
+    traffic = Traffic(seed=seed, sites=sites, days=days)
+    started = time.perf_counter()
+    batch, total = [], 0
+    for row in traffic.hits(rows):
+        batch.append(row)
+        if len(batch) >= chunk:
+            total += _load(db, batch)
+            batch = []
+            rate  = total / (time.perf_counter() - started)
+            echo(f"  {total:>12,} hits  ({rate:,.0f}/s)")
+    total += _load(db, batch)
+    echo(f"Loaded {total:,} hits in {time.perf_counter() - started:.1f}s")
+
+    if raw_only:
+        with db:
+            db.execute(
+                "UPDATE meta SET value = 9999999999 "
+                "WHERE key IN ('rollup_since', 'sketch_since', 'sessions_since')"
+            )
+    else:
+        echo("Rebuilding rollups…")
+        rollups.rebuild(db, echo=echo)
+        echo("Rebuilding sessions…")
+        sessions.rebuild(db, chunk=chunk, echo=None)
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+    echo(f"Done: {path} ({os.path.getsize(path) / 1e6:,.0f} MB)")
+    return total
+
+
+def _load(db, batch):
+    if not batch:
+        return 0
+    interner = interning.interner(db)
+    learned  = {}
+    with db:
+        db.executemany(_INSERT, encode_hits(db, batch, interner, learned))
+    interner.learn(learned)
+    return len(batch)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.generate", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("path", help="database file to create (replaced if it exists)")
+    ap.add_argument("--rows",  default="1m", help="number of hits: 1m, 10m, 100m, 250k… (default 1m)")
+    ap.add_argument("--sites", type=int, default=200, help="distinct root domains (default 200)")
+    ap.add_argument("--days",  type=int, default=90, help="days of history ending now (default 90)")
+    ap.add_argument("--seed",  type=int, default=1)
+    ap.add_argument("--raw-only", action="store_true",
+                    help="skip rollup/sessions rebuild; queries read raw hits only")
+    args = ap.parse_args(argv)
+    os.makedirs(os.path.dirname(os.path.abspath(args.path)), exist_ok=True)
+    generate(args.path, parse_rows(args.rows), seed=args.seed, sites=args.sites,
+             days=args.days, raw_only=args.raw_only)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
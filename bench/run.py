@@ -0,0 +1,344 @@
+"""
+Measure /hit throughput and /api/* latency; write the results as JSON.
+
+  python -m bench.run --db bench/data/1m.db --out bench/results/main.json
+  python -m bench.run --db bench/data/1m.db --only api --repeat 30
+  python -m bench.run --only ingest --hits 20000 --workers 4 --concurrency 32
+
+ingest — /hit through the Flask test client (sync and buffered ingest) and
+         through a local gunicorn with concurrent clients, each into a fresh
+         temporary database.  gunicorn runs are skipped if it isn't installed.
+api    — p50/p99 latency of every GET /api/* route against --db, for each
+         range length (1d, 7d, 30d, all — ending at the newest hit) and filter
+         (none, country, path), with the response cache disabled.
+
+Compare two result files with `python -m bench.compare`.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from nano_analytics import create_app
+from nano_analytics.db import connect
+
+from .data import DAY, Traffic
+
+REPO  = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "bench"
+
+RANGES  = {"1d": 1, "7d": 7, "30d": 30, "all": None}
+FILTERS = {
+    "none":    {},
+    "country": {"filter_country": "US"},
+    "path":    {"filter_path": "/blog"},
+}
+# Routes needing parameters, and extra variants worth timing separately
+EXTRA_PARAMS = {
+    "/api/filter-values": [{"field": "path"}],
+    "/api/timeseries":    [{}, {"granularity": "hour"}],
+}
+
+# Ingest settings shared by every ingest run: no flood flagging, so the
+# benchmark exercises the full (non-bot) write path; no response cache file.
+_INGEST_CONFIG = {
+    "FLOOD_MAX_PER_MINUTE": 10**9,
+    "CACHE_BACKEND":        "memory",
+}
+
+
+# ── Statistics ─────────────────────────────────────────────────────────────────
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summarize(samples_ms):
+    return {
+        "n":       len(samples_ms),
+        "p50_ms":  round(percentile(samples_ms, 50), 3),
+        "p99_ms":  round(percentile(samples_ms, 99), 3),
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3),
+        "max_ms":  round(max(samples_ms), 3),
+    }
+
+
+def _stored(path):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT COUNT(*) FROM hits").fetchone()[0]
+    finally:
+        db.close()
+
+
+# ── Ingest ─────────────────────────────────────────────────────────────────────
+
+def bench_test_client(mode, hits, seed):
+    """/hit through the Flask test client, in-process, one request at a time."""
+    traffic  = Traffic(seed=seed)
+    beacons  = [traffic.beacon() for _ in range(hits)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path   = os.path.join(tmp, "ingest.db")
+        app    = create_app({"DB_PATH": path, "INGEST_MODE": mode, **_INGEST_CONFIG})
+        client = app.test_client()
+        writer = app.extensions["hit_writer"]
+        latencies = []
+        started = time.perf_counter()
+        for params, ua in beacons:
+            t0 = time.perf_counter()
+            client.get("/hit", query_string=params, headers={"User-Agent": ua})
+            latencies.append((time.perf_counter() - t0) * 1000)
+        if writer is not None:
+            writer.close()          # buffered rows count only once they are stored
+        elapsed = time.perf_counter() - started
+        return {
+            "hits":       hits,
+            "seconds":    round(elapsed, 3),
+            "hits_per_s": round(hits / elapsed, 1),
+            "stored":     _stored(path),
+            **summarize(latencies),
+        }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port, proc, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def bench_gunicorn(mode, hits, workers, concurrency, seed):
+    """/hit through a local gunicorn, `concurrency` client threads."""
+    if importlib.util.find_spec("gunicorn") is None:
+        return {"skipped": "gunicorn is not installed"}
+    traffic = Traffic(seed=seed)
+    urls    = [(f"/hit?{urlencode(p)}", ua) for p, ua in (traffic.beacon() for _ in range(hits))]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ingest.db")
+        create_app({"DB_PATH": path, **_INGEST_CONFIG})   # schema before workers race for it
+        port = _free_port()
+        env  = {
+            **os.environ,
+            "DB_PATH":              path,
+            "INGEST_MODE":          mode,
+            "API_TOKEN":            TOKEN,
+            "CACHE_BACKEND":        "memory",
+            "FLOOD_MAX_PER_MINUTE": str(10**9),
+        }
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+             "-w", str(workers), "-b", f"127.0.0.1:{port}", "wsgi:app"],
+            cwd=REPO, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_ready(port, proc)
+            latencies, errors = [], 0
+            lock = threading.Lock()
+
+            def send(chunk):
+                nonlocal errors
+                local, failed = [], 0
+                for url, ua in chunk:
+                    t0 = time.perf_counter()
+                    try:
+                        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                        conn.request("GET", url, headers={"User-Agent": ua})
+                        conn.getresponse().read()
+                        conn.close()
+                    except OSError:
+                        failed += 1
+                        continue
+                    local.append((time.perf_counter() - t0) * 1000)
+                with lock:
+                    latencies.extend(local)
+                    errors += failed
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(send, [urls[i::concurrency] for i in range(concurrency)]))
+            elapsed = time.perf_counter() - started
+        finally:
+            proc.send_signal(signal.SIGTERM)   # workers flush buffered hits on exit
+            proc.wait(30)
+        return {
+            "hits":        hits,
+            "workers":     workers,
+            "concurrency": concurrency,
+            "seconds":     round(elapsed, 3),
+            "hits_per_s":  round(hits / elapsed, 1),
+            "errors":      errors,
+            "stored":      _stored(path),
+            **(summarize(latencies) if latencies else {}),
+        }
+
+
+def bench_ingest(args, echo):
+    results = {}
+    for mode in ("sync", "buffered"):
+        echo(f"ingest: test client, {mode}")
+        results[f"test_client_{mode}"] = bench_test_client(mode, args.hits, args.seed)
+        echo(f"ingest: gunicorn ×{args.workers}, {mode}")
+        results[f"gunicorn_{mode}"] = bench_gunicorn(
+            mode, args.hits, args.workers, args.concurrency, args.seed
+        )
+    return results
+
+
+# ── API latency ────────────────────────────────────────────────────────────────
+
+def api_routes(app):
+    """(name, path, params) for every parameterless GET /api/* route."""
+    out = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if not rule.rule.startswith("/api/") or rule.arguments or "GET" not in rule.methods:
+            continue
+        for extra in EXTRA_PARAMS.get(rule.rule, [{}]):
+            name = rule.rule[len("/api/"):]
+            if extra:
+                name += "?" + urlencode(extra)
+            out.append((name, rule.rule, extra))
+    return out
+
+
+def bench_api(args, echo):
+    app = create_app({
+        "DB_PATH":         args.db,
+        "CACHE_BACKEND":   "memory",
+        "CACHE_MAX_BYTES": 0,          # nothing fits: every request is computed
+    })
+    db     = connect(args.db)
+    newest = db.execute("SELECT MAX(ts) FROM hits").fetchone()[0] or int(time.time())
+    db.close()
+    client  = app.test_client()
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    results = {}
+    for name, path, extra in api_routes(app):
+        for range_name, days in RANGES.items():
+            for filter_name, filters in FILTERS.items():
+                params = {"site": args.site, **extra, **filters}
+                if days:
+                    params["start"] = newest - days * DAY
+                    params["end"]   = newest
+                samples, status = [], 200
+                for i in range(args.warmup + args.repeat):
+                    t0   = time.perf_counter()
+                    resp = client.get(path, query_string=params, headers=headers)
+                    ms   = (time.perf_counter() - t0) * 1000
+                    resp.close()
+                    if resp.status_code != 200:
+                        status = resp.status_code
+                    if i >= args.warmup:
+                        samples.append(ms)
+                key = f"{name}|{range_name}|{filter_name}"
+                results[key] = {**summarize(samples), "status": status}
+        row = results[f"{name}|30d|none"]
+        echo(f"api: {name:<32} 30d p50 {row['p50_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms")
+    return results
+
+
+def echo(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+# ── Run ────────────────────────────────────────────────────────────────────────
+
+def _git_revision():
+    try:
+        rev   = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=REPO, capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(args):
+    info = {
+        "revision":    _git_revision(),
+        "started_at":  time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python":      platform.python_version(),
+        "sqlite":      sqlite3.sqlite_version,
+        "platform":    platform.platform(),
+        "cpus":        os.cpu_count(),
+        "args":        vars(args),
+    }
+    if args.db and os.path.exists(args.db):
+        db = sqlite3.connect(args.db)
+        info["dataset"] = {
+            "path":  args.db,
+            "bytes": os.path.getsize(args.db),
+            "hits":  db.execute("SELECT COALESCE(MAX(id), 0) FROM hits").fetchone()[0],
+        }
+        db.close()
+    return info
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", help="dataset from bench.generate (required for api)")
+    ap.add_argument("--out", help="write results JSON here (default: stdout)")
+    ap.add_argument("--only", choices=("ingest", "api"), action="append",
+                    help="run only this part (repeatable)")
+    ap.add_argument("--site", default="site0.com", help="site queried by the api runs")
+    ap.add_argument("--repeat", type=int, default=15, help="timed requests per api case")
+    ap.add_argument("--warmup", type=int, default=2, help="untimed requests per api case")
+    ap.add_argument("--hits", type=int, default=5000, help="/hit requests per ingest run")
+    ap.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    ap.add_argument("--concurrency", type=int, default=8, help="gunicorn client threads")
+    ap.add_argument("--seed", type=int, default=1)
+    args  = ap.parse_args(argv)
+    parts = args.only or ["ingest", "api"]
+    if "api" in parts and not args.db:
+        ap.error("--db is required for the api benchmark")
+
+    os.environ["API_TOKEN"] = TOKEN
+    results = {"meta": environment(args)}
+    if "ingest" in parts:
+        results["ingest"] = bench_ingest(args, echo)
+    if "api" in parts:
+        results["api"] = bench_api(args, echo)
+
+    text = json.dumps(results, indent=1, sort_keys=True)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        echo(f"Wrote {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
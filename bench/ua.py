@@ -0,0 +1,97 @@
+"""
+Check ua_parser.analyze() against the per-pattern reference functions, then
+time both.
+
+  python -m bench.ua
+  python -m bench.ua --fuzz 200000 --seed 7
+
+The corpus is bench.data's user agents plus --fuzz random strings built
+from the fragments the rules look for (in random case, order and
+adjacency: "IEMobile", "HeadlessChrome/120.", "Android … Mobile" and so
+on, plus a few non-ASCII ones that case-fold onto them).  Any disagreement
+is printed and the exit status is 1.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from bench.data import USER_AGENTS
+from nano_analytics import ua_parser
+
+_FRAGMENTS = [
+    "Mozilla/5.0", "(", ")", ";", " ", " ", " ", "/", ".", "1", "Gecko", "KHTML, like Gecko",
+    "iPad", "Tablet", "PlayBook", "Silk", "Android", "Android 14", "Mobile", "Mobi", "IEMobile",
+    "iPhone", "iPod", "BlackBerry", "Opera Mini", "Opera", "OPR/", "Edge/", "Edg/", "Edga",
+    "SamsungBrowser/", "Firefox/", "Chrome", "Chrome/", "Chrome/109.", "Chrome/120.0",
+    "Chrome/x.", "Safari/", "Windows", "Windows NT 6.1", "Windows NT 10.0", "windows nt 6.1",
+    "Macintosh", "Mac OS X", "MacOS", "Linux", "X11", "bot", "Googlebot/2.1", "robot", "crawler",
+    "spider", "Slurp", "HeadlessChrome/120.", "python-requests/2", "curl/8", "Wget", "axios",
+    "node-fetch", "Go-http-client/1.1", "Java/17", "libwww-perl", "okhttp/4", "Scrapy",
+    "\u0130Pad", "o\u212ahttp", "\u017fpider", "Caf\u00e9",   # İ, Kelvin sign, long s: case folding
+]
+
+
+def reference(ua):
+    """(device, browser, os, bot) from the original one-regex-per-rule functions."""
+    return (ua_parser.device_type(ua), ua_parser.browser_name(ua), ua_parser.os_name(ua),
+            ua_parser.is_bot(ua))
+
+
+def corpus(fuzz, seed):
+    rng = random.Random(seed)
+    uas = [ua for ua, _w in USER_AGENTS] + ["", None]
+    for _ in range(fuzz):
+        parts = rng.choices(_FRAGMENTS, k=rng.randint(1, 12))
+        if rng.random() < 0.3:
+            parts = [p.upper() if rng.random() < 0.5 else p.lower() for p in parts]
+        uas.append("".join(parts))
+    return uas
+
+
+def _best(fn, uas, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for ua in uas:
+            fn(ua)
+        best = min(best, time.perf_counter() - t)
+    return best / len(uas) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check and time the single-pass UA classifier")
+    parser.add_argument("--fuzz",   type=int, default=100_000, help="random UAs added to the corpus")
+    parser.add_argument("--seed",   type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    uas = corpus(args.fuzz, args.seed)
+    bad = 0
+    for ua in uas:
+        want, got = reference(ua), ua_parser.analyze(ua)
+        if want != got:
+            bad += 1
+            if bad <= 20:
+                print(f"MISMATCH {ua!r}: reference {want}, analyze {got}")
+    print(f"correctness: {len(uas) - bad:,}/{len(uas):,} agree")
+
+    # Uncached (analyze.__wrapped__) on the fuzz corpus and on real UAs, then cached
+    real   = [ua for ua, _w in USER_AGENTS]
+    fuzz   = uas[:20_000]
+    single = ua_parser.analyze.__wrapped__
+    print(f"fuzz, per UA    reference {_best(reference, fuzz, args.repeat):6.2f} µs   "
+          f"analyze {_best(single, fuzz, args.repeat):6.2f} µs")
+    print(f"real UAs        reference {_best(reference, real * 100, args.repeat):6.2f} µs   "
+          f"analyze {_best(single, real * 100, args.repeat):6.2f} µs")
+    ua_parser.analyze.cache_clear()
+    print(f"cached          analyze {_best(ua_parser.analyze, real * 100, args.repeat):6.2f} µs")
+    t = time.perf_counter()
+    ua_parser.analyze_many(fuzz)
+    print(f"analyze_many    {len(set(fuzz)):,} distinct UAs in {(time.perf_counter() - t) * 1000:.1f} ms")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
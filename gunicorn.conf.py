@@ -1,4 +1,6 @@
+import gc
 import logging
+import os
 
 
 class _FilterActive(logging.Filter):
@@ -9,3 +11,23 @@ class _FilterActive(logging.Filter):
 
 # Suppress noisy polling endpoint from access logs
 logging.getLogger("gunicorn.access").addFilter(_FilterActive())
+
+# Threads per worker (gunicorn switches to the gthread worker when > 1): the
+# dashboard's /api/live event stream stays open for minutes, and with one
+# thread per worker each open dashboard would hold a whole worker.
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+
+def on_starting(server):
+    # Load the GeoIP database once in the master: forked workers share its
+    # pages instead of each loading a copy.  gc.freeze() keeps the collector
+    # from touching (and so copying) those objects in the workers.
+    from nano_analytics import geo
+    geo.resolver.load()
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # Flush hits still buffered by the write-behind ingest writer
+    from nano_analytics import ingest
+    ingest.shutdown()
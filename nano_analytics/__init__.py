@@ -2,6 +2,13 @@ import os
 from flask import Flask
 from .db import init_db, close_db
 from .routes import bp
+from .ingest import writer_from_config
+from .cache import cache_from_config
+from .flood import flood_from_config
+from .live import live_from_config
+from .maintenance import maintenance_from_config
+from .metrics import metrics_from_config
+from . import commands, geo
 
 
 def create_app(config=None):
@@ -15,11 +22,85 @@ def create_app(config=None):
     app.config["DB_PATH"]  = os.environ.get("DB_PATH", "/data/analytics.db")
     app.config["BASE_URL"] = os.environ.get("BASE_URL", "")
 
+    # Connection pool (per worker) and read tuning for pooled connections
+    app.config["DB_POOL_SIZE"]       = int(os.environ.get("DB_POOL_SIZE", 4))
+    app.config["DB_POOL_TIMEOUT"]    = float(os.environ.get("DB_POOL_TIMEOUT", 2.0))
+    app.config["DB_MMAP_SIZE"]       = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+    app.config["DB_CACHE_KB"]        = int(os.environ.get("DB_CACHE_KB", 16000))
+    app.config["DB_STATEMENT_CACHE"] = int(os.environ.get("DB_STATEMENT_CACHE", 256))
+
+    # Ingest: "sync" commits every hit; "buffered" batches them in a background writer
+    app.config["INGEST_MODE"]           = os.environ.get("INGEST_MODE", "sync")
+    app.config["INGEST_BATCH_SIZE"]     = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+    app.config["INGEST_FLUSH_MS"]       = int(os.environ.get("INGEST_FLUSH_MS", 250))
+    app.config["INGEST_QUEUE_SIZE"]     = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+    app.config["INGEST_PUT_TIMEOUT_MS"] = int(os.environ.get("INGEST_PUT_TIMEOUT_MS", 50))
+    # Standalone asyncio ingest server for /hit and /a.js (python -m nano_analytics.ingest_server)
+    app.config["INGEST_SERVER_HOST"]    = os.environ.get("INGEST_SERVER_HOST", "0.0.0.0")
+    app.config["INGEST_SERVER_PORT"]    = int(os.environ.get("INGEST_SERVER_PORT", 8001))
+
+    # Response cache: "sqlite" (shared by all workers, next to DB_PATH) or "memory"
+    app.config["CACHE_BACKEND"]   = os.environ.get("CACHE_BACKEND", "sqlite")
+    app.config["CACHE_PATH"]      = os.environ.get("CACHE_PATH", "")
+    app.config["CACHE_MAX_BYTES"] = int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    # Timeseries / peak hours: cache closed UTC days separately, compute only the rest
+    app.config["BUCKET_CACHE"]    = os.environ.get("BUCKET_CACHE", "1") == "1"
+
+    # Flood detection: hits/minute per site (instance-wide) before hits count as bot
+    app.config["FLOOD_MAX_PER_MINUTE"] = int(os.environ.get("FLOOD_MAX_PER_MINUTE", 300))
+    app.config["FLOOD_SLOTS"]          = int(os.environ.get("FLOOD_SLOTS", 4096))
+    app.config["FLOOD_PATH"]           = os.environ.get("FLOOD_PATH", "")
+
+    # GeoIP: LRU of countries per worker, keyed by /24 (IPv4) or /48 (IPv6); 0 = per address
+    app.config["GEO_CACHE_SIZE"]   = int(os.environ.get("GEO_CACHE_SIZE", 65536))
+    app.config["GEO_CACHE_PREFIX"] = os.environ.get("GEO_CACHE_PREFIX", "1")
+
+    # Storage: "monthly" moves closed months into per-month files; "none" keeps one file
+    app.config["PARTITIONS"]           = os.environ.get("PARTITIONS", "monthly")
+    app.config["PARTITION_MMAP_SIZE"]  = int(os.environ.get("PARTITION_MMAP_SIZE", 1024 * 1024 * 1024))
+    app.config["MAINTENANCE_INTERVAL"] = int(os.environ.get("MAINTENANCE_INTERVAL", 3600))
+    # Raw-hit retention in days (0 = forever) and per-site overrides ("site=days,...")
+    app.config["RETENTION_DAYS"]       = int(os.environ.get("RETENTION_DAYS", 0))
+    app.config["RETENTION_SITES"]      = os.environ.get("RETENTION_SITES", "")
+    # Columnar copies of closed months, scanned with NumPy (needs the "archive" extra)
+    app.config["COLUMNAR_ARCHIVES"]    = os.environ.get("COLUMNAR_ARCHIVES", "1") == "1"
+
+    # Live view (/api/active, /api/live): shared session table next to DB_PATH, and
+    # seconds per event stream before the dashboard reconnects
+    app.config["LIVE_PATH"]           = os.environ.get("LIVE_PATH", "")
+    app.config["LIVE_SLOTS"]          = int(os.environ.get("LIVE_SLOTS", 65536))
+    app.config["LIVE_STREAM_SECONDS"] = float(os.environ.get("LIVE_STREAM_SECONDS", 300))
+
+    # /api/export: rows per page, and seconds per response (keep under gunicorn's --timeout)
+    app.config["EXPORT_CHUNK_ROWS"]  = int(os.environ.get("EXPORT_CHUNK_ROWS", 5000))
+    app.config["EXPORT_MAX_SECONDS"] = float(os.environ.get("EXPORT_MAX_SECONDS", 20))
+
+    # /metrics: request timings and counters shared by all workers, next to DB_PATH
+    app.config["METRICS"]      = os.environ.get("METRICS", "1") == "1"
+    app.config["METRICS_PATH"] = os.environ.get("METRICS_PATH", "")
+
     if config:
         app.config.update(config)
 
     app.teardown_appcontext(close_db)
     app.register_blueprint(bp)
+    commands.register(app)
     init_db(app)
+    app.extensions["hit_writer"] = writer_from_config(app.config)
+    app.extensions["response_cache"] = cache_from_config(app.config)
+    app.extensions["flood"] = flood_from_config(app.config)
+    app.extensions["live"]  = live_from_config(app.config)
+    app.extensions["geo"]   = geo.configure(app.config)
+
+    metrics = metrics_from_config(app.config, [r.endpoint for r in app.url_map.iter_rules()])
+    app.extensions["metrics"] = metrics
+    if metrics is not None:
+        metrics.install(app)
+
+    maintenance = maintenance_from_config(app.config)
+    app.extensions["maintenance"] = maintenance
+    if maintenance is not None:
+        # First, so reads answered 503 during a pending migration still start it
+        app.before_request_funcs.setdefault(None, []).insert(0, maintenance.ensure_started)
 
     return app
@@ -0,0 +1,96 @@
+import time
+
+# Per-day result cache for bucketed panels (/api/timeseries, /api/peak-hours).
+#
+# cache_response caches whole responses, and any range that includes today
+# expires after two minutes, so a year-long daily chart used to be recomputed
+# in full every two minutes although only its last bucket could still change.
+# Bucketed panels instead cache their rows per UTC day, under a key naming
+# the site, filters and granularity.  A request for [start, end] is split into
+#
+#   head   the part of the first day before the first whole day — computed
+#   days   whole closed days — read from the cache; the missing ones are
+#          computed, one query per contiguous run, and stored
+#   tail   the days not closed yet, up to `end` — computed
+#
+# so a warm request costs about as much as a one-day query whatever its
+# length.  A day is closed once it ended SETTLE seconds ago: /hit/batch
+# accepts events up to an hour old and the buffered writer commits late, so
+# rows for a just-ended day may still arrive.  Buckets are UTC-aligned and no
+# coarser than a day, so every bucket falls wholly in one part and a day's
+# rows never change once closed — unless history is rewritten: importing
+# logs, rebuilding rollups, reclassifying bots or deleting raw hits for
+# retention call invalidate(), which bumps the generation that every key
+# includes (meta table, see rollups.SCHEMA), so all workers stop reading the
+# old entries at once; they age out of the cache's LRU.
+
+DAY    = 86400
+SETTLE = 2 * 3600   # seconds after its end before a day is cached
+TTL    = 7 * DAY    # per-day entries; bounded by the cache's byte budget anyway
+
+_GENERATION = "bucket_generation"
+
+
+def generation(db) -> int:
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (_GENERATION,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def invalidate(db):
+    """Forget every cached day: call after changing hits that are not recent."""
+    with db:
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, 1) "
+            "ON CONFLICT (key) DO UPDATE SET value = value + 1",
+            (_GENERATION,),
+        )
+
+
+def day_label(day) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(day))
+
+
+def assemble(cache, key, start, end, compute, label, now=None, settle=SETTLE, ttl=TTL):
+    """Rows for ts in [start, end] (end None: no upper bound), bucket order.
+
+    compute(lo, hi) returns the rows for ts in [lo, hi] in bucket order;
+    label(row) is the row's bucket label, starting with its '%Y-%m-%d' day.
+    `key` identifies everything but the range: site, filters, granularity
+    and generation.
+    """
+    now   = int(now or time.time())
+    first = -(-start // DAY) * DAY                       # first whole day
+    stop  = (now - settle) // DAY * DAY                  # days before this one are closed
+    if end is not None:
+        stop = min(stop, (end + 1) // DAY * DAY)         # end is inclusive
+    if stop <= first:
+        return compute(start, end)
+
+    days = range(first, stop, DAY)
+    keys = [f"{key}:{day_label(d)}" for d in days]
+    got  = cache.get_many(keys)
+    rows = compute(start, first - 1) if start < first else []
+    run  = []   # contiguous days missing from the cache
+    for d, k in zip(days, keys):
+        if k not in got:
+            run.append(d)
+            continue
+        if run:
+            rows += _fill(cache, key, run, compute, label, ttl)
+            run   = []
+        rows += got[k]
+    if run:
+        rows += _fill(cache, key, run, compute, label, ttl)
+    if end is None or stop <= end:
+        rows += compute(stop, end)
+    return rows
+
+
+def _fill(cache, key, days, compute, label, ttl):
+    """Compute a run of missing days in one query and cache each day's rows."""
+    rows   = compute(days[0], days[-1] + DAY - 1)
+    by_day = {day_label(d): [] for d in days}
+    for row in rows:
+        by_day[label(row)[:10]].append(row)
+    cache.set_many({f"{key}:{day}": day_rows for day, day_rows in by_day.items()}, ttl)
+    return rows
@@ -0,0 +1,302 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Response cache backends used by routes.cache_response.
+#
+# SQLiteCache (default) lives in a side database next to DB_PATH, so every
+# gunicorn worker reads and fills the same cache.  MemoryCache is the
+# per-process fallback.  Both are bounded by the total size of the cached
+# JSON payloads, evict least-recently-used entries first, honour a per-entry
+# TTL, and count hits, misses and evictions.  get_many/set_many serve the
+# per-day entries of buckets.py, hundreds per request, in one round trip.
+
+class MemoryCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[float, int, object]] = OrderedDict()
+        self._bytes = 0
+        self._lock  = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() >= entry[0]:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl):
+        size = len(json.dumps(value, separators=(",", ":")))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.time() + ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_many(self, keys) -> dict:
+        """{key: value} for the keys present and unexpired."""
+        out = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                out[key] = value
+        return out
+
+    def set_many(self, items: dict, ttl):
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend":   "memory",
+            "entries":   len(self._entries),
+            "bytes":     self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_CACHE_SCHEMA = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS cache (
+    key     TEXT PRIMARY KEY,
+    expires REAL    NOT NULL,
+    used    REAL    NOT NULL,
+    size    INTEGER NOT NULL,
+    value   BLOB    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_used    ON cache(used);
+CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    n    INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO counters (name) VALUES ('hits'), ('misses'), ('evictions');
+INSERT OR IGNORE INTO counters (name, n) SELECT 'bytes', COALESCE(SUM(size), 0) FROM cache;
+"""
+
+_BUMP  = "UPDATE counters SET n = n + ? WHERE name = ?"
+_MANY  = 500   # keys per IN (...) list, under SQLite's bound-parameter limit
+_EVICT = 64    # LRU victims read per query
+TOUCH  = 60    # seconds: reads leave `used` alone for entries read more recently
+FLUSH  = 5     # seconds between writes of a worker's hit/miss counts on reads alone
+
+
+class SQLiteCache:
+    """Cross-worker cache in a side SQLite database (no server needed).
+
+    Cached data is disposable, so the file runs with synchronous=OFF; a crash
+    can at worst lose recent entries.  Reads only write to the file when an
+    entry's recency is more than TOUCH seconds old, it expired, or this
+    worker's hit/miss counts are due (FLUSH), so warm reads from all workers
+    do not queue on the write lock.  The total payload size is kept in the
+    counters table ('bytes'), so a set never sums the whole cache.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self._local    = threading.local()
+        self._counts   = {"hits": 0, "misses": 0}   # not yet written to counters
+        self._flushed  = time.monotonic()
+        self._lock     = threading.Lock()
+        db = self._conn()
+        db.executescript(_CACHE_SCHEMA)
+
+    def _conn(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _count(self, hits, misses):
+        """Add to this worker's counts; True when they are due to be written."""
+        with self._lock:
+            self._counts["hits"]   += hits
+            self._counts["misses"] += misses
+            return time.monotonic() - self._flushed >= FLUSH
+
+    def _take_counts(self):
+        """Swap out the pending counts; the caller writes or restores them."""
+        with self._lock:
+            counts, self._counts = self._counts, {"hits": 0, "misses": 0}
+            self._flushed = time.monotonic()
+        return counts
+
+    def _restore_counts(self, counts):
+        with self._lock:
+            for name, n in counts.items():
+                self._counts[name] += n
+
+    def _write(self, db, fn):
+        """Run fn(db) in a write transaction, with the pending counts."""
+        taken = None
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            fn(db)
+            taken = self._take_counts()
+            db.executemany(_BUMP, [(n, name) for name, n in taken.items() if n])
+            db.execute("COMMIT")
+            return True
+        except sqlite3.Error:
+            _rollback(db)
+            if taken:
+                self._restore_counts(taken)   # only what left self._counts
+            return False
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys) -> dict:
+        """{key: value} for the keys present and unexpired; one hit or miss counted per key.
+
+        Recency is only refreshed for entries not used in the last TOUCH
+        seconds, so repeated reads of the same keys write little.
+        """
+        db  = self._conn()
+        now = time.time()
+        found, stale, expired = {}, [], []
+        try:
+            for i in range(0, len(keys), _MANY):
+                part = keys[i:i + _MANY]
+                for key, value, expires, used in db.execute(
+                    f"SELECT key, value, expires, used FROM cache "
+                    f"WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ):
+                    if now >= expires:
+                        expired.append(key)
+                        continue
+                    found[key] = value
+                    if used < now - TOUCH:
+                        stale.append((now, key))
+        except sqlite3.Error:
+            return {}
+        due = self._count(len(found), len(keys) - len(found))
+        if stale or expired or due:
+            def write(db):
+                db.executemany("UPDATE cache SET used = ? WHERE key = ?", stale)
+                _delete(db, expired, now)
+            self._write(db, write)
+        if not found:
+            return {}
+        # One parse for all values
+        values = json.loads(b"[" + b",".join(found.values()) + b"]")
+        return dict(zip(found, values))
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: dict, ttl):
+        now   = time.time()
+        blobs = {}
+        for key, value in items.items():
+            blob = json.dumps(value, separators=(",", ":")).encode()
+            if len(blob) <= self.max_bytes:
+                blobs[key] = blob
+        if not blobs:
+            return
+
+        def write(db):
+            keys = list(blobs)
+            _delete(db, keys, None)   # replaced entries: their size leaves the total
+            db.executemany(
+                "INSERT INTO cache (key, expires, used, size, value) VALUES (?,?,?,?,?)",
+                [(key, now + ttl, now, len(blob), blob) for key, blob in blobs.items()],
+            )
+            db.execute(_BUMP, (sum(map(len, blobs.values())), "bytes"))
+            expired = [r[0] for r in db.execute("SELECT key FROM cache WHERE expires <= ?", (now,))]
+            _delete(db, expired, None)
+            total   = db.execute("SELECT n FROM counters WHERE name = 'bytes'").fetchone()[0]
+            evicted = 0
+            while total > self.max_bytes:
+                # Least recently used first, a few at a time, until back under the budget
+                victims = [
+                    (key, size) for key, size in db.execute(
+                        "SELECT key, size FROM cache ORDER BY used LIMIT ?", (_EVICT + len(blobs),)
+                    ) if key not in blobs
+                ]
+                if not victims:
+                    break
+                for key, size in victims:
+                    if total <= self.max_bytes:
+                        break
+                    db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    db.execute(_BUMP, (-size, "bytes"))
+                    evicted += 1
+                    total   -= size
+            if evicted:
+                db.execute(_BUMP, (evicted, "evictions"))
+
+        self._write(self._conn(), write)
+
+    def clear(self):
+        def write(db):
+            db.execute("DELETE FROM cache")
+            db.execute("UPDATE counters SET n = 0 WHERE name = 'bytes'")
+        self._write(self._conn(), write)
+
+    def stats(self) -> dict:
+        db = self._conn()
+        self._write(db, lambda db: None)   # this worker's pending counts
+        entries  = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        counters = dict(db.execute("SELECT name, n FROM counters").fetchall())
+        return {
+            "backend":   "sqlite",
+            "entries":   entries,
+            "bytes":     counters.pop("bytes"),
+            "max_bytes": self.max_bytes,
+            **counters,
+        }
+
+
+def _delete(db, keys, now):
+    """Delete `keys` (only if expired by `now`, unless None), keeping the byte total."""
+    for i in range(0, len(keys), _MANY):
+        part  = keys[i:i + _MANY]
+        where = f"key IN ({','.join('?' * len(part))})"
+        if now is not None:
+            where, part = f"{where} AND expires <= ?", [*part, now]
+        size  = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM cache WHERE {where}", part).fetchone()[0]
+        if size:
+            db.execute(f"DELETE FROM cache WHERE {where}", part)
+            db.execute(_BUMP, (-size, "bytes"))
+
+
+def _rollback(db):
+    if db.in_transaction:
+        db.execute("ROLLBACK")
+
+
+def cache_from_config(config):
+    max_bytes = int(config.get("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    if config.get("CACHE_BACKEND", "sqlite") == "memory":
+        return MemoryCache(max_bytes)
+    path = config.get("CACHE_PATH") or f"{config['DB_PATH']}-cache"
+    return SQLiteCache(path, max_bytes)
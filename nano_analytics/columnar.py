@@ -0,0 +1,450 @@
+import json
+import os
+import re
+import sqlite3
+import struct
+import time
+from pathlib import Path
+
+# Optional vectorized engine — NumPy is only needed for columnar archives
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import interning
+from .ua_parser import classify
+
+# Columnar copies of closed monthly partitions, scanned with NumPy.
+#
+# Once a partition is 'ready', build() writes analytics-2026-09.cols next to
+# analytics-2026-09.db: rows sorted by (root_site, ts) so a site is one
+# contiguous segment and a time range a slice of it, then one block per
+# column:
+#
+#   ts                     delta-encoded per site segment (first value
+#                          relative to the month start), each segment in the
+#                          narrowest unsigned dtype its gaps fit
+#   site path ref ua lang  dictionary-encoded: uint8/16/32 codes into a
+#   session country        per-column dictionary, code 0 = NULL
+#   device browser os
+#   bot, w                 bit-packed, w as w+1 in max(w).bit_length()+1 bits
+#
+# Files are memory-mapped read-only; a Scan touches only the pages of the
+# requested site and range.  Queries over archived months get partial
+# aggregates from Scan and merge them with SQL over everything else (main,
+# months without an archive), as they already do with rollup rows.  The
+# SQLite partition stays the source of truth: session panels and ad-hoc SQL
+# read it, and an archive is only used while its max_id matches the
+# partition's (appending late rows clears it until it is rebuilt).
+#
+# Layout: 64-byte prefix (magic, header offset, header length), 64-byte
+# aligned blocks, JSON header last.
+
+MAGIC   = b"NACOLS01"
+_PREFIX = struct.Struct("<8sQQ")
+_ALIGN  = 64
+_CHUNK  = 65536   # rows per write; a multiple of 8 keeps bit-packed chunks byte-aligned
+
+DICT_COLUMNS = ("site", "path", "ref", "ua", "lang", "session", "country",
+                "device", "browser", "os")
+
+
+def available() -> bool:
+    return np is not None
+
+
+def path_for(part_path: str) -> str:
+    return os.path.splitext(part_path)[0] + ".cols"
+
+
+def _code_dtype(n):
+    return np.uint8 if n <= 1 << 8 else np.uint16 if n <= 1 << 16 else np.uint32
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+# ── Bit packing ────────────────────────────────────────────────────────────────
+
+def _shifts(nbits):
+    return np.arange(nbits - 1, -1, -1, dtype=np.uint64)
+
+
+def _pack(values, nbits):
+    """Pack unsigned ints into consecutive nbits-wide fields, most significant bit first."""
+    bits = (values.astype(np.uint64)[:, None] >> _shifts(nbits)) & 1
+    return np.packbits(bits.astype(np.uint8).ravel())
+
+
+def _unpack(buf, nbits, a, b):
+    """Fields a..b-1 of a buffer written by _pack()."""
+    lo, hi = a * nbits, b * nbits
+    bits = np.unpackbits(buf[lo // 8:(hi + 7) // 8])[lo % 8:lo % 8 + hi - lo]
+    return bits.reshape(-1, nbits).astype(np.uint64) @ (np.uint64(1) << _shifts(nbits))
+
+
+# ── Building ───────────────────────────────────────────────────────────────────
+
+def build(part_path, out_path, lo, max_id, main_path):
+    """Write the columnar archive of one partition file; returns the row count.
+
+    Interned columns are stored as text: their labels are read from the main
+    database at `main_path`.
+    """
+    src = sqlite3.connect(Path(part_path).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        src.execute("ATTACH DATABASE ? AS labels", (Path(main_path).resolve().as_uri() + "?mode=ro",))
+        return _build(src, out_path, lo, max_id)
+    finally:
+        src.close()
+
+
+def _build(src, out_path, lo, max_id):
+    # Pass 1: dictionaries, and per site: row count and largest ts gap.
+    # keys[col] are the stored values (ids for interned columns) behind dicts[col].
+    dicts, keys = {}, {}
+    for col in DICT_COLUMNS:
+        key = interning.stored(col)
+        if col in interning.COLUMNS:
+            found = src.execute(
+                f"SELECT id, value FROM labels.{interning.COLUMNS[col]} "
+                f"WHERE id IN (SELECT DISTINCT {key} FROM hits)"
+            ).fetchall()
+        else:
+            found = [(v, v) for v, in src.execute(f"SELECT DISTINCT {key} FROM hits WHERE {key} IS NOT NULL")]
+        keys[col]  = [None] + [k for k, _ in found]
+        dicts[col] = [None] + [v for _, v in found]
+    segments = src.execute(
+        "SELECT root_site, COUNT(*), MAX(d) FROM ("
+        "  SELECT root_site, ts - LAG(ts, 1, ?) OVER (PARTITION BY root_site ORDER BY ts, id) AS d"
+        "  FROM hits"
+        ") GROUP BY root_site ORDER BY root_site",
+        (lo,),
+    ).fetchall()
+    rows   = sum(n for _, n, _ in segments)
+    w_max  = src.execute("SELECT MAX(w) FROM hits WHERE w >= 0").fetchone()[0] or 0
+    w_bits = (w_max + 1).bit_length()
+
+    # Layout: dictionaries, then ts segments, code columns and bit columns
+    header = {"version": 1, "lo": lo, "max_id": max_id, "rows": rows,
+              "segments": [], "columns": {}}
+    blobs  = {}
+    offset = _ALIGN
+    for col, values in dicts.items():
+        data = [b""] + [str(v).encode() for v in values[1:]]
+        ends = np.cumsum([len(d) for d in data], dtype=np.uint64)
+        blobs[col] = (ends.tobytes(), b"".join(data))
+        header["columns"][col] = {
+            "enc": "dict", "dtype": np.dtype(_code_dtype(len(values))).str,
+            "dict_count": len(values), "dict_ends": offset,
+            "dict_blob": _aligned(offset + len(blobs[col][0])),
+        }
+        offset = _aligned(header["columns"][col]["dict_blob"] + len(blobs[col][1]))
+    start = 0
+    for root, n, max_gap in segments:
+        dtype = np.dtype(_code_dtype(int(max_gap) + 1)).str
+        header["segments"].append([root, start, start + n, offset, dtype])
+        offset = _aligned(offset + n * np.dtype(dtype).itemsize)
+        start += n
+    for col in DICT_COLUMNS:
+        header["columns"][col]["offset"] = offset
+        offset = _aligned(offset + rows * np.dtype(header["columns"][col]["dtype"]).itemsize)
+    for col, nbits in (("bot", 1), ("w", w_bits)):
+        header["columns"][col] = {"enc": "bits", "bits": nbits, "offset": offset}
+        offset = _aligned(offset + (rows * nbits + 7) // 8)
+
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.truncate(offset)
+        for col, (ends, blob) in blobs.items():
+            f.seek(header["columns"][col]["dict_ends"]); f.write(ends)
+            f.seek(header["columns"][col]["dict_blob"]); f.write(blob)
+        # Pass 2: stream rows in (root_site, ts) order and write each column's slice
+        codes    = {col: {k: i for i, k in enumerate(values)} for col, values in keys.items()}
+        seg_idx  = {root: i for i, (root, *_) in enumerate(segments)}
+        seg_meta = header["segments"]
+        prev_seg, prev_ts, pos = -1, 0, 0
+        cur = src.execute(
+            f"SELECT root_site, ts, bot, w, {', '.join(map(interning.stored, DICT_COLUMNS))} FROM hits "
+            f"ORDER BY root_site, ts, id"
+        )
+        while True:
+            chunk = cur.fetchmany(_CHUNK)
+            if not chunk:
+                break
+            n    = len(chunk)
+            cols = list(zip(*chunk))
+            seg  = np.fromiter((seg_idx[r] for r in cols[0]), np.int64, n)
+            ts   = np.fromiter(cols[1], np.int64, n)
+            prev = np.concatenate(([prev_seg], seg[:-1]))
+            last = np.concatenate(([prev_ts], ts[:-1]))
+            delta = np.where(seg != prev, ts - lo, ts - last)
+            for s in np.unique(seg):
+                _, s_start, _, s_off, s_dtype = seg_meta[s]
+                sel = np.flatnonzero(seg == s)
+                f.seek(s_off + (pos + sel[0] - s_start) * np.dtype(s_dtype).itemsize)
+                f.write(delta[sel].astype(s_dtype).tobytes())
+            for i, col in enumerate(DICT_COLUMNS, start=4):
+                meta = header["columns"][col]
+                f.seek(meta["offset"] + pos * np.dtype(meta["dtype"]).itemsize)
+                lookup = codes[col]
+                f.write(np.fromiter((lookup[v] for v in cols[i]), meta["dtype"], n).tobytes())
+            bot = np.fromiter((1 if b else 0 for b in cols[2]), np.uint64, n)
+            w   = np.fromiter((v + 1 if v is not None and v >= 0 else 0 for v in cols[3]), np.uint64, n)
+            for col, values in (("bot", bot), ("w", w)):
+                meta = header["columns"][col]
+                f.seek(meta["offset"] + pos * meta["bits"] // 8)
+                f.write(_pack(values, meta["bits"]).tobytes())
+            prev_seg, prev_ts, pos = int(seg[-1]), int(ts[-1]), pos + n
+
+        data = json.dumps(header).encode()
+        f.seek(offset); f.write(data)
+        f.seek(0);      f.write(_PREFIX.pack(MAGIC, offset, len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, out_path)
+    return rows
+
+
+def build_missing(db, force=False, echo=None):
+    """Build archives for ready partitions lacking an up-to-date one; returns how many."""
+    if np is None:
+        return 0
+    where = "state = 'ready'" + ("" if force else " AND cols IS NULL")
+    main  = db.execute("SELECT file FROM pragma_database_list WHERE name = 'main'").fetchone()[0]
+    built = 0
+    for part in db.execute(f"SELECT * FROM partitions WHERE {where} ORDER BY month").fetchall():
+        out = path_for(part["path"])
+        n   = build(part["path"], out, part["lo"], part["max_id"], main)
+        with db:
+            # Skip if rotation appended to the partition meanwhile; next run rebuilds it
+            db.execute(
+                "UPDATE partitions SET cols = ? WHERE month = ? AND max_id = ? AND state = 'ready'",
+                (out, part["month"], part["max_id"]),
+            )
+        built += 1
+        if echo:
+            echo(f"  {part['month']}: {n} rows")
+    return built
+
+
+# ── Reading ────────────────────────────────────────────────────────────────────
+
+class Dictionary:
+    def __init__(self, mm, meta):
+        self.count = meta["dict_count"]
+        self._ends = mm[meta["dict_ends"]:meta["dict_ends"] + self.count * 8].view(np.uint64)
+        self._blob = mm[meta["dict_blob"]:meta["dict_blob"] + int(self._ends[-1])]
+        self._all  = None
+
+    def value(self, code):
+        if code == 0:
+            return None
+        a, b = int(self._ends[code - 1]), int(self._ends[code])
+        return self._blob[a:b].tobytes().decode()
+
+    def values(self):
+        """Every entry, decoded once and kept (for predicates over the dictionary)."""
+        if self._all is None:
+            blob = self._blob.tobytes()
+            ends = self._ends.tolist()
+            self._all = [None] + [blob[ends[i - 1]:ends[i]].decode() for i in range(1, self.count)]
+        return self._all
+
+
+class Archive:
+    def __init__(self, path):
+        self.path = path
+        self.mm   = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, off, length = _PREFIX.unpack(self.mm[:_PREFIX.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a columnar archive")
+        self.header   = json.loads(self.mm[off:off + length].tobytes())
+        self.lo       = self.header["lo"]
+        self.max_id   = self.header["max_id"]
+        self.segments = {root: (a, b, o, dt) for root, a, b, o, dt in self.header["segments"]}
+        self._dicts   = {}
+        self._matches = {}
+
+    def segment(self, root):
+        """(start, stop) rows of a root site, or None."""
+        seg = self.segments.get(root)
+        return seg[:2] if seg else None
+
+    def ts(self, root):
+        a, b, off, dtype = self.segments[root]
+        deltas = self.mm[off:off + (b - a) * np.dtype(dtype).itemsize].view(dtype)
+        return np.cumsum(deltas, dtype=np.int64) + self.lo
+
+    def codes(self, col, a, b):
+        meta = self.header["columns"][col]
+        size = np.dtype(meta["dtype"]).itemsize
+        return self.mm[meta["offset"] + a * size:meta["offset"] + b * size].view(meta["dtype"])
+
+    def bits(self, col, a, b):
+        meta = self.header["columns"][col]
+        return _unpack(self.mm[meta["offset"]:], meta["bits"], a, b)
+
+    def dictionary(self, col):
+        if col not in self._dicts:
+            self._dicts[col] = Dictionary(self.mm, self.header["columns"][col])
+        return self._dicts[col]
+
+    def matches(self, col, op, value):
+        """Boolean array over the dictionary of `col`: which codes satisfy the condition.
+
+        op is "=", "LIKE", or "host" (value or any subdomain of it).
+        """
+        key = (col, op, value)
+        if key not in self._matches:
+            if op == "host":
+                on_sub = like(f"%.{value}")
+                pred   = lambda v: v == value or on_sub(v)
+            elif op == "LIKE":
+                pred = like(value)
+            else:
+                pred = lambda v: v == value
+            values = self.dictionary(col).values()
+            if len(self._matches) >= 256:
+                self._matches.clear()
+            self._matches[key] = np.fromiter((pred(v) for v in values), bool, len(values))
+        return self._matches[key]
+
+
+_archives: dict[str, tuple] = {}
+
+
+def open_archive(path):
+    """Per-process cache of open archives, reopened when the file is replaced."""
+    st  = os.stat(path)
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    hit = _archives.get(path)
+    if hit is None or hit[0] != key:
+        hit = _archives[path] = (key, Archive(path))
+    return hit[1]
+
+
+# ── Scanning ───────────────────────────────────────────────────────────────────
+
+def like(pattern):
+    """Predicate with SQLite LIKE semantics (ASCII-only case folding, % and _)."""
+    rx = "".join(
+        ".*" if p == "%" else "." if p == "_" else re.escape(p)
+        for p in re.split(r"([%_])", pattern)
+    )
+    match = re.compile(rx, re.IGNORECASE | re.ASCII | re.DOTALL).fullmatch
+    return lambda v: v is not None and match(str(v)) is not None
+
+
+class Scan:
+    """Rows of one archive matching a stats request, as a boolean mask over a segment slice.
+
+    Mirrors routes._where(): root_site = root AND (site = host OR site LIKE
+    '%.host') AND bot = 0 AND start <= ts <= end AND each (col, op, value)
+    filter, op being "=" or "LIKE".
+    """
+
+    def __init__(self, archive, month, root, host, start=None, end=None, filters=()):
+        self.archive = archive
+        self.month   = month
+        seg = archive.segment(root)
+        if seg is None:
+            self.a = self.b = 0
+            self._ts  = np.zeros(0, dtype=np.int64)
+            self.mask = np.zeros(0, dtype=bool)
+            return
+        ts   = archive.ts(root)
+        i    = int(np.searchsorted(ts, start, "left"))  if start else 0
+        j    = int(np.searchsorted(ts, end,   "right")) if end   else len(ts)
+        self.a, self.b = seg[0] + i, seg[0] + j
+        self._ts  = ts[i:j]
+        self.mask = archive.bits("bot", self.a, self.b) == 0
+        self._where("site", "host", host)
+        for col, op, value in filters:
+            self._where(col, op, value)
+
+    def _where(self, col, op, value):
+        ok = self.archive.matches(col, op, value)
+        self.mask &= ok[self.archive.codes(col, self.a, self.b)]
+
+    def ts(self):
+        return self._ts[self.mask]
+
+    def codes(self, col):
+        return self.archive.codes(col, self.a, self.b)[self.mask]
+
+    def count(self) -> int:
+        return int(self.mask.sum())
+
+    def distinct(self, col):
+        """Distinct non-NULL values of a dictionary column."""
+        d = self.archive.dictionary(col)
+        return [d.value(int(c)) for c in np.unique(self.codes(col)) if c]
+
+    def group_counts(self, col):
+        """[[value, rows], ...] grouped by a column, NULL included (as SQL GROUP BY does)."""
+        if col == "w":
+            values, counts = np.unique(self.archive.bits("w", self.a, self.b)[self.mask],
+                                       return_counts=True)
+            return [[int(v) - 1 if v else None, int(n)] for v, n in zip(values, counts)]
+        d      = self.archive.dictionary(col)
+        counts = np.bincount(self.codes(col), minlength=d.count)
+        return [[d.value(int(c)), int(counts[c])] for c in np.flatnonzero(counts)]
+
+    def buckets(self, step, fmt):
+        """[[label, views, distinct sessions], ...] per UTC bucket of `step` seconds."""
+        bucket = self.ts() // step
+        if not len(bucket):
+            return []
+        n_sess = self.archive.dictionary("session").count
+        sess   = self.codes("session").astype(np.int64)
+        keys, views = np.unique(bucket, return_counts=True)
+        pairs  = np.unique(bucket[sess > 0] * n_sess + sess[sess > 0])
+        sessions = dict(zip(*np.unique(pairs // n_sess, return_counts=True)))
+        return [
+            [time.strftime(fmt, time.gmtime(int(k) * step)), int(v), int(sessions.get(k, 0))]
+            for k, v in zip(keys, views)
+        ]
+
+    def hours(self):
+        """[[hour of day (UTC), views], ...]."""
+        counts = np.bincount(self.ts() // 3600 % 24, minlength=24)
+        return [[h, int(counts[h])] for h in np.flatnonzero(counts).tolist()]
+
+    def ua_counts(self, col):
+        """{value: views} for device/browser/os; NULL rows are classified from their UA."""
+        idx    = ("device", "browser", "os").index(col)
+        codes  = self.codes(col)
+        counts = {}
+        for value, n in self.group_counts(col):
+            if value is not None:
+                counts[value] = n
+        ua_codes = self.codes("ua")[codes == 0]
+        if len(ua_codes):
+            d = self.archive.dictionary("ua")
+            per_ua = np.bincount(ua_codes, minlength=d.count)
+            for c in np.flatnonzero(per_ua):
+                value = classify(d.value(int(c)))[idx]
+                counts[value] = counts.get(value, 0) + int(per_ua[c])
+        return counts
+
+
+def scans(db, root, host, start=None, end=None, filters=()):
+    """Scans over every archived partition overlapping [start, end]."""
+    if np is None:
+        return []
+    out = []
+    for part in db.execute(
+        "SELECT month, cols, max_id FROM partitions "
+        "WHERE cols IS NOT NULL AND state = 'ready' AND hi > ? AND lo <= ? ORDER BY month",
+        (start or 0, end or 1 << 62),
+    ):
+        try:
+            archive = open_archive(part["cols"])
+        except (OSError, ValueError):
+            continue   # missing or unreadable: the SQLite partition answers instead
+        if archive.max_id == part["max_id"]:
+            out.append(Scan(archive, part["month"], root, host, start, end, filters))
+    return out
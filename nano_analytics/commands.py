@@ -0,0 +1,146 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+try:
+    import fcntl
+except ImportError:   # Windows: no lock against a second migration
+    fcntl = None
+
+from . import columnar, importer, interning, partitions, retention, rollups, sessions
+from .db import get_db, backfill_ua
+
+# Maintenance commands. Run as:
+#   flask --app 'nano_analytics:create_app()' <command>
+
+
+@click.command("backfill-ua")
+@with_appcontext
+def backfill_ua_command():
+    """Classify device/browser/os for hits recorded before ingest did it."""
+    n = backfill_ua(get_db())
+    click.echo(f"Backfilled {n} rows.")
+
+
+@click.command("migrate-interning")
+@with_appcontext
+def migrate_interning_command():
+    """Move hits from text path/ref/ua/lang columns to interned ids now (ingest can keep running)."""
+    db = get_db()
+    if not interning.pending(db):
+        click.echo("Nothing to migrate.")
+        return
+    # The maintenance thread's lock: it runs the same migration in the background
+    fd = os.open(f"{current_app.config['DB_PATH']}-maintenance", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise click.ClickException("Maintenance is running (it migrates too); try again later.")
+        n = interning.migrate(db, echo=click.echo)
+    finally:
+        os.close(fd)
+    click.echo(f"Migrated {n} tables.")
+
+
+@click.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups_command():
+    """Recompute the daily/hourly rollup tables from raw hits."""
+    rollups.rebuild(get_db(), echo=click.echo)
+    click.echo("Rollups rebuilt.")
+
+
+@click.command("rebuild-sessions")
+@with_appcontext
+def rebuild_sessions_command():
+    """Recompute the per-session table from raw hits."""
+    sessions.rebuild(get_db(), echo=click.echo)
+    click.echo("Sessions rebuilt.")
+
+
+@click.command("rotate-partitions")
+@with_appcontext
+def rotate_partitions_command():
+    """Move hits of closed months from the main database into monthly files."""
+    n = partitions.rotate(get_db(), current_app.config["DB_PATH"], echo=click.echo)
+    click.echo(f"Moved {n} hits into partitions.")
+
+
+@click.command("build-archives")
+@click.option("--force", is_flag=True, help="Rebuild archives that are already up to date.")
+@with_appcontext
+def build_archives_command(force):
+    """Write columnar copies of closed monthly partitions (needs NumPy)."""
+    if not columnar.available():
+        raise click.ClickException("NumPy is not installed: pip install 'nano-analytics[archive]'")
+    n = columnar.build_missing(get_db(), force=force, echo=click.echo)
+    click.echo(f"Built {n} archives.")
+
+
+@click.command("apply-retention")
+@click.option("--vacuum", is_flag=True,
+              help="Then rewrite the database once so later runs can return space to the disk.")
+@with_appcontext
+def apply_retention_command(vacuum):
+    """Delete raw hits older than RETENTION_DAYS / RETENTION_SITES now."""
+    policy = retention.policy_from_config(current_app.config)
+    stats  = retention.enforce(get_db(), policy)
+    if "skipped" in stats:
+        raise click.ClickException(stats["skipped"])
+    click.echo(f"Deleted {stats['hits']} hits and {stats['sessions']} sessions, "
+               f"dropped {stats['partitions_dropped']} partitions.")
+    if vacuum:
+        click.echo("Vacuuming…")
+        retention.vacuum(get_db())
+        click.echo("Done.")
+
+
+@click.command("import-logs")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--site", help="Site that pageviews in the logs belong to (/hit lines carry their own).")
+@click.option("--workers", type=int, default=0, help="Parser processes (default: one per CPU).")
+@click.option("--restart", is_flag=True,
+              help="Ignore checkpoints and read the files from the start (imports their lines again).")
+@click.option("--drop-indexes/--keep-indexes", default=None,
+              help="Drop the hits indexes during the import and rebuild them at the end "
+                   "(default: only if hits is empty; never on a live instance).")
+@click.option("--no-rebuild", is_flag=True,
+              help="Skip the rollup/session rebuild; run rebuild-rollups and rebuild-sessions later.")
+@with_appcontext
+def import_logs_command(paths, site, workers, restart, drop_indexes, no_rebuild):
+    """Import nginx/gunicorn access logs (plain or .gz) into hits, resumably."""
+    db     = get_db()
+    totals = importer.run(
+        db, paths, site=site, workers=workers or None, restart=restart,
+        defer_indexes=drop_indexes, echo=click.echo,
+    )
+    click.echo(f"Imported {totals['hits']:,} hits from {totals['lines']:,} lines "
+               f"({totals['skipped']:,} skipped).")
+    if not totals["hits"]:
+        return
+    if no_rebuild:
+        click.echo("Stats read raw hits for the imported days until rebuild-rollups and "
+                   "rebuild-sessions have run.")
+        return
+    click.echo("Rebuilding rollups…")
+    rollups.rebuild(db, echo=click.echo)
+    click.echo("Rebuilding sessions…")
+    sessions.rebuild(db)
+    if current_app.config.get("PARTITIONS", "monthly") != "none":
+        n = partitions.rotate(db, current_app.config["DB_PATH"], echo=click.echo)
+        click.echo(f"Moved {n} hits into partitions.")
+
+
+def register(app):
+    app.cli.add_command(backfill_ua_command)
+    app.cli.add_command(migrate_interning_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(rebuild_sessions_command)
+    app.cli.add_command(rotate_partitions_command)
+    app.cli.add_command(build_archives_command)
+    app.cli.add_command(apply_retention_command)
+    app.cli.add_command(import_logs_command)
@@ -1,7 +1,16 @@
+import os
+import queue
 import sqlite3
-from flask import g, current_app
+import threading
+import time
+from flask import g, current_app, jsonify, request
+
+from . import interning, partitions, retention, rollups, sessions
+from .sites import site_root
+from .ua_parser import classify
 
 SCHEMA = """
+PRAGMA auto_vacuum=INCREMENTAL;
 PRAGMA journal_mode=WAL;
 PRAGMA synchronous=NORMAL;
 
@@ -9,10 +18,10 @@ CREATE TABLE IF NOT EXISTS hits (
     id      INTEGER PRIMARY KEY AUTOINCREMENT,
     ts      INTEGER NOT NULL,
     site    TEXT NOT NULL,
-    path    TEXT NOT NULL,
-    ref     TEXT,
-    ua      TEXT,
-    lang    TEXT,
+    path_id INTEGER NOT NULL,   -- path/ref/ua/lang: ids into interning tables
+    ref_id  INTEGER,
+    ua_id   INTEGER,
+    lang_id INTEGER,
     w       INTEGER,
     session TEXT,
     country TEXT
@@ -22,26 +31,259 @@ CREATE INDEX IF NOT EXISTS idx_site_ts      ON hits(site, ts);
 CREATE INDEX IF NOT EXISTS idx_site_session ON hits(site, session);
 """
 
+# Column order of the tuples passed to insert_hits()
+HIT_COLUMNS = (
+    "ts", "site", "path", "ref", "ua", "lang", "w", "session", "country", "bot",
+    "device", "browser", "os",
+)
+
+# Tuple positions replaced by interned ids before the INSERT
+_INTERNED = {col: HIT_COLUMNS.index(col) for col in interning.COLUMNS}
+
+# root_site is derived from site in insert_hits(), not passed by callers
+_INSERT_HIT = (
+    f"INSERT INTO hits ({', '.join(map(interning.stored, HIT_COLUMNS))}, root_site) "
+    f"VALUES ({','.join('?' * (len(HIT_COLUMNS) + 1))})"
+)
+
+# Same, while the interning migration is pending: the text columns are filled too
+_INSERT_HIT_TEXT = (
+    f"INSERT INTO hits ({', '.join(map(interning.stored, HIT_COLUMNS))}, root_site, "
+    f"{', '.join(interning.COLUMNS)}) "
+    f"VALUES ({','.join('?' * (len(HIT_COLUMNS) + 1 + len(interning.COLUMNS)))})"
+)
+
+_PENDING_RECHECK = 5   # seconds between checks whether a pending migration has run
+# Served while it is pending: ingest writes both text and ids, so no beacon is lost
+_PENDING_OK = {"main.health", "main.hit", "main.hit_batch", "main.beacon_js"}
+
+
+# ── Connections ────────────────────────────────────────────────────────────────
+
+class Connection(sqlite3.Connection):
+    """sqlite3.Connection that can carry attributes: pool bookkeeping, the interner."""
+
+
+def connect(path, mmap_size=256 * 1024 * 1024, cache_kb=16000, statement_cache=256):
+    """Open a tuned SQLite connection.
+
+    Connections are long-lived (pooled), so the PRAGMAs favour reads: a large
+    mmap window and page cache, and in-memory temp B-trees for GROUP BY/ORDER BY.
+    sqlite3's per-connection statement cache keeps the prepared statements for
+    the fixed queries in routes.py, so they are compiled once per connection.
+    """
+    db = sqlite3.connect(
+        path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+        cached_statements=statement_cache,
+        uri=True,   # partitions are attached read-only via file: URIs
+        factory=Connection,
+    )
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    db.execute(f"PRAGMA cache_size=-{int(cache_kb)}")
+    db.execute("PRAGMA temp_store=MEMORY")
+    db.create_function("site_root", 1, site_root, deterministic=True)
+    return db
+
+
+class ConnectionPool:
+    """Per-process pool of persistent SQLite connections.
+
+    Checkout waits up to ``timeout`` seconds for an idle connection once
+    ``size`` connections are open; after that an extra, unpooled connection
+    is opened (and closed on checkin) rather than failing the request.
+    """
+
+    def __init__(self, path, size=4, timeout=2.0, **tuning):
+        self.path    = path
+        self.size    = max(1, size)
+        self.timeout = timeout
+        self.tuning  = tuning
+        self._lock   = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections must not be shared across fork(): each gunicorn worker
+        # starts with an empty pool of its own.
+        self._pid       = os.getpid()
+        self._idle      = queue.LifoQueue()
+        self._open      = 0
+        self._checkouts = 0
+        self._reused    = 0
+        self._overflow  = 0
+        self._wait_s    = 0.0
+        self._wait_max  = 0.0
+
+    def checkout(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._checkouts += 1
+            try:
+                conn = self._idle.get_nowait()
+                self._reused += 1
+                return conn
+            except queue.Empty:
+                pass
+            if self._open < self.size:
+                self._open += 1
+                return self._new()
+        t0 = time.monotonic()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            conn = None
+        waited = time.monotonic() - t0
+        with self._lock:
+            self._wait_s  += waited
+            self._wait_max = max(self._wait_max, waited)
+            if conn is not None:
+                self._reused += 1
+                return conn
+            self._overflow += 1
+        conn = self._new()
+        conn._nano_overflow = True
+        return conn
+
+    def checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if getattr(conn, "_nano_overflow", False) or self._pid != os.getpid():
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def _new(self):
+        return connect(self.path, **self.tuning)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size":          self.size,
+                "open":          self._open,
+                "idle":          self._idle.qsize(),
+                "checkouts":     self._checkouts,
+                "hit_ratio":     round(self._reused / self._checkouts, 4) if self._checkouts else None,
+                "overflow":      self._overflow,
+                "wait_ms_total": round(self._wait_s * 1000, 1),
+                "wait_ms_max":   round(self._wait_max * 1000, 1),
+            }
+
+
+def pool_from_config(config):
+    return ConnectionPool(
+        config["DB_PATH"],
+        size            = int(config.get("DB_POOL_SIZE", 4)),
+        timeout         = float(config.get("DB_POOL_TIMEOUT", 2.0)),
+        mmap_size       = int(config.get("DB_MMAP_SIZE", 256 * 1024 * 1024)),
+        cache_kb        = int(config.get("DB_CACHE_KB", 16000)),
+        statement_cache = int(config.get("DB_STATEMENT_CACHE", 256)),
+    )
+
 
 def get_db():
-    """Return a per-request SQLite connection stored on Flask's g object."""
+    """Return the request's pooled SQLite connection, stored on Flask's g object."""
     if "_db" not in g:
-        g._db = sqlite3.connect(
-            current_app.config["DB_PATH"],
-            detect_types=sqlite3.PARSE_DECLTYPES,
-        )
-        g._db.row_factory = sqlite3.Row
+        g._db   = current_app.extensions["db_pool"].checkout()
+        metrics = current_app.extensions.get("metrics")
+        if metrics is not None:
+            metrics.watch(g._db)
     return g._db
 
 
+def insert_hits(db, rows):
+    """Insert a batch of hit tuples (ordered as HIT_COLUMNS) in one transaction.
+
+    The rollups and sessions table are updated in the same transaction, so
+    aggregate tables never disagree with raw hits.  BEGIN IMMEDIATE takes the
+    write lock up front so the rollup lookups of concurrent writers cannot
+    interleave.  path/ref/ua/lang are stored as interned ids (interning.py).
+    """
+    if not rows:
+        return
+    interner = interning.interner(db)
+    learned  = {}
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rollups.apply(db, rows)
+        sessions.apply(db, rows)
+        write_hits(db, rows, interner, learned)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    interner.learn(learned)
+
+
+def write_hits(db, rows, interner, learned):
+    """INSERT hit tuples into hits, inside the caller's write transaction."""
+    if interning.text_columns(db):
+        db.executemany(_INSERT_HIT_TEXT, encode_hits(db, rows, interner, learned, text=True))
+    else:
+        db.executemany(_INSERT_HIT, encode_hits(db, rows, interner, learned))
+
+
+def encode_hits(db, rows, interner, learned, text=False):
+    """Hit tuples as stored: interned columns replaced by ids, root_site appended.
+
+    With `text`, the original path/ref/ua/lang follow root_site (for
+    _INSERT_HIT_TEXT).  Runs inside the INSERT's transaction; see
+    Interner.ids() for `learned`.
+    """
+    ids = {
+        col: interner.ids(db, col, {r[i] for r in rows if r[i] is not None}, learned)
+        for col, i in _INTERNED.items()
+    }
+    stored = []
+    for r in rows:
+        extra = tuple(r[i] for i in _INTERNED.values()) if text else ()
+        r = list(r)
+        for col, i in _INTERNED.items():
+            if r[i] is not None:
+                r[i] = ids[col][r[i]]
+        stored.append((*r, site_root(r[1]), *extra))
+    return stored
+
+
+def hits_source(start=None, end=None, where="1", params=(), skip=None, exclude=()):
+    """FROM target for the request's hits in [start, end], across monthly partitions.
+
+    See partitions.source(); `where`/`params` are only used when the range
+    spans too many partitions to attach and its rows are staged instead.
+    """
+    db  = get_db()
+    src = partitions.source(
+        db, start, end, where, params, skip,
+        mmap_size=current_app.config.get("PARTITION_MMAP_SIZE", 1024 * 1024 * 1024),
+        exclude=exclude,
+    )
+    if src.startswith(partitions.STAGED_PREFIX):
+        g._staged = True
+    return src
+
+
+def hit_tables(start=None, end=None):
+    """Attached hits tables covering [start, end], or None (see partitions.tables())."""
+    return partitions.tables(
+        get_db(), start, end,
+        mmap_size=current_app.config.get("PARTITION_MMAP_SIZE", 1024 * 1024 * 1024),
+    )
+
+
 def close_db(e=None):
     db = g.pop("_db", None)
     if db is not None:
-        db.close()
+        if g.pop("_staged", False):
+            partitions.release(db)
+        current_app.extensions["db_pool"].checkin(db)
 
 
 def init_db(app):
-    """Called once at startup to create schema if not present."""
+    """Called once at startup to create the connection pool and schema."""
+    app.extensions["db_pool"] = pool_from_config(app.config)
     with app.app_context():
         db = get_db()
         db.executescript(SCHEMA)
@@ -49,9 +291,83 @@ def init_db(app):
         for stmt in (
             "ALTER TABLE hits ADD COLUMN country TEXT",
             "ALTER TABLE hits ADD COLUMN bot INTEGER DEFAULT 0",
+            # UA classification materialized at ingest (NULL until backfilled)
+            "ALTER TABLE hits ADD COLUMN device TEXT",
+            "ALTER TABLE hits ADD COLUMN browser TEXT",
+            "ALTER TABLE hits ADD COLUMN os TEXT",
+            "ALTER TABLE hits ADD COLUMN root_site TEXT",
         ):
             try:
                 db.execute(stmt)
                 db.commit()
             except Exception:
                 pass  # column already exists
+        _backfill_root_site(db)
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_root_bot_ts ON hits(root_site, bot, ts)"
+        )
+        interning.init(db)
+        partitions.init(db)
+        retention.init(db)
+        rollups.init(db)
+        sessions.init(db)
+        # Rewriting hits is too long for a worker's boot: the maintenance
+        # thread (or `flask migrate-interning`) does it while ingest goes on,
+        # and reads get a 503 until it is done
+        app.extensions["interning_pending"] = interning.pending(db)
+    if app.extensions["interning_pending"]:
+        app.before_request(_interning_guard)
+
+
+def _interning_guard():
+    """503 for reads while the interning migration is pending (old rows have no ids yet)."""
+    ext = current_app.extensions
+    now = time.monotonic()
+    if ext["interning_pending"] and now >= ext.get("interning_checked", 0) + _PENDING_RECHECK:
+        ext["interning_checked"] = now
+        ext["interning_pending"] = interning.pending(get_db())
+    if not ext["interning_pending"] or request.endpoint in _PENDING_OK:
+        return None
+    return jsonify({"error": "database migration in progress, try again later"}), 503
+
+
+def _backfill_root_site(db, chunk=20000):
+    """Derive root_site (and normalise NULL bot to 0) for rows stored before ingest did.
+
+    Walks id ranges, one short transaction per chunk, so a large database is
+    migrated without holding the write lock for the whole table.
+    """
+    if not db.execute("SELECT 1 FROM hits WHERE root_site IS NULL LIMIT 1").fetchone():
+        return
+    lo, hi = db.execute("SELECT MIN(id), MAX(id) FROM hits").fetchone()
+    for a in range(lo, hi + 1, chunk):
+        with db:
+            db.execute(
+                "UPDATE hits SET root_site = site_root(site), bot = COALESCE(bot, 0) "
+                "WHERE id >= ? AND id < ? AND root_site IS NULL",
+                (a, a + chunk),
+            )
+
+
+def backfill_ua(db, chunk=5000):
+    """Classify device/browser/os for rows stored before those columns existed.
+
+    Works in id-ordered chunks, one short transaction each, so it can run
+    while the app is serving. Returns the number of rows updated.
+    """
+    done, last_id = 0, 0
+    while True:
+        rows = db.execute(
+            f"SELECT id, {interning.label('ua')} AS ua FROM hits "
+            f"WHERE id > ? AND device IS NULL ORDER BY id LIMIT ?",
+            (last_id, chunk),
+        ).fetchall()
+        if not rows:
+            return done
+        with db:
+            db.executemany(
+                "UPDATE hits SET device = ?, browser = ?, os = ? WHERE id = ?",
+                [(*classify(r["ua"]), r["id"]) for r in rows],
+            )
+        done   += len(rows)
+        last_id = rows[-1]["id"]
@@ -0,0 +1,143 @@
+import csv
+import heapq
+import io
+import json
+import time
+import zlib
+
+from . import interning, partitions
+from .db import connect
+
+# Streaming raw-hit export (/api/export), NDJSON or CSV, optionally gzipped.
+#
+# Rows are read in keyset pages ordered by id — `id > last ORDER BY id LIMIT
+# n` — from each table holding the range (main.hits and the overlapping
+# monthly partitions), merged by id.  Every page is a short statement that
+# is read to the end before the next one runs, so no read transaction stays
+# open for the length of the export: WAL checkpoints proceed and memory
+# stays at about `chunk` rows whatever the range.  Output is encoded and
+# compressed one page at a time.  Ids are unique across main and the
+# partitions (rotation copies rows with their id), so the last id received
+# is the cursor a client passes as `after` to resume.
+#
+# Exports use their own connection, not one from the request pool, and
+# give way to the buffered ingest writer between pages while its queue is
+# more than half full.  A response stops after `max_seconds` (below the
+# gunicorn timeout) or `limit` rows; clients repeat with `after` until a
+# response holds no rows.  A rotation running during an export may move
+# not-yet-read rows into a partition the export did not open; resuming
+# picks those up only if their ids are above the cursor.
+
+COLUMNS = ("id", "ts", "site", "path", "ref", "ua", "lang", "w", "session", "country",
+           "bot", "device", "browser", "os")
+
+CHUNK_ROWS  = 5000   # rows per page, shared by all tables read
+MAX_SECONDS = 20     # per response; keep under gunicorn's --timeout
+WRITER_WAIT = 1.0    # longest pause per page while the ingest queue drains
+
+_MIN_PAGE = 100
+
+
+def _pages(db, table, where, params, after, size, part=None, mmap_size=None):
+    """Rows of one table in id order, fetched `size` at a time."""
+    if part is not None:
+        partitions.attach(db, [part], mmap_size)
+    # The id span of the matches comes from the (root_site, bot, ts) index;
+    # pages then walk the rowid within it.  Left to itself the planner would
+    # use that index for every page and sort all of the site's rows each time.
+    lo, hi = db.execute(f"SELECT MIN(id), MAX(id) FROM {table} WHERE {where}", params).fetchone()
+    if lo is None:
+        return
+    after = max(after, lo - 1)
+    cols  = ", ".join(
+        f"{interning.label(c)} AS {c}" if c in interning.COLUMNS else c for c in COLUMNS
+    )
+    sql   = (f"SELECT {cols} FROM {table} NOT INDEXED "
+             f"WHERE id > ? AND id <= ? AND ({where}) ORDER BY id LIMIT ?")
+    while True:
+        if part is not None:
+            partitions.attach(db, [part], mmap_size)   # may have been detached for another
+        rows = db.execute(sql, [after, hi, *params, size]).fetchall()
+        yield from rows
+        if len(rows) < size:
+            return
+        after = rows[-1][0]
+
+
+def rows(db, where, params, start=None, end=None, after=0, chunk=CHUNK_ROWS,
+         mmap_size=1024 * 1024 * 1024):
+    """Hits matching `where` in [start, end] with id > after, in id order, across partitions."""
+    parts = partitions.overlapping(db, start, end)
+    size  = max(_MIN_PAGE, chunk // (len(parts) + 1))
+    main  = f"({where}) AND {partitions.main_filter(parts)}"
+    legs  = [_pages(db, "main.hits", main, params, after, size)]
+    legs += [
+        _pages(db, f"{partitions.alias(p['month'])}.hits", where, params, after, size, p, mmap_size)
+        for p in parts
+    ]
+    return heapq.merge(*legs, key=lambda r: r[0]) if len(legs) > 1 else legs[0]
+
+
+# ── Encoding ───────────────────────────────────────────────────────────────────
+
+def _ndjson(batch, first):
+    return "".join(
+        json.dumps(dict(zip(COLUMNS, r)), ensure_ascii=False, separators=(",", ":")) + "\n"
+        for r in batch
+    )
+
+
+def _csv(batch, first):
+    out = io.StringIO()
+    w   = csv.writer(out, lineterminator="\n")
+    if first:
+        w.writerow(COLUMNS)
+    w.writerows(batch)
+    return out.getvalue()
+
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", _ndjson),
+    "csv":    ("text/csv; charset=utf-8", _csv),
+}
+
+
+def stream(db_path, where, params, fmt="ndjson", start=None, end=None, after=0, limit=None,
+           gzip=False, writer=None, chunk=CHUNK_ROWS, max_seconds=MAX_SECONDS,
+           mmap_size=1024 * 1024 * 1024):
+    """Generator of response body bytes; opens and closes its own connection."""
+    encode   = FORMATS[fmt][1]
+    deflate  = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None   # 31: gzip framing
+    capacity = writer.stats()["capacity"] if writer is not None else 0
+    db       = connect(db_path, mmap_size=mmap_size)
+    try:
+        started, sent, first = time.monotonic(), 0, True
+        it = rows(db, where, params, start, end, after, chunk, mmap_size)
+        while True:
+            want  = chunk if limit is None else min(chunk, limit - sent)
+            batch = [r for _, r in zip(range(want), it)]
+            if batch or first:
+                data = encode(batch, first).encode()
+                if deflate is not None:
+                    data = deflate.compress(data) + deflate.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            first  = False
+            sent  += len(batch)
+            if len(batch) < want or sent == limit or time.monotonic() - started > max_seconds:
+                break
+            _yield_to(writer, capacity)
+        if deflate is not None:
+            yield deflate.flush()
+    finally:
+        db.close()
+
+
+def _yield_to(writer, capacity):
+    """Let the ingest writer catch up: pause while its queue is over half full."""
+    time.sleep(0)
+    if writer is None:
+        return
+    deadline = time.monotonic() + WRITER_WAIT
+    while writer.depth() * 2 > capacity and time.monotonic() < deadline:
+        time.sleep(0.01)
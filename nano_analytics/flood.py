@@ -0,0 +1,101 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from hashlib import blake2b
+
+try:
+    import fcntl
+except ImportError:   # Windows: falls back to a per-process table
+    fcntl = None
+
+# Per-site hit-rate detector shared by all gunicorn workers.
+#
+# A fixed table of SLOTS slots lives in an mmap'd file next to DB_PATH, so
+# memory never grows with traffic or with the number of distinct site= values
+# sent to /hit.  Each slot holds a site hash, the current minute and hit
+# counters for the current and previous minute; the rate is the usual
+# sliding-window approximation  prev × (unelapsed share of minute) + curr.
+#
+# Sites hash to a group of WAYS adjacent slots.  Only that group is locked —
+# an fcntl byte-range lock across processes plus one of STRIPES thread locks
+# inside a process — so there is no global lock on the hot path.  A site that
+# finds its group full of live sites takes over the least busy slot.
+
+_SLOT    = struct.Struct("<QqII8x")   # tag, minute, curr, prev → 32 bytes
+_WAYS    = 4
+_STRIPES = 64
+
+
+class FloodDetector:
+    def __init__(self, path=None, max_per_minute=300, slots=4096):
+        self.max_per_minute = max_per_minute
+        self.groups = max(1, slots // _WAYS)
+        size        = self.groups * _WAYS * _SLOT.size
+        self._fd    = None
+        if path and fcntl is not None:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        else:
+            self._map = mmap.mmap(-1, size)
+        self._stripes = [threading.Lock() for _ in range(_STRIPES)]
+        self.trips    = 0   # hits this process found over the threshold
+
+    def hit(self, site: str) -> bool:
+        """Count one hit for `site`; True if its rate is above the threshold."""
+        tag    = int.from_bytes(blake2b(site.encode(), digest_size=8).digest(), "little") or 1
+        group  = tag % self.groups
+        offset = group * _WAYS * _SLOT.size
+        now    = time.time()
+        minute = int(now // 60)
+        with self._stripes[group % _STRIPES]:
+            if self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, _WAYS * _SLOT.size, offset)
+            try:
+                over = self._count(offset, tag, minute, now) > self.max_per_minute
+            finally:
+                if self._fd is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, _WAYS * _SLOT.size, offset)
+            if over:
+                self.trips += 1
+            return over
+
+    def _count(self, offset, tag, minute, now):
+        victim, victim_rate = None, None
+        for way in range(_WAYS):
+            pos = offset + way * _SLOT.size
+            t, m, curr, prev = _SLOT.unpack_from(self._map, pos)
+            if t == tag:
+                break
+            rate = _rate(m, curr, prev, minute, now)
+            if victim is None or rate < victim_rate:
+                victim, victim_rate = pos, rate
+        else:
+            pos, m, curr, prev = victim, minute, 0, 0
+        if m != minute:
+            prev = curr if m == minute - 1 else 0
+            curr = 0
+        curr += 1
+        _SLOT.pack_into(self._map, pos, tag, minute, curr, prev)
+        return _rate(minute, curr, prev, minute, now)
+
+
+def _rate(m, curr, prev, minute, now):
+    """Approximate hits in the last 60 s for a slot last written in minute m."""
+    if m == minute:
+        return prev * (1 - (now % 60) / 60) + curr
+    if m == minute - 1:
+        return curr * (1 - (now % 60) / 60)
+    return 0.0
+
+
+def flood_from_config(config):
+    path = config.get("FLOOD_PATH") or f"{config['DB_PATH']}-flood"
+    return FloodDetector(
+        path,
+        max_per_minute = int(config.get("FLOOD_MAX_PER_MINUTE", 300)),
+        slots          = int(config.get("FLOOD_SLOTS", 4096)),
+    )
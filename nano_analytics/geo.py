@@ -0,0 +1,115 @@
+import ipaddress
+import threading
+import time
+from functools import lru_cache
+
+# Optional offline GeoIP — bundled database, zero external calls
+try:
+    from geoip2fast import GeoIP2Fast
+except ImportError:
+    GeoIP2Fast = None
+
+# Country of a client IP, for /hit and everything that records hits.
+#
+# The GeoIP database is loaded on first use, not at import: CLI commands that
+# never look up an IP do not pay for it.  gunicorn.conf.py loads it in the
+# master before workers are forked, so they share its pages instead of each
+# building a copy.
+#
+# Lookups go through an LRU keyed by network prefix (/24 for IPv4, /48 for
+# IPv6): visitors of one network, crawlers and repeat visitors resolve once.
+# The cached value is computed from the prefix alone (its first address), so
+# an odd X-Forwarded-For value cannot poison the entry for real addresses.
+# The common private ranges are answered before the cache.  Set
+# GEO_CACHE_PREFIX=0 to key by full address.
+
+CACHE_SIZE = 65536
+
+_PRIVATE_V4 = ("10.", "127.", "192.168.") + tuple(f"172.{n}." for n in range(16, 32))
+
+
+class CountryResolver:
+    def __init__(self, size=CACHE_SIZE, prefix=True):
+        self.prefix  = prefix
+        self.private = 0
+        self.miss_s  = 0.0   # time spent in lookups the cache missed
+        self._geo    = None
+        self._loaded = False
+        self._lock   = threading.Lock()
+        self._lookup = lru_cache(maxsize=max(1, size))(self._resolve)
+
+    def load(self):
+        """Load the GeoIP database now (idempotent); False if geoip2fast is unavailable."""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        self._geo = GeoIP2Fast() if GeoIP2Fast is not None else None
+                    except Exception:
+                        self._geo = None
+                    self._loaded = True
+        return self._geo is not None
+
+    def country(self, ip):
+        """2-letter ISO country code, or None for private/unknown IPs."""
+        if not ip:
+            return None
+        if ip.startswith(_PRIVATE_V4):
+            self.private += 1
+            return None
+        if not self.prefix:
+            return self._lookup(ip)
+        if ":" in ip:
+            head = ip.split(":", 3)
+            # Only uncompressed leading groups make a /48 ("2001:db8::1" stays whole)
+            if len(head) == 4 and all(head[:3]):
+                return self._lookup(":".join(head[:3]).lower() + "::")
+            return self._lookup(ip)
+        return self._lookup(ip[:ip.rfind(".")] + ".0")
+
+    def _resolve(self, ip):
+        if not self.load():
+            return None
+        t0 = time.perf_counter()
+        try:
+            if ipaddress.ip_address(ip).is_private:
+                return None
+            return self._geo.lookup(ip).country_code or None
+        except Exception:
+            return None
+        finally:
+            self.miss_s += time.perf_counter() - t0
+
+    def stats(self) -> dict:
+        info = self._lookup.cache_info()
+        return {
+            "loaded":       self._geo is not None,
+            "hits":         info.hits,
+            "misses":       info.misses,
+            "private":      self.private,
+            "miss_seconds": round(self.miss_s, 6),
+            "size":         info.currsize,
+            "capacity":     info.maxsize,
+            "prefix":       self.prefix,
+        }
+
+
+# One per process: the importer's pool workers and the ingest server use it
+# outside any app, and it must exist before gunicorn forks.
+resolver = CountryResolver()
+
+
+def configure(config):
+    """Apply GEO_CACHE_SIZE / GEO_CACHE_PREFIX; keeps the loaded database."""
+    global resolver
+    size   = int(config.get("GEO_CACHE_SIZE", CACHE_SIZE))
+    prefix = str(config.get("GEO_CACHE_PREFIX", "1")) == "1"
+    if (size, prefix) != (resolver.stats()["capacity"], resolver.prefix):
+        fresh = CountryResolver(size, prefix)
+        fresh._geo, fresh._loaded = resolver._geo, resolver._loaded
+        resolver = fresh
+    return resolver
+
+
+def country(ip):
+    return resolver.country(ip)
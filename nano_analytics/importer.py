@@ -0,0 +1,301 @@
+import calendar
+import gzip
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from urllib.parse import parse_qsl
+
+from . import buckets, geo, interning, rollups
+from .db import write_hits
+from .routes import _beacon_row
+from .ua_parser import analyze_many
+
+# Bulk import of historical traffic from web-server access logs.
+#
+# Reads nginx "combined" / gunicorn default access logs, plain or gzipped,
+# in CHUNK_BYTES slices of whole lines.  A process pool parses the slices
+# into hit tuples: user agents are classified and IPs geolocated once per
+# distinct value in the slice.  The main process inserts each slice in one
+# transaction together with its checkpoint (the `imports` table: byte offset
+# reached in each file), so an interrupted import resumes where it stopped
+# and a re-run only reads lines appended since.
+#
+# Lines for NanoAnalytics' own /hit are imported as the beacon they were
+# (same fields and bot check as /hit).  Other lines count as pageviews of
+# --site: successful GETs of anything but static assets, with a session per
+# visitor (IP + user agent) and UTC day.  Flood detection is a live rate and
+# is not applied to history.
+#
+# Into an empty database, secondary indexes on hits are dropped for the
+# import and rebuilt once at the end; a database that already has hits keeps
+# them, as live queries and ingest need them.  Imported hits bypass the
+# rollups and the sessions table, so every slice also moves their coverage
+# (meta.rollup_since, sketch_since, sessions_since) past the day of its last
+# hit: queries read raw hits there until rollups and sessions are rebuilt from
+# raw hits, like `flask rebuild-rollups` / `rebuild-sessions`, which the
+# import command does at the end unless --no-rebuild.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS imports (
+    path   TEXT PRIMARY KEY,
+    head   BLOB,
+    offset INTEGER NOT NULL DEFAULT 0,
+    lines  INTEGER NOT NULL DEFAULT 0,
+    hits   INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+CHUNK_BYTES = 4 * 1024 * 1024   # log bytes per parse task and per transaction
+HEAD_BYTES  = 1024              # identifies a file again when resuming
+
+_LINE_RE  = re.compile(r'(\S+) \S+ \S+ \[([^\]]+)\] "([^"]*)" (\d{3}) \S+ "([^"]*)" "([^"]*)"')
+_ASSET_RE = re.compile(
+    r"\.(?:css|js|mjs|map|png|jpe?g|gif|svg|ico|webp|avif|bmp|woff2?|ttf|otf|eot|"
+    r"mp3|mp4|webm|ogg|wav|pdf|zip|gz|txt|xml|json|webmanifest)$",
+    re.IGNORECASE,
+)
+_COVERAGE = (*rollups.COVERAGE_KEYS, "sessions_since")   # meta keys the import moves
+_MONTHS   = {m: i for i, m in enumerate(calendar.month_abbr) if m}
+_PAGEVIEW = ("200", "304")
+
+
+def init(db):
+    db.executescript(SCHEMA)
+
+
+class _NoFlood:
+    """FloodDetector stand-in: history is imported without the live rate check."""
+
+    def hit(self, site):
+        return False
+
+
+_NO_FLOOD = _NoFlood()
+
+
+# ── Parsing (pool workers) ─────────────────────────────────────────────────────
+
+def parse_chunk(data, site=None):
+    """Hit tuples (db.HIT_COLUMNS order) for a slice of log lines; also (lines, skipped).
+
+    Runs in pool workers, so it only depends on module-level state.
+    """
+    parsed, days = [], {}
+    lines = skipped = 0
+    for line in data.decode("utf-8", "replace").splitlines():
+        lines += 1
+        m = _LINE_RE.match(line)
+        if m is None:
+            skipped += 1
+            continue
+        ip, when, request, status, ref, ua = m.groups()
+        method, _, rest = request.partition(" ")
+        target = rest.rpartition(" ")[0] or rest
+        if method != "GET" or status not in _PAGEVIEW:
+            skipped += 1
+            continue
+        ts = _timestamp(when, days)
+        if ts is None:
+            skipped += 1
+            continue
+        path, _, query = target.partition("?")
+        ua  = "" if ua == "-" else ua
+        ref = "" if ref == "-" else ref
+        if path == "/hit" and "site=" in query:
+            parsed.append((ts, None, query, None, ua, ip))
+        elif site and not _ASSET_RE.search(path) and path.startswith("/"):
+            parsed.append((ts, site, path, ref, ua, ip))
+        else:
+            skipped += 1
+
+    # Classify and geolocate each distinct user agent / IP of the slice once
+    agents    = analyze_many(p[4] for p in parsed)
+    countries = {ip: geo.country(ip) for ip in {p[5] for p in parsed}}
+    rows = []
+    for ts, s, path, ref, ua, ip in parsed:
+        if s is None:
+            args = {}
+            for k, v in parse_qsl(path, keep_blank_values=True):
+                args.setdefault(k, v)
+            row = _beacon_row(args, ua, ip, _NO_FLOOD, ts)
+            if row is None:
+                skipped += 1
+            else:
+                rows.append(row)
+            continue
+        day     = ts - ts % 86400
+        session = blake2b(f"{ip} {ua} {day}".encode(), digest_size=4).hexdigest()
+        device, browser, os_, bot = agents[ua]
+        rows.append((ts, s, path, ref, ua, "", None, session, countries[ip], 1 if bot else 0,
+                     device, browser, os_))
+    return rows, lines, skipped
+
+
+def _timestamp(when, days):
+    """UTC epoch of '10/Oct/2024:13:55:36 -0700', or None if malformed."""
+    try:
+        day = days.get(when[:11])
+        if day is None:
+            day = days[when[:11]] = calendar.timegm(
+                (int(when[7:11]), _MONTHS[when[3:6]], int(when[0:2]), 0, 0, 0)
+            )
+        tz     = when[21:26]
+        offset = (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60) * (-1 if tz[0] == "-" else 1)
+        return day + int(when[12:14]) * 3600 + int(when[15:17]) * 60 + int(when[18:20]) - offset
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+# ── Import ─────────────────────────────────────────────────────────────────────
+
+def run(db, paths, site=None, workers=None, restart=False, defer_indexes=None,
+        chunk_bytes=CHUNK_BYTES, echo=None, progress_every=5.0):
+    """Import access logs into hits; returns {"lines", "hits", "skipped"}.
+
+    defer_indexes=None drops the hits indexes only if hits is empty.  Does
+    not rebuild rollups or sessions; the caller does once all files are in.
+    """
+    init(db)
+    workers = workers or os.cpu_count() or 1
+    totals  = {"lines": 0, "hits": 0, "skipped": 0}
+    if defer_indexes is None:
+        defer_indexes = db.execute("SELECT 1 FROM hits LIMIT 1").fetchone() is None
+    indexes = _drop_indexes(db) if defer_indexes else []
+    pool    = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        for path in paths:
+            _import_file(db, path, site, pool, workers, restart, chunk_bytes, totals,
+                         echo, progress_every)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if indexes:
+            if echo:
+                echo("Rebuilding indexes…")
+            with db:
+                for sql in indexes:
+                    db.execute(sql)
+    if totals["hits"]:
+        buckets.invalidate(db)
+    return totals
+
+
+def _import_file(db, path, site, pool, workers, restart, chunk_bytes, totals, echo, every):
+    key   = os.path.realpath(path)
+    f     = _open(path)
+    raw   = getattr(f, "fileobj", f)   # compressed stream: progress by bytes read
+    size  = os.fstat(raw.fileno()).st_size or 1
+    head  = f.read(HEAD_BYTES)
+    state = db.execute("SELECT offset, head FROM imports WHERE path = ?", (key,)).fetchone()
+    start = 0
+    if state is not None:
+        known = bytes(state[1] or b"")
+        if not restart and head[:len(known)] == known:
+            start = state[0]
+        else:
+            if echo and not restart:
+                echo(f"{path}: not the file imported before under this name, starting over")
+            with db:
+                db.execute("DELETE FROM imports WHERE path = ?", (key,))
+    f.seek(start)
+    if start and echo:
+        echo(f"{path}: resuming at byte {start:,}")
+
+    offset, pending = start, deque()
+    lines = hits = 0
+    started = last = time.monotonic()
+    try:
+        while True:
+            data = b"".join(f.readlines(chunk_bytes))
+            if data and not data.endswith(b"\n"):
+                # Line still being written: leave it for the next run
+                data = data[:data.rfind(b"\n") + 1]
+            if data:
+                offset += len(data)
+                task = (pool.submit(parse_chunk, data, site) if pool is not None
+                        else _Done(parse_chunk(data, site)))
+                pending.append((task, offset))
+            # Keep a few slices in flight; commit them in file order
+            while pending and (len(pending) > workers * 2 or not data):
+                task, end = pending.popleft()
+                rows, n, skipped = task.result()
+                _commit(db, key, head, end, rows, n)
+                lines += n
+                hits  += len(rows)
+                totals["lines"]   += n
+                totals["hits"]    += len(rows)
+                totals["skipped"] += skipped
+                now = time.monotonic()
+                if echo and now - last >= every:
+                    last = now
+                    echo(f"  {path}: {lines:,} lines, {hits:,} hits, "
+                         f"{lines / (now - started):,.0f} lines/s, "
+                         f"{min(100, 100 * raw.tell() // size)}%")
+            if not data:
+                break
+    finally:
+        f.close()
+    if echo:
+        elapsed = max(time.monotonic() - started, 1e-9)
+        echo(f"{path}: {lines:,} lines, {hits:,} hits ({lines / elapsed:,.0f} lines/s)")
+
+
+def _commit(db, key, head, offset, rows, lines):
+    """Insert one slice's hits and advance the file's checkpoint in the same transaction."""
+    interner = interning.interner(db)
+    learned  = {}
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if rows:
+            write_hits(db, rows, interner, learned)
+            last  = max(r[0] for r in rows)
+            since = last - last % rollups.DAY + rollups.DAY
+            db.execute(
+                f"UPDATE meta SET value = MAX(value, ?) WHERE key IN ({','.join('?' * len(_COVERAGE))})",
+                (since, *_COVERAGE),
+            )
+        db.execute(
+            "INSERT INTO imports (path, head, offset, lines, hits) VALUES (?,?,?,?,?) "
+            "ON CONFLICT (path) DO UPDATE SET head = excluded.head, offset = excluded.offset, "
+            "lines = lines + excluded.lines, hits = hits + excluded.hits",
+            (key, head, offset, lines, len(rows)),
+        )
+        db.commit()
+    except BaseException:   # Ctrl-C too: the indexes are rebuilt on this connection next
+        db.rollback()
+        raise
+    interner.learn(learned)
+
+
+def _open(path):
+    with open(path, "rb") as f:
+        gz = f.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rb") if gz else open(path, "rb")
+
+
+class _Done:
+    """Already computed result with the Future interface (no pool)."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def _drop_indexes(db):
+    """Drop the secondary indexes of hits; returns the SQL to create them again.
+
+    init_db() recreates them too, should the import be killed before the end.
+    """
+    indexes = db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'hits' "
+        "AND sql IS NOT NULL"
+    ).fetchall()
+    with db:
+        for name, _sql in indexes:
+            db.execute(f"DROP INDEX {name}")
+    return [sql for _name, sql in indexes]
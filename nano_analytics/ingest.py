@@ -0,0 +1,222 @@
+import os
+import queue
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+
+from .db import connect, insert_hits
+
+# Write-behind buffer for the /hit beacon (INGEST_MODE=buffered).
+#
+# /hit enqueues the row and returns immediately; a background thread drains
+# the queue and writes up to INGEST_BATCH_SIZE rows per transaction, at least
+# every INGEST_FLUSH_MS milliseconds.  When the queue is full, submit() waits
+# up to INGEST_PUT_TIMEOUT_MS and then reports failure so the caller can fall
+# back to a direct insert — bursts slow down instead of dropping hits.
+#
+# A batch that fails because the database is busy (a migration, rebuild or
+# import holding the write lock) is kept and retried with backoff; the queue
+# fills meanwhile and /hit falls back as above.  Any other error retries the
+# batch row by row, so only the rows that fail are dropped (logged, counted
+# in stats()["dropped"]).  Nothing a batch raises stops the writer thread.
+
+RETRY_MIN = 0.05   # seconds before the first retry of a busy batch
+RETRY_MAX = 2.0    # longest wait between retries
+
+log = logging.getLogger(__name__)
+
+_writers: list["HitWriter"] = []
+_writers_lock = threading.Lock()
+
+
+class HitWriter:
+    def __init__(self, db_path, batch_size=500, flush_ms=250, queue_size=10000,
+                 put_timeout_ms=50):
+        self.db_path     = db_path
+        self.batch_size  = max(1, batch_size)
+        self.flush_s     = max(1, flush_ms) / 1000.0
+        self.put_timeout = max(0, put_timeout_ms) / 1000.0
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop    = threading.Event()
+        self._thread  = None
+        self._pid     = None
+        self._lock    = threading.Lock()
+        self._db      = None
+        self._until   = float("inf")   # give up retrying busy batches after this (close())
+        self.written  = 0
+        self.batches  = 0
+        self.overflow = 0
+        self.errors   = 0
+        self.dropped  = 0
+        with _writers_lock:
+            _writers.append(self)
+
+    # ── Producer side ─────────────────────────────────────────────────────────
+
+    def submit(self, row) -> bool:
+        """Enqueue one hit tuple. Returns False if the buffer stayed full."""
+        self._ensure_started()
+        try:
+            self._queue.put(row, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.overflow += 1
+            return False
+
+    def offer(self, row) -> bool:
+        """Enqueue one hit tuple without waiting; False if the buffer is full.
+
+        For callers that must not block, like the asyncio ingest server.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queued":   self.depth(),
+            "capacity": self._queue.maxsize,
+            "written":  self.written,
+            "batches":  self.batches,
+            "overflow": self.overflow,
+            "errors":   self.errors,
+            "dropped":  self.dropped,
+        }
+
+    # ── Writer thread ─────────────────────────────────────────────────────────
+
+    def _ensure_started(self):
+        # Threads do not survive fork(): a writer created before gunicorn forks
+        # its workers must start its own thread inside each worker.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._db     = None   # never use a connection inherited across fork()
+            self._until  = float("inf")
+            self._pid    = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="nano-analytics-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _drain(self, first):
+        batch    = [first]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        delay = RETRY_MIN
+        while True:
+            try:
+                if self._db is None:
+                    self._db = connect(self.db_path)
+                insert_hits(self._db, batch)
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                self.errors += 1
+                if _busy(e) and time.monotonic() + delay < self._until:
+                    if delay == RETRY_MIN:
+                        log.warning("database busy, retrying %d hits: %s", len(batch), e)
+                    time.sleep(delay)
+                    delay = min(delay * 2, RETRY_MAX)
+                    continue
+                if len(batch) > 1 and not _busy(e):
+                    # One bad row must not take the rest of the batch with it
+                    for row in batch:
+                        self._write([row])
+                    return
+                self.dropped += len(batch)
+                log.error("dropped %d hits", len(batch), exc_info=e)
+                return
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    first = self._queue.get(timeout=self.flush_s)
+                except queue.Empty:
+                    continue
+                self._write(self._drain(first))
+            # Shutdown: flush whatever is still buffered
+            while True:
+                batch = []
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if not batch:
+                    break
+                self._write(batch)
+        finally:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def close(self, timeout=10.0):
+        """Stop the writer thread after flushing all buffered rows."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._until = time.monotonic() + timeout
+        self._stop.set()
+        thread.join(timeout)
+        self._thread = None
+
+
+def _busy(e):
+    """True for SQLITE_BUSY/SQLITE_LOCKED: another connection holds the lock, try again."""
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(e) or "busy" in str(e)
+
+
+def writer_from_config(config, mode=None):
+    """Build a HitWriter from app config, or return None for synchronous ingest.
+
+    `mode` overrides INGEST_MODE (the asyncio ingest server always buffers).
+    """
+    if (mode or config.get("INGEST_MODE", "sync")) != "buffered":
+        return None
+    return HitWriter(
+        config["DB_PATH"],
+        batch_size     = int(config.get("INGEST_BATCH_SIZE", 500)),
+        flush_ms       = int(config.get("INGEST_FLUSH_MS", 250)),
+        queue_size     = int(config.get("INGEST_QUEUE_SIZE", 10000)),
+        put_timeout_ms = int(config.get("INGEST_PUT_TIMEOUT_MS", 50)),
+    )
+
+
+def shutdown():
+    """Flush and stop every writer in this process (gunicorn worker_exit, atexit)."""
+    with _writers_lock:
+        writers = list(_writers)
+    for w in writers:
+        w.close()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+from . import create_app, geo
+from .ingest import writer_from_config
+from .routes import (
+    _BATCH_HEADERS, _BATCH_MAX_BYTES, _GIF_1x1, _GIF_HEADERS, _SCRIPT_HEADERS,
+    _batch_rows, _beacon_row, _forwarded_ip,
+)
+
+# Standalone asyncio ingest server: serves /hit, /hit/batch and /a.js only, so the beacon
+# no longer competes with the stats API for gunicorn's sync workers.
+#
+# Put it behind the same reverse proxy as the Flask app and route /hit* and
+# /a.js to it.  A hit is recorded exactly as Flask's /hit does (routes.
+# _beacon_row: same bot regex, same shared flood counters, same country
+# lookup), fed to the shared live tracker and handed to a buffered
+# HitWriter — always buffered here, whatever INGEST_MODE says.  When the writer's queue is full the connection waits for
+# room instead of blocking the event loop or dropping the hit.
+#
+# The HTTP side is a deliberately small HTTP/1.1 subset on asyncio.Protocol
+# (no per-request task or stream objects): GET/HEAD (POST for /hit/batch),
+# keep-alive, pipelining, no chunked request bodies.  Anything else gets an error status.
+# Requests are recorded in the shared /metrics under the Flask endpoint names.
+
+IDLE_TIMEOUT = 15          # seconds a keep-alive connection may stay silent
+MAX_HEAD     = 16 * 1024   # request line + headers
+MAX_BODY     = _BATCH_MAX_BYTES
+QUEUE_WAIT   = 0.005       # seconds between retries while the writer's queue is full
+
+_SCRIPT_RESPONSE_HEADERS = {"Content-Type": "application/javascript; charset=utf-8", **_SCRIPT_HEADERS}
+_BATCH_JSON_HEADERS      = {"Content-Type": "application/json", **_BATCH_HEADERS}
+_ENDPOINTS = {"/hit": "main.hit", "/hit/batch": "main.hit_batch", "/a.js": "main.beacon_js",
+              "/health": "main.health"}
+
+
+class IngestServer:
+    def __init__(self, app):
+        self.flood   = app.extensions["flood"]
+        self.live    = app.extensions["live"]
+        self.writer  = app.extensions.get("hit_writer") or writer_from_config(app.config, "buffered")
+        self.metrics = app.extensions.get("metrics")
+        if self.metrics is not None:
+            # After the app's own source, so this writer's depth is the one copied
+            self.metrics.sources.append(lambda: {"ingest_queue_depth": self.writer.depth()})
+        with open(os.path.join(app.static_folder, "a.js"), "rb") as f:
+            self.script = f.read()
+        self.waits  = 0
+        self.conns  = set()
+
+    def route(self, method, target, headers, body, remote):
+        """(status, headers, body, rows to store) for one request."""
+        path, _, query = target.partition("?")
+        ua = headers.get("user-agent", "")
+        ip = _forwarded_ip(headers.get("x-forwarded-for", ""), remote)
+        if path == "/hit/batch":
+            if method == "OPTIONS":
+                return HTTPStatus.NO_CONTENT, _BATCH_HEADERS, b"", []
+            if method != "POST":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"Allow": "POST, OPTIONS"}, b"", []
+            try:
+                rows, rejected = _batch_rows(body, ua, ip, self.flood)
+            except ValueError as e:
+                return HTTPStatus.BAD_REQUEST, _BATCH_JSON_HEADERS, _json({"error": f"invalid batch: {e}"}), []
+            self.live.record(rows)
+            return HTTPStatus.OK, _BATCH_JSON_HEADERS, _json({"accepted": len(rows), "rejected": rejected}), rows
+        if method not in ("GET", "HEAD"):
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"Allow": "GET, HEAD"}, b"", []
+        if path == "/hit":
+            args = {}
+            for k, v in parse_qsl(query, keep_blank_values=True):
+                args.setdefault(k, v)   # first value wins, like request.args.get
+            row = _beacon_row(args, ua, ip, self.flood)
+            if row is None:
+                return HTTPStatus.OK, _GIF_HEADERS, _GIF_1x1, []
+            self.live.record([row])
+            return HTTPStatus.OK, _GIF_HEADERS, _GIF_1x1, [row]
+        if path == "/a.js":
+            return HTTPStatus.OK, _SCRIPT_RESPONSE_HEADERS, self.script, []
+        if path == "/health":
+            return HTTPStatus.OK, {"Content-Type": "application/json"}, b'{"status":"ok"}', []
+        return HTTPStatus.NOT_FOUND, {}, b"", []
+
+    # ── Lifecycle ─────────────────────────────────────────────────────────────
+
+    async def serve(self, host, port):
+        loop   = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _Connection(self), host, port, backlog=1024)
+        stop   = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:   # Windows
+                pass
+        addrs = ", ".join(str(s.getsockname()) for s in server.sockets)
+        print(f"nano-analytics ingest server listening on {addrs}", flush=True)
+        async with server:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), IDLE_TIMEOUT / 3)
+                except TimeoutError:
+                    self._close_idle(loop.time() - IDLE_TIMEOUT)
+            server.close()
+            for conn in list(self.conns):
+                conn.close()
+            await server.wait_closed()
+        # Flush the hits still buffered before exiting
+        await asyncio.to_thread(self.writer.close)
+
+    def _close_idle(self, before):
+        for conn in list(self.conns):
+            if conn.last_active < before:
+                conn.close()
+
+
+class _Connection(asyncio.Protocol):
+    """One client connection: parses pipelined requests out of the byte stream."""
+
+    def __init__(self, server):
+        self.server      = server
+        self.transport   = None
+        self.remote      = ""
+        self.buf         = b""
+        self.pending     = None    # (rows, response, keep_alive) waiting for writer queue space
+        self.slow_client = False   # transport buffer full: client is not reading responses
+        self.last_active = 0.0
+
+    def connection_made(self, transport):
+        self.transport   = transport
+        peer             = transport.get_extra_info("peername")
+        self.remote      = peer[0] if isinstance(peer, tuple) else ""
+        self.last_active = asyncio.get_running_loop().time()
+        self.server.conns.add(self)
+
+    def connection_lost(self, exc):
+        self.server.conns.discard(self)
+
+    def close(self):
+        if not self.transport.is_closing():
+            self.transport.close()
+
+    def data_received(self, data):
+        self.last_active = asyncio.get_running_loop().time()
+        self.buf += data
+        self._process()
+
+    # Slow client: stop reading until it has consumed our responses
+    def pause_writing(self):
+        self.slow_client = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.slow_client = False
+        if self.pending is None:
+            self.transport.resume_reading()
+            self._process()
+
+    def _process(self):
+        while self.pending is None and not self.slow_client and not self.transport.is_closing():
+            end = self.buf.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.buf) > MAX_HEAD:
+                    self._fail(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                return
+            line, *lines = self.buf[:end].decode("latin-1").split("\r\n")
+            parts = line.split(" ")
+            if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+                return self._fail(HTTPStatus.BAD_REQUEST)
+            method, target, version = parts
+            headers = {}
+            for h in lines:
+                name, sep, value = h.partition(":")
+                if sep:
+                    headers.setdefault(name.strip().lower(), value.strip())
+
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                return self._fail(HTTPStatus.NOT_IMPLEMENTED)
+            length = headers.get("content-length", "0")
+            if not length.isdigit() or int(length) > MAX_BODY:
+                return self._fail(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            size = end + 4 + int(length)
+            if len(self.buf) < size:
+                return   # body still arriving
+            body, self.buf = self.buf[end + 4:size], self.buf[size:]
+
+            conn       = headers.get("connection", "").lower()
+            keep_alive = conn != "close" if version == "HTTP/1.1" else conn == "keep-alive"
+            t0 = time.perf_counter()
+            status, extra, out, rows = self.server.route(method, target, headers, body, self.remote)
+            if self.server.metrics is not None:
+                self.server.metrics.observe(_ENDPOINTS.get(target.partition("?")[0], "other"),
+                                            status.value, time.perf_counter() - t0)
+            response = _response(status, extra, b"" if method == "HEAD" else out, len(out), keep_alive)
+            self._deliver(rows, response, keep_alive)
+
+    def _deliver(self, rows, response, keep_alive):
+        sent = 0
+        while sent < len(rows) and self.server.writer.offer(rows[sent]):
+            sent += 1
+        rows = rows[sent:]
+        if rows:
+            # Backpressure: hold this connection until the writer has room
+            self.server.waits += 1
+            self.pending = (rows, response, keep_alive)
+            self.transport.pause_reading()
+            asyncio.get_running_loop().call_later(QUEUE_WAIT, self._retry)
+            return
+        self.transport.write(response)
+        if not keep_alive:
+            self.transport.close()
+
+    def _retry(self):
+        if self.transport.is_closing():
+            return
+        rows, response, keep_alive = self.pending
+        self.pending = None
+        self._deliver(rows, response, keep_alive)
+        if self.pending is None and not self.slow_client:
+            self.transport.resume_reading()
+            self._process()
+
+    def _fail(self, status):
+        self.transport.write(_response(status, {}, b"", 0, False))
+        self.transport.close()
+
+
+def _json(obj):
+    return json.dumps(obj).encode()
+
+
+def _response(status, headers, body, length, keep_alive):
+    out = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Length: {length}"]
+    out += [f"{k}: {v}" for k, v in headers.items()]
+    if not keep_alive:
+        out.append("Connection: close")
+    return ("\r\n".join(out) + "\r\n\r\n").encode("latin-1") + body
+
+
+def main(argv=None):
+    """Entry point: nano-analytics-ingest [--host H] [--port P]"""
+    app    = create_app()
+    parser = argparse.ArgumentParser(description="NanoAnalytics asyncio ingest server (/hit, /a.js)")
+    parser.add_argument("--host", default=app.config["INGEST_SERVER_HOST"])
+    parser.add_argument("--port", type=int, default=app.config["INGEST_SERVER_PORT"])
+    args   = parser.parse_args(argv)
+    geo.resolver.load()   # before the first hit, not during it
+    asyncio.run(IngestServer(app).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import re
+import sqlite3
+from collections import OrderedDict
+
+# Interned text columns of hits.
+#
+# path, ref, ua and lang repeat the same few thousand strings across millions
+# of rows, so hits stores integer ids (path_id, ref_id, ua_id, lang_id) into
+# one lookup table per column; NULL stays NULL.  Ids are assigned at ingest
+# and never change or get reused, so partitions and archives can refer to
+# them too.
+#
+# Queries GROUP BY the id and join the label back in only for the rows they
+# return (label()); filters match against the lookup table once (matching())
+# instead of running LIKE on every hit.  Ingest resolves ids through a
+# per-connection LRU, so only strings it has not seen recently cost a lookup.
+#
+# Substring filters on path and ref ('%value%') would still scan every
+# distinct value, so those lookup tables also get an FTS5 trigram index
+# (<table>_trigram, external content, filled by an insert trigger: lookup
+# rows are never updated or deleted).  like() answers a pattern from the
+# index when it has an ASCII literal run of at least three characters and
+# re-checks each candidate with plain LIKE, so results are exactly LIKE's —
+# ASCII-only case folding, % and _ — whatever FTS5 folds.  Other patterns,
+# and SQLite builds without FTS5 or its trigram tokenizer (before 3.34),
+# fall back to the scan.
+#
+# Databases created before ids existed are migrated online.  init() adds the
+# id columns next to the text ones, and while the text columns are there
+# ingest writes both (text_columns()), so no hit needs to wait.  migrate()
+# then runs from the maintenance thread (or `flask migrate-interning`):
+# chunked, one short transaction per id range, and the text columns are
+# dropped as the last step.  Until it is done, reads answer 503 (see
+# db.init_db).  Partition files are vacuumed right away; the main database
+# keeps the freed space for new rows until `flask apply-retention --vacuum`.
+
+# hits column -> lookup table
+COLUMNS = {
+    "path": "paths",
+    "ref":  "referrers",
+    "ua":   "user_agents",
+    "lang": "languages",
+}
+
+SCHEMA = "".join(
+    f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE);\n"
+    for table in COLUMNS.values()
+)
+
+# hits columns whose lookup table gets a trigram index
+TRIGRAM = ("path", "ref")
+
+CACHE_SIZE = 10000   # strings per column kept by each connection's Interner
+
+_indexed = set()   # TRIGRAM columns whose index exists (FTS5 trigram available)
+_RUN     = re.compile(r"[^%_]{3,}")
+
+
+def init(db):
+    db.executescript(SCHEMA)
+    if "path" in _columns(db, "main"):
+        _add_id_columns(db, "main")   # ingest fills them from now on
+    for col in TRIGRAM:
+        if _init_trigram(db, COLUMNS[col]):
+            _indexed.add(col)
+
+
+def _init_trigram(db, table):
+    """Create and fill <table>_trigram if missing; False if FTS5 trigram is unavailable."""
+    fts    = f"{table}_trigram"
+    exists = "SELECT 1 FROM sqlite_master WHERE name = ?"
+    if db.execute(exists, (fts,)).fetchone():
+        return True
+    try:
+        # One write transaction, so concurrent workers build it only once
+        db.execute("BEGIN IMMEDIATE")
+        if not db.execute(exists, (fts,)).fetchone():
+            db.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                f"value, content='{table}', content_rowid='id', tokenize='trigram')"
+            )
+            db.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts} (rowid, value) VALUES (new.id, new.value); END"
+            )
+            db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")   # values interned so far
+        db.commit()
+    except sqlite3.OperationalError:
+        db.rollback()   # no fts5 module or trigram tokenizer
+        return False
+    return True
+
+
+# ── SQL helpers ────────────────────────────────────────────────────────────────
+
+def stored(col):
+    """Name of the hits column holding `col`: path -> path_id; other columns unchanged."""
+    return f"{col}_id" if col in COLUMNS else col
+
+
+def label(col, ref=None):
+    """SQL expression for the text of an interned id (`ref`, default <col>_id)."""
+    table = COLUMNS[col]
+    return f"(SELECT value FROM {table} WHERE {table}.id = {ref or stored(col)})"
+
+
+def id_of(col, expr):
+    """SQL expression for the id of a text value, NULL if it was never interned."""
+    return f"(SELECT id FROM {COLUMNS[col]} WHERE value = {expr})"
+
+
+def matching(col, op, value="?"):
+    """WHERE clause comparing an interned column's text with `value` (a parameter by default)."""
+    return f"{stored(col)} IN (SELECT id FROM {COLUMNS[col]} WHERE value {op} {value})"
+
+
+def text_of(db, col):
+    """SQL expression for an interned column's text in main hits.
+
+    The text column itself until the migration drops it: rows it has not
+    reached yet have no ids.
+    """
+    return col if text_columns(db) else label(col)
+
+
+def like(col, pattern):
+    """(WHERE clause, params) for `col LIKE pattern`, through the trigram index when it helps."""
+    if col in _indexed and pattern.isascii() and _RUN.search(pattern):
+        table = COLUMNS[col]
+        return (
+            f"{stored(col)} IN (SELECT id FROM {table} WHERE id IN "
+            f"(SELECT rowid FROM {table}_trigram WHERE value LIKE ?) AND value LIKE ?)",
+            [pattern, pattern],
+        )
+    return matching(col, "LIKE"), [pattern]
+
+
+# ── Ingest ─────────────────────────────────────────────────────────────────────
+
+class Interner:
+    """LRU of string -> id per interned column, for one connection."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size    = size
+        self._caches = {col: OrderedDict() for col in COLUMNS}
+        self.hits    = 0
+        self.misses  = 0
+
+    def ids(self, db, col, values, learned):
+        """Map each of `values` to its id, creating ids for new strings.
+
+        Must run inside the caller's transaction.  Ids created here are
+        recorded in `learned` and only cached by learn() once it commits: a
+        rollback would otherwise leave ids in the cache that do not exist.
+        """
+        table, cache = COLUMNS[col], self._caches[col]
+        found, missing = {}, []
+        for v in values:
+            i = cache.get(v)
+            if i is None:
+                missing.append(v)
+            else:
+                cache.move_to_end(v)
+                found[v] = i
+        self.hits   += len(found)
+        self.misses += len(missing)
+        for a in range(0, len(missing), 500):
+            part = missing[a:a + 500]
+            known = db.execute(
+                f"SELECT value, id FROM {table} WHERE value IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            for value, i in known:
+                found[value] = i
+                self._put(cache, value, i)   # committed by another transaction
+        for v in missing:
+            if v not in found:
+                i = db.execute(f"INSERT INTO {table} (value) VALUES (?)", (v,)).lastrowid
+                found[v] = learned[col, v] = i
+        return found
+
+    def learn(self, learned):
+        for (col, value), i in learned.items():
+            self._put(self._caches[col], value, i)
+
+    def _put(self, cache, value, i):
+        cache[value] = i
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+
+
+def text_columns(db) -> bool:
+    """True while main hits still has the text columns, which ingest must then fill too.
+
+    Check inside the write transaction, so the migration cannot drop them
+    in between.  Once they are gone the answer is kept on the connection.
+    """
+    if getattr(db, "interned", False):
+        return False
+    if "path" in _columns(db, "main"):
+        return True
+    try:
+        db.interned = True
+    except AttributeError:   # plain sqlite3 connection: checked every time
+        pass
+    return False
+
+
+def interner(db):
+    """The connection's Interner (connections from db.connect() keep theirs)."""
+    it = getattr(db, "interner", None)
+    if it is None:
+        it = Interner()
+        try:
+            db.interner = it
+        except AttributeError:   # plain sqlite3 connection: no cache across calls
+            pass
+    return it
+
+
+# ── Migration ──────────────────────────────────────────────────────────────────
+
+def migrate(db, chunk=20000, echo=None):
+    """Move a pre-interning database (and its partition files) to id columns.
+
+    Returns the number of tables migrated.  Safe to interrupt: rows are
+    marked done by path_id, and the text columns are only dropped once every
+    row has its ids.
+    """
+    done = 0
+    if _migrate_table(db, "main", chunk, echo):
+        done += 1
+    has_parts = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'partitions'"
+    ).fetchone()
+    for part in db.execute("SELECT path FROM partitions").fetchall() if has_parts else ():
+        db.execute("ATTACH DATABASE ? AS intern_src", (part[0],))
+        try:
+            if _migrate_table(db, "intern_src", chunk, echo):
+                db.execute("VACUUM intern_src")   # closed month: rewriting it is cheap
+                done += 1
+        finally:
+            db.execute("DETACH DATABASE intern_src")
+    pending(db)   # records completion
+    return done
+
+
+_MIGRATED = "interning_migrated"   # meta key, set once no table has text columns left
+
+
+def pending(db) -> bool:
+    """True while hits or a partition file still has the text columns (run migrate())."""
+    if db.execute("SELECT 1 FROM meta WHERE key = ?", (_MIGRATED,)).fetchone():
+        return False
+    if "path" in _columns(db, "main"):
+        return True
+    for (path,) in db.execute("SELECT path FROM partitions").fetchall():
+        db.execute("ATTACH DATABASE ? AS intern_src", (path,))
+        try:
+            if "path" in _columns(db, "intern_src"):
+                return True
+        finally:
+            db.execute("DETACH DATABASE intern_src")
+    with db:
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, 1)", (_MIGRATED,))
+    return False
+
+
+def _columns(db, schema):
+    return {r[1] for r in db.execute(f"PRAGMA {schema}.table_info(hits)")}
+
+
+def _migrate_table(db, schema, chunk, echo):
+    if "path" not in _columns(db, schema):
+        return False
+    _add_id_columns(db, schema)
+    try:
+        _fill_ids(db, schema, chunk, echo)
+        # Last step, under the write lock: rows that arrived since the last
+        # pass without ids get them, then the text columns go
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            _fill(db, schema, "path_id IS NULL")
+            for col in COLUMNS:
+                db.execute(f"ALTER TABLE {schema}.hits DROP COLUMN {col}")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    except sqlite3.OperationalError:
+        # Another worker migrating at the same time dropped the columns first
+        if "path" in _columns(db, schema):
+            raise
+        return False
+    return True
+
+
+def _add_id_columns(db, schema):
+    for col in COLUMNS:
+        try:
+            db.execute(f"ALTER TABLE {schema}.hits ADD COLUMN {stored(col)} INTEGER")
+        except sqlite3.OperationalError:
+            pass  # column already exists
+
+
+def _fill_ids(db, schema, chunk, echo):
+    lo, hi = db.execute(f"SELECT MIN(id), MAX(id) FROM {schema}.hits WHERE path_id IS NULL").fetchone()
+    # Rows written meanwhile come with their ids; any without (an import or
+    # worker from before the upgrade) are picked up by the next pass
+    while lo is not None:
+        for a in range(lo, hi + 1, chunk):
+            with db:
+                _fill(db, schema, f"id >= {a} AND id < {a + chunk} AND path_id IS NULL")
+            if echo:
+                echo(f"  {schema}: up to hit #{min(a + chunk - 1, hi)}")
+        lo, hi = db.execute(
+            f"SELECT MIN(id), MAX(id) FROM {schema}.hits WHERE path_id IS NULL"
+        ).fetchone()
+
+
+def _fill(db, schema, where):
+    """Intern the text of the hits matching `where` and store their ids."""
+    for col, table in COLUMNS.items():
+        db.execute(
+            f"INSERT OR IGNORE INTO main.{table} (value) "
+            f"SELECT DISTINCT {col} FROM {schema}.hits WHERE {where} AND {col} IS NOT NULL"
+        )
+    db.execute(
+        f"UPDATE {schema}.hits SET "
+        + ", ".join(f"{stored(col)} = (SELECT id FROM main.{table} WHERE value = {col})"
+                    for col, table in COLUMNS.items())
+        + f" WHERE {where}"
+    )
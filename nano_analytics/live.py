@@ -0,0 +1,168 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from hashlib import blake2b
+
+try:
+    import fcntl
+except ImportError:   # Windows: falls back to a per-process table
+    fcntl = None
+
+from .sites import site_root
+
+# Live view: sessions seen recently per site, shared by all gunicorn workers
+# and the ingest server.
+#
+# Every stored non-bot hit is recorded here as well (routes /hit, /hit/batch,
+# ingest_server), so /api/active and the /api/live event stream answer
+# without touching SQLite.  Like flood.py, the state is a fixed-size mmap'd
+# file next to DB_PATH:
+#
+#   header   sequence number, bumped on every record — readers compare it to
+#            tell whether anything changed
+#   recent   ring of the last RECENT hits (time, site, country, path)
+#   slots    SLOTS session slots (site, session, last seen, country) in
+#            aligned groups of WAYS; a session lives in the group its
+#            (site, session) hash selects and, when the group is full,
+#            replaces the slot seen longest ago
+#
+# Sites are keyed by their registrable root (sites.site_root), so a query for
+# a subdomain counts the whole root domain.  Counting a site's active
+# sessions scans the site column of the table (a few ms for the default
+# 65,536 slots).  Sessions are only evicted when their group is full, so
+# counts are exact until more sessions than slots are live within the
+# window at once.  Writers lock the group (or the header and ring)
+# they change: an fcntl byte-range lock across processes plus one of STRIPES
+# thread locks.  Readers take no lock.
+
+_HEADER  = struct.Struct("<Q56x")            # seq → 64 bytes
+_RECENT  = struct.Struct("<QIII2s2x40s")     # seq, ts, site, path length, country, path → 64 bytes
+_SLOT    = struct.Struct("<III2s2x")         # site, session, last seen, country → 16 bytes
+_WAYS    = 8
+_STRIPES = 64
+
+RECENT   = 256
+SLOTS    = 65536
+WINDOW   = 300     # /api/active default
+HORIZON  = 3600    # longest window answered
+
+
+class LiveTracker:
+    def __init__(self, path=None, slots=SLOTS):
+        self.groups = max(1, slots // _WAYS)
+        self._base  = _HEADER.size + RECENT * _RECENT.size
+        size        = self._base + self.groups * _WAYS * _SLOT.size
+        self._fd    = None
+        if path and fcntl is not None:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        else:
+            self._map = mmap.mmap(-1, size)
+        # Slot fields as uint32 columns: every 4th word is a site tag
+        self._sites   = memoryview(self._map)[self._base:].cast("I")[0::4]
+        self._stripes = [threading.Lock() for _ in range(_STRIPES)]
+        self._header  = threading.Lock()
+
+    # ── Ingest ────────────────────────────────────────────────────────────────
+
+    def record(self, rows):
+        """Record hit tuples (db.HIT_COLUMNS order); bot-flagged ones are skipped."""
+        now = int(time.time())
+        for row in rows:
+            ts, site, path, _ref, _ua, _lang, _w, session, country, bot = row[:10]
+            if bot or ts < now - HORIZON:
+                continue
+            tag = _tag(site_root(site))
+            cc  = (country or "").encode()[:2]
+            self._touch(tag, _tag(f"{tag} {session or ''}"), ts, cc)
+            self._push(tag, ts, cc, path or "")
+
+    def _touch(self, tag, sess, ts, cc):
+        group  = sess % self.groups
+        offset = self._base + group * _WAYS * _SLOT.size
+        with self._locked(self._stripes[group % _STRIPES], offset, _WAYS * _SLOT.size):
+            victim, oldest = None, None
+            for way in range(_WAYS):
+                pos = offset + way * _SLOT.size
+                t, s, seen, _cc = _SLOT.unpack_from(self._map, pos)
+                if t == tag and s == sess:
+                    _SLOT.pack_into(self._map, pos, tag, sess, max(seen, ts), cc)
+                    return
+                if victim is None or seen < oldest:
+                    victim, oldest = pos, seen
+            _SLOT.pack_into(self._map, victim, tag, sess, ts, cc)
+
+    def _push(self, tag, ts, cc, path):
+        data = path.encode()[:40]
+        with self._locked(self._header, 0, self._base):
+            seq = _HEADER.unpack_from(self._map, 0)[0] + 1
+            _RECENT.pack_into(self._map, _HEADER.size + seq % RECENT * _RECENT.size,
+                              seq, ts, tag, len(data), cc, data)
+            _HEADER.pack_into(self._map, 0, seq)
+
+    def _locked(self, lock, offset, length):
+        return _RangeLock(lock, self._fd, offset, length)
+
+    # ── Queries ───────────────────────────────────────────────────────────────
+
+    def seq(self) -> int:
+        """Changes whenever a hit is recorded."""
+        return _HEADER.unpack_from(self._map, 0)[0]
+
+    def active(self, site, window=WINDOW, now=None):
+        """(sessions seen in the last `window` seconds, {country: sessions}) for a site."""
+        tag   = _tag(site_root(site))
+        since = int(now or time.time()) - min(window, HORIZON)
+        total, countries = 0, {}
+        for i, t in enumerate(self._sites):
+            if t != tag:
+                continue
+            _t, _s, seen, cc = _SLOT.unpack_from(self._map, self._base + i * _SLOT.size)
+            if seen >= since:
+                total += 1
+                if cc.strip(b"\0"):
+                    key = cc.decode()
+                    countries[key] = countries.get(key, 0) + 1
+        return total, countries
+
+    def recent(self, site, after=0, limit=20):
+        """Hits recorded for a site after sequence number `after`, oldest first (at most `limit`)."""
+        tag, seq = _tag(site_root(site)), self.seq()
+        out = []
+        for n in range(max(after + 1, seq - RECENT + 1), seq + 1):
+            s, ts, t, length, cc, data = _RECENT.unpack_from(
+                self._map, _HEADER.size + n % RECENT * _RECENT.size)
+            if s == n and t == tag:   # s != n: overwritten since seq was read
+                out.append({"ts": ts, "path": data[:length].decode("utf-8", "replace"),
+                            "country": cc.strip(b"\0").decode() or None})
+        return out[-limit:]
+
+
+class _RangeLock:
+    """Thread lock plus an fcntl lock on [offset, offset + length) of the file."""
+
+    def __init__(self, lock, fd, offset, length):
+        self.lock, self.fd, self.offset, self.length = lock, fd, offset, length
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.fd is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.length, self.offset)
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.offset)
+        self.lock.release()
+
+
+def _tag(text):
+    return int.from_bytes(blake2b(text.encode(), digest_size=4).digest(), "little") or 1
+
+
+def live_from_config(config):
+    path = config.get("LIVE_PATH") or f"{config['DB_PATH']}-live"
+    return LiveTracker(path, slots=int(config.get("LIVE_SLOTS", SLOTS)))
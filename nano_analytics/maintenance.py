@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:   # Windows: no cross-process lock, every process runs the jobs
+    fcntl = None
+
+from .db import connect
+
+# Periodic housekeeping in the background of the web workers.
+#
+# Jobs run every MAINTENANCE_INTERVAL seconds in a daemon thread, started on
+# the first request of each worker.  A non-blocking fcntl lock on
+# DB_PATH-maintenance makes only one gunicorn worker run them at a time; the
+# others skip that round.  A database from before interned ids is migrated
+# by the first job; the others wait for it to finish (they expect the ids).
+
+
+class Maintenance:
+    def __init__(self, db_path, interval=3600, jobs=()):
+        self.db_path  = db_path
+        self.interval = interval
+        self.jobs     = list(jobs)      # (name, fn(db)) pairs
+        self._thread  = None
+        self._pid     = None
+        self._lock    = threading.Lock()
+        self._stop    = threading.Event()
+        self.runs     = 0
+        self.last: dict[str, dict] = {}
+
+    def ensure_started(self):
+        # Threads do not survive fork(): start one inside each worker.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid    = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="nano-analytics-maintenance", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        # First round shortly after startup, then every interval
+        delay = min(60, self.interval)
+        while not self._stop.wait(delay):
+            self.run_once()
+            delay = self.interval
+
+    def run_once(self):
+        """Run every job once if no other process is; returns False if skipped."""
+        lock_fd = None
+        if fcntl is not None:
+            lock_fd = os.open(f"{self.db_path}-maintenance", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(lock_fd)
+                return False
+        try:
+            db = connect(self.db_path)
+            try:
+                for name, job in self.jobs:
+                    t0 = time.monotonic()
+                    try:
+                        result = job(db)
+                        error  = None
+                    except Exception as exc:   # keep the thread alive; report in stats
+                        result, error = None, repr(exc)
+                    self.last[name] = {
+                        "at":       int(time.time()),
+                        "seconds":  round(time.monotonic() - t0, 3),
+                        "result":   result,
+                        "error":    error,
+                    }
+            finally:
+                db.close()
+            self.runs += 1
+            return True
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "runs": self.runs, "jobs": self.last}
+
+
+def maintenance_from_config(config):
+    """Build the Maintenance runner, or None when MAINTENANCE_INTERVAL is 0."""
+    interval = int(config.get("MAINTENANCE_INTERVAL", 3600))
+    if interval <= 0:
+        return None
+    from . import columnar, interning, partitions, retention
+
+    db_path  = config["DB_PATH"]
+    policy   = retention.policy_from_config(config)
+    archives = config.get("COLUMNAR_ARCHIVES", True) and columnar.available()
+    jobs     = [("migrate_interning", lambda db: interning.migrate(db) if interning.pending(db) else 0)]
+    if config.get("PARTITIONS", "monthly") == "monthly":
+        jobs.append(("rotate_partitions", _migrated(lambda db: partitions.rotate(db, db_path))))
+    if policy:
+        jobs.append(("retention", _migrated(lambda db: retention.enforce(db, policy))))
+    if config.get("PARTITIONS", "monthly") == "monthly" and archives:
+        # After retention, which invalidates the archives of months it trims
+        jobs.append(("build_archives", _migrated(columnar.build_missing)))
+    return Maintenance(db_path, interval, jobs)
+
+
+def _migrated(job):
+    """Skip `job` while the interning migration is pending."""
+    from . import interning
+
+    def run(db):
+        if interning.pending(db):
+            return "skipped: interning migration pending"
+        return job(db)
+    return run
@@ -0,0 +1,413 @@
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from bisect import bisect_left
+from hashlib import blake2b
+
+try:
+    import fcntl
+except ImportError:   # Windows: falls back to a per-process table
+    fcntl = None
+
+from flask import current_app, g, has_request_context, request
+
+from . import geo
+from .db import connect
+
+# Prometheus metrics (/metrics), shared by all gunicorn workers and the
+# ingest server.
+#
+# Like flood.py and live.py, the numbers live in a fixed-size mmap'd file
+# next to DB_PATH, so a scrape sees the whole instance whichever worker
+# answers it.  The file holds a table of PROCS process ids and one region of
+# float64 values per process; a process claims a region the first time it
+# records (reclaiming the region of a dead process, whose counters it then
+# carries on from) and is its only writer, so recording takes just a thread
+# lock.  A scrape sums the regions.
+#
+# Per endpoint (request.endpoint; "other" for unmatched URLs):
+#
+#   requests by status class, a latency histogram (handler start to
+#   response returned — for streaming responses, the first byte), and the
+#   SQLite work of the request's pooled connection: rows fetched, counted
+#   by a row factory, and VM instructions in units of STEP, counted by a
+#   progress handler
+#
+# Per process, copied into the region at most every MIRROR seconds:
+# GeoIP lookups and the time spent on cache misses, flood-detector trips,
+# the in-memory response cache's counters (the SQLite cache counts in its
+# own database; /metrics reads it directly) and the ingest queue depth.
+# Counters are copied as increments, so a reclaimed region keeps growing;
+# gauges only count for live processes.  The copies are taken while
+# recording, so another process's last second of activity shows once it
+# records again; the scraped process copies its own at scrape time.
+#
+# Recording a request costs a few microseconds; the progress handler runs
+# once per STEP VM instructions, well under 1% of query time.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROCS   = 64
+STEP    = 1000   # SQLite VM instructions per progress-handler call
+MIRROR  = 1.0    # seconds between copies of per-process counters
+
+_CLASSES  = ("1xx", "2xx", "3xx", "4xx", "5xx")
+_COUNTERS = ("flood_trips", "geo_hits", "geo_misses", "geo_private", "geo_miss_seconds",
+             "cache_hits", "cache_misses", "cache_evictions")
+_GAUGES   = ("ingest_queue_depth",)
+
+# Offsets within an endpoint's block of values
+_REQ    = 0
+_HIST   = _REQ + len(_CLASSES)           # one per bucket, then +Inf
+_SUM    = _HIST + len(BUCKETS) + 1
+_ROWS   = _SUM + 1
+_STEPS  = _ROWS + 1
+_FIELDS = _STEPS + 1
+
+_HEADER = struct.Struct("<32s32x")   # layout digest → 64 bytes
+_PID    = struct.Struct("<Q")
+
+
+class Metrics:
+    def __init__(self, endpoints, path=None):
+        self.endpoints = sorted(set(endpoints) | {"other"})
+        self._index    = {e: i * _FIELDS for i, e in enumerate(self.endpoints)}
+        self._globals  = len(self.endpoints) * _FIELDS
+        self._values   = self._globals + len(_COUNTERS) + len(_GAUGES)
+        self._table    = _HEADER.size
+        self._base     = self._table + PROCS * _PID.size
+        size           = self._base + PROCS * self._values * 8
+        layout         = blake2b(repr((self.endpoints, _CLASSES, BUCKETS, _COUNTERS, _GAUGES))
+                                 .encode(), digest_size=32).digest()
+        self._fd       = None
+        if path and fcntl is not None:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, 0)    # new layout: start over
+                    os.ftruncate(self._fd, size)
+                self._map = mmap.mmap(self._fd, size)
+                if _HEADER.unpack_from(self._map, 0)[0] != layout:
+                    self._map[:] = bytes(size)
+                    _HEADER.pack_into(self._map, 0, layout)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        else:
+            self._map = mmap.mmap(-1, size)
+        self._all    = memoryview(self._map)[self._base:].cast("d")
+        self._lock   = threading.Lock()
+        self._pid    = None
+        self._region = None
+        self._mirror = 0.0
+        self._last   = {}
+        self.sources = []   # callables returning {counter or gauge name: value}
+
+    # ── Recording ─────────────────────────────────────────────────────────────
+
+    def observe(self, endpoint, status, seconds, rows=0, steps=0):
+        """Record one finished request."""
+        base = self._index.get(endpoint, self._index["other"])
+        with self._lock:
+            v = self._claim()
+            v[base + _REQ + min(max(status // 100 - 1, 0), 4)] += 1
+            v[base + _HIST + bisect_left(BUCKETS, seconds)]    += 1
+            v[base + _SUM]   += seconds
+            v[base + _ROWS]  += rows
+            v[base + _STEPS] += steps
+            now = time.monotonic()
+            if now - self._mirror >= MIRROR:
+                self._mirror = now
+                self._copy(v)
+
+    def _copy(self, v):
+        """Add the sources' counter increments to this process's region; set its gauges."""
+        for source in self.sources:
+            for name, value in source().items():
+                if name in _GAUGES:
+                    v[self._globals + len(_COUNTERS) + _GAUGES.index(name)] = value
+                    continue
+                last = self._last.get(name, 0)
+                self._last[name] = value
+                v[self._globals + _COUNTERS.index(name)] += value - last if value >= last else value
+
+    def _claim(self):
+        """This process's region, claimed on first use after start or fork."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._region
+        self._pid, self._last = pid, {}
+        if self._fd is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, PROCS * _PID.size, self._table)
+        try:
+            slot = None
+            for i in range(PROCS):
+                owner = _PID.unpack_from(self._map, self._table + i * _PID.size)[0]
+                if owner == pid:
+                    slot = i
+                    break
+                if slot is None and not _alive(owner):
+                    slot = i
+            if slot is not None:
+                _PID.pack_into(self._map, self._table + slot * _PID.size, pid)
+        finally:
+            if self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, PROCS * _PID.size, self._table)
+        if slot is None:   # more processes than PROCS: count privately, unseen by scrapes
+            self._region = memoryview(mmap.mmap(-1, self._values * 8)).cast("d")
+        else:
+            self._region = self._all[slot * self._values:(slot + 1) * self._values]
+            for i in range(len(_GAUGES)):
+                self._region[self._globals + len(_COUNTERS) + i] = 0
+        return self._region
+
+    # ── Requests ──────────────────────────────────────────────────────────────
+
+    def install(self, app):
+        """Time every request of `app`, count its SQLite work, and copy this process's numbers."""
+        # First, so requests answered by an earlier before_request hook are timed too
+        app.before_request_funcs.setdefault(None, []).insert(0, _start)
+        app.after_request(_returned)
+        app.teardown_request(_finish)
+        flood  = app.extensions["flood"]
+        writer = app.extensions.get("hit_writer")
+        cache  = app.extensions["response_cache"]
+        memory = cache.stats()["backend"] == "memory"
+
+        def read():
+            info = geo.resolver.stats()
+            out  = {
+                "geo_hits":         info["hits"],
+                "geo_misses":       info["misses"],
+                "geo_private":      info["private"],
+                "geo_miss_seconds": info["miss_seconds"],
+                "flood_trips":      flood.trips,
+            }
+            if writer is not None:
+                out["ingest_queue_depth"] = writer.depth()
+            if memory:
+                stats = cache.stats()
+                out.update({f"cache_{k}": stats[k] for k in ("hits", "misses", "evictions")})
+            return out
+
+        self.sources.append(read)
+
+    def watch(self, db):
+        """Count rows and VM steps on `db` for the current request (called by db.get_db)."""
+        if not has_request_context() or "_metrics_t0" not in g:
+            return
+        work = g._metrics_work = _Work()
+        db.row_factory = work.row
+        db.set_progress_handler(work.step, STEP)
+
+    # ── Scrape ────────────────────────────────────────────────────────────────
+
+    def totals(self):
+        """(values summed over all regions, number of live processes).
+
+        Gauges count only for live processes; counters of dead ones stay.
+        """
+        with self._lock:
+            self._copy(self._claim())   # this process's latest numbers
+        total = [0.0] * self._values
+        gauge = self._globals + len(_COUNTERS)
+        procs = 0
+        for i in range(PROCS):
+            pid = _PID.unpack_from(self._map, self._table + i * _PID.size)[0]
+            if not pid:
+                continue
+            alive  = _alive(pid)
+            procs += alive
+            region = self._all[i * self._values:(i + 1) * self._values]
+            for j, x in enumerate(region):
+                if x and (alive or j < gauge):
+                    total[j] += x
+        return total, procs
+
+    def families(self, cache):
+        """Prometheus metric families: (name, type, help, samples).
+
+        A sample is (labels, value), or (suffix, labels, value) for histogram
+        series.  `cache` is the response cache's stats(); a memory cache's
+        counters are per process, so the summed copies replace them.
+        """
+        v, procs = self.totals()
+        out = [
+            ("nano_http_requests_total", "counter", "Requests by endpoint and status class.", [
+                ({"endpoint": e, "code": c}, v[self._index[e] + _REQ + i])
+                for e in self.endpoints for i, c in enumerate(_CLASSES)
+                if v[self._index[e] + _REQ + i]
+            ]),
+        ]
+        hist = []
+        for e in self.endpoints:
+            base  = self._index[e]
+            count = sum(v[base + _HIST:base + _SUM])
+            if not count:
+                continue
+            seen = 0
+            for i, le in enumerate(BUCKETS):
+                seen += v[base + _HIST + i]
+                hist.append(("_bucket", {"endpoint": e, "le": le}, seen))
+            hist.append(("_bucket", {"endpoint": e, "le": "+Inf"}, count))
+            hist.append(("_sum", {"endpoint": e}, v[base + _SUM]))
+            hist.append(("_count", {"endpoint": e}, count))
+        out.append(("nano_http_request_duration_seconds", "histogram",
+                    "Time from request start to response returned (first byte when streamed).", hist))
+        for name, field, scale, text in (
+            ("nano_sqlite_rows_total", _ROWS, 1, "Rows fetched from SQLite, by endpoint."),
+            ("nano_sqlite_vm_steps_total", _STEPS, STEP,
+             f"SQLite VM instructions, by endpoint (counted in units of {STEP})."),
+        ):
+            out.append((name, "counter", text, [
+                ({"endpoint": e}, v[self._index[e] + field] * scale)
+                for e in self.endpoints if v[self._index[e] + field]
+            ]))
+        c = dict(zip(_COUNTERS, v[self._globals:]))
+        g = dict(zip(_GAUGES, v[self._globals + len(_COUNTERS):]))
+        out += [
+            ("nano_flood_trips_total", "counter", "Hits flagged as bot by the flood detector.",
+             [({}, c["flood_trips"])]),
+            ("nano_geo_lookups_total", "counter", "GeoIP lookups by outcome.",
+             [({"result": r}, c[f"geo_{r}"]) for r in ("hits", "misses", "private")]),
+            ("nano_geo_miss_seconds_total", "counter", "Time spent resolving GeoIP cache misses.",
+             [({}, c["geo_miss_seconds"])]),
+            ("nano_ingest_queue_depth", "gauge", "Hits waiting in buffered ingest writers.",
+             [({}, g["ingest_queue_depth"])]),
+            ("nano_processes", "gauge", "Processes reporting metrics.", [({}, procs)]),
+        ]
+        if cache["backend"] == "memory":
+            cache = {**cache, **{k[6:]: c[k] for k in _COUNTERS if k.startswith("cache_")}}
+        for name in ("hits", "misses", "evictions"):
+            out.append((f"nano_cache_{name}_total", "counter", f"Response cache {name}.",
+                        [({"backend": cache["backend"]}, cache[name])]))
+        out.append(("nano_cache_bytes", "gauge", "Bytes held by the response cache.",
+                    [({"backend": cache["backend"]}, cache["bytes"])]))
+        return out
+
+
+def render(families):
+    """Prometheus text exposition format (0.0.4)."""
+    out = []
+    for name, kind, text, samples in families:
+        out.append(f"# HELP {name} {text}")
+        out.append(f"# TYPE {name} {kind}")
+        for sample in samples:
+            suffix, (labels, value) = ("", sample) if len(sample) == 2 else (sample[0], sample[1:])
+            out.append(f"{name}{suffix}{_labels(labels)} {_number(value)}")
+    return "\n".join(out) + "\n"
+
+
+def scrape(app):
+    """/metrics body: the shared values plus file sizes and this worker's pool."""
+    metrics  = app.extensions["metrics"]
+    cache    = app.extensions["response_cache"]
+    families = metrics.families(cache.stats())
+    db_path  = app.config["DB_PATH"]
+    db       = connect(db_path)
+    try:
+        parts = db.execute("SELECT path, cols FROM partitions").fetchall()
+    finally:
+        db.close()
+    files = {
+        "db":         [db_path],
+        "wal":        [f"{db_path}-wal"],
+        "cache":      [getattr(cache, "path", None)],
+        "partitions": [p["path"] for p in parts],
+        "archives":   [p["cols"] for p in parts],
+    }
+    families.append(("nano_db_file_bytes", "gauge", "Size of the SQLite files and archives.", [
+        ({"file": name}, sum(os.path.getsize(p) for p in paths if p and os.path.exists(p)))
+        for name, paths in files.items()
+    ]))
+    pool = app.extensions["db_pool"].stats()
+    families.append(("nano_db_pool_connections", "gauge", "Pooled connections of the scraped worker.",
+                     [({"state": "open"}, pool["open"]), ({"state": "idle"}, pool["idle"])]))
+    return render(families)
+
+
+# ── Request hooks ──────────────────────────────────────────────────────────────
+
+class _Work:
+    """SQLite work of one request's connection."""
+
+    __slots__ = ("rows", "steps")
+
+    def __init__(self):
+        self.rows = self.steps = 0
+
+    def row(self, cursor, row):
+        self.rows += 1
+        return sqlite3.Row(cursor, row)
+
+    def step(self):
+        self.steps += 1
+        return 0
+
+
+def _start():
+    g._metrics_t0 = time.perf_counter()
+
+
+def _returned(response):
+    # Latency ends when the handler returns: a streamed body (/api/export,
+    # /api/live) is still being sent when the request is torn down.
+    g._metrics_done = (time.perf_counter() - g._metrics_t0, response.status_code)
+    return response
+
+
+def _finish(exc=None):
+    t0 = g.pop("_metrics_t0", None)
+    if t0 is None:
+        return
+    seconds, status = g.pop("_metrics_done", (time.perf_counter() - t0, 500))
+    if exc is not None:
+        status = 500
+    work = g.pop("_metrics_work", None)
+    db   = g.get("_db")
+    if work is not None and db is not None:
+        db.row_factory = sqlite3.Row
+        db.set_progress_handler(None, 0)
+    current_app.extensions["metrics"].observe(
+        request.endpoint or "other", status, seconds,
+        work.rows if work else 0, work.steps if work else 0,
+    )
+
+
+# ── Helpers ────────────────────────────────────────────────────────────────────
+
+def _alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:   # exists, owned by someone else
+        return True
+    return True
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in labels.items()
+    )
+    return "{" + inner + "}"
+
+
+def _number(x):
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return repr(x)
+
+
+def metrics_from_config(config, endpoints):
+    if not config.get("METRICS"):
+        return None
+    path = config.get("METRICS_PATH") or f"{config['DB_PATH']}-metrics"
+    return Metrics(endpoints, path)
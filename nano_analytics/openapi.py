@@ -91,6 +91,37 @@ SPEC = {
                 "responses": {"200": {"description": "1×1 transparent GIF"}},
             }
         },
+        "/hit/batch": {
+            "post": {
+                "summary": "Record several pageviews at once (beacon)",
+                "description": "Body: a JSON array, or NDJSON, of up to 100 events with the /hit fields plus optional `ago` (seconds since the event, max 3600). Inserted in one transaction; User-Agent and client IP come from the request. Any Content-Type is accepted (navigator.sendBeacon sends text/plain).",
+                "requestBody": {
+                    "required": True,
+                    "content": {"application/json": {"schema": {
+                        "type": "array",
+                        "maxItems": 100,
+                        "items": {
+                            "type": "object",
+                            "required": ["site"],
+                            "properties": {
+                                "site": {"type": "string"},
+                                "path": {"type": "string"},
+                                "ref":  {"type": "string"},
+                                "lang": {"type": "string"},
+                                "w":    {"type": "integer"},
+                                "s":    {"type": "string", "description": "Session ID"},
+                                "ago":  {"type": "integer", "description": "Seconds since the event happened"},
+                            },
+                        },
+                    }}},
+                },
+                "responses": {
+                    "200": {"description": '{"accepted": n, "rejected": n} — malformed events are skipped'},
+                    "400": {"description": "Body is not a JSON array / NDJSON, or has more than 100 events"},
+                    "413": {"description": "Body larger than 64 KB"},
+                },
+            }
+        },
         "/health": {
             "get": {
                 "summary": "Health check",
@@ -98,12 +129,14 @@ SPEC = {
             }
         },
         "/api/pageviews": _stats_path(
-            "Total pageviews and unique sessions",
+            "Total pageviews and unique sessions. Sessions over long ranges are a HyperLogLog estimate (see mode/error); pass exact=1 for an exact count.",
             response_schema={
                 "type": "object",
                 "properties": {
                     "views":    {"type": "integer"},
                     "sessions": {"type": "integer"},
+                    "mode":     {"type": "string", "enum": ["exact", "sketch"], "description": "How sessions was computed"},
+                    "error":    {"type": "number", "description": "Relative standard error of sessions (0 when exact)"},
                 },
             },
         ),
@@ -188,9 +221,24 @@ SPEC = {
                 },
             },
         ),
+        "/api/report": {
+            "get": {
+                "summary": "Several stats panels in one request, computed from a single scan of the filtered range. Each key of the response holds the same payload as the /api/<panel> endpoint of that name.",
+                "security": [{"BearerAuth": []}],
+                "parameters": list(_COMMON_PARAMS) + [
+                    _LIMIT_PARAM,
+                    {"name": "panels", "in": "query", "required": False, "schema": {"type": "string"},
+                     "description": "Comma-separated panel names, e.g. pageviews,pages,referrers,timeseries,devices,countries. Default: all panels"},
+                ],
+                "responses": {
+                    "200": {"description": "OK", "content": {"application/json": {"schema": {"type": "object"}}}},
+                    "401": {"description": "Unauthorized"},
+                },
+            }
+        },
         "/api/active": {
             "get": {
-                "summary": "Active unique sessions in the last N seconds (default 300 = 5 min), with per-country breakdown. Use for real-time visitor map.",
+                "summary": "Active unique sessions in the last N seconds (default 300 = 5 min), with per-country breakdown. Use for real-time visitor map. Answered from memory shared by the workers, not from the database; /api/live pushes the same payload as it changes.",
                 "security": [{"BearerAuth": []}],
                 "parameters": [
                     {"name": "site",   "in": "query", "required": True,  "schema": {"type": "string"}},
@@ -215,6 +263,21 @@ SPEC = {
                 },
             }
         },
+        "/api/live": {
+            "get": {
+                "summary": "Server-Sent Events stream of live activity for a site: `active` events carry the /api/active payload whenever it changes, `hits` events list the hits recorded since the previous event ({ts, path, country}). The stream ends after LIVE_STREAM_SECONDS (default 300); reconnect.",
+                "security": [{"BearerAuth": []}],
+                "parameters": [
+                    {"name": "site",   "in": "query", "required": True,  "schema": {"type": "string"}},
+                    {"name": "window", "in": "query", "required": False, "schema": {"type": "integer", "default": 300, "maximum": 3600}, "description": "Lookback window in seconds for active sessions"},
+                ],
+                "responses": {
+                    "200": {"description": "text/event-stream", "content": {"text/event-stream": {}}},
+                    "400": {"description": "Missing site"},
+                    "401": {"description": "Unauthorized"},
+                },
+            }
+        },
         "/api/hostnames": _stats_path(
             "Pageview breakdown by exact hostname (subdomain breakdown). Accepts root domain or any subdomain — all subdomains are matched automatically.",
             has_limit=True,
@@ -271,5 +334,40 @@ SPEC = {
                 },
             },
         ),
+        "/api/export": {
+            "get": {
+                "summary": "Stream raw hits for a site and range, in id order, as NDJSON (one object per line) or CSV with a header row. Gzip-compressed when the client sends Accept-Encoding: gzip.",
+                "description": "A response stops after `limit` rows or EXPORT_MAX_SECONDS (default 20 s). To export everything, repeat with after=<id of the last row received> until a response holds no rows.",
+                "security": [{"BearerAuth": []}],
+                "parameters": list(_COMMON_PARAMS) + [
+                    {"name": "format", "in": "query", "required": False, "schema": {"type": "string", "enum": ["ndjson", "csv"], "default": "ndjson"}},
+                    {"name": "after",  "in": "query", "required": False, "schema": {"type": "integer", "default": 0},
+                     "description": "Only hits with a greater id — the id of the last row of the previous response"},
+                    {"name": "limit",  "in": "query", "required": False, "schema": {"type": "integer"},
+                     "description": "Maximum rows in this response"},
+                    {"name": "bots",   "in": "query", "required": False, "schema": {"type": "integer", "enum": [0, 1], "default": 0},
+                     "description": "1 to include hits flagged as bot (see the bot column)"},
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Rows with id, ts, site, path, ref, ua, lang, w, session, country, bot, device, browser, os",
+                        "content": {"application/x-ndjson": {}, "text/csv": {}},
+                    },
+                    "400": {"description": "Missing site or unknown format"},
+                    "401": {"description": "Unauthorized"},
+                },
+            }
+        },
+        "/metrics": {
+            "get": {
+                "summary": "Prometheus metrics for the whole instance: request latency histograms, SQLite rows and VM steps per endpoint, response cache, flood detector, GeoIP, ingest queue and file sizes.",
+                "security": [{"BearerAuth": []}],
+                "responses": {
+                    "200": {"description": "Prometheus text exposition format", "content": {"text/plain": {}}},
+                    "401": {"description": "Unauthorized"},
+                    "404": {"description": "Metrics are disabled (METRICS=0)"},
+                },
+            }
+        },
     },
 }
@@ -0,0 +1,289 @@
+import itertools
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Monthly partitions of the hits table.
+#
+# The main database keeps the hot data: hits of the current month (and of
+# the previous one for a day of grace), plus rollups, sessions and meta.
+# rotate() moves every closed month into its own file next to DB_PATH
+# (analytics.db -> analytics-2026-09.db) and records it in the `partitions`
+# table.  Queries attach only the partitions overlapping their range,
+# read-only with a large mmap window, and read the UNION ALL of those and
+# main.hits, so COUNT(DISTINCT session) and friends stay exact across months.
+#
+# Rotation is crash-safe: rows are copied first, the partition is then
+# registered as 'draining' (queries skip main rows with id <= max_id of that
+# month), and the copies are deleted from main in short batches.  Late rows
+# for an archived month stay in main until the next rotation appends them.
+#
+# SQLite limits attached databases per connection (10 by default).  Ranges
+# needing more partitions than that are staged into a temp table, one group
+# of partitions at a time, filtered by the query's WHERE clause.
+
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    month  TEXT PRIMARY KEY,
+    path   TEXT    NOT NULL,
+    lo     INTEGER NOT NULL,
+    hi     INTEGER NOT NULL,
+    max_id INTEGER NOT NULL,
+    rows   INTEGER NOT NULL DEFAULT 0,
+    state  TEXT    NOT NULL DEFAULT 'draining'
+);
+"""
+
+STAGED_PREFIX = "staged_hits_"
+_FOREVER      = 1 << 62
+_ALIAS_RE     = re.compile(r"^p\d{4}_\d{2}$")
+_staged_seq   = itertools.count(1)
+
+
+def init(db):
+    db.executescript(SCHEMA)
+    try:
+        # Path of the columnar copy (see columnar.py), NULL until built
+        db.execute("ALTER TABLE partitions ADD COLUMN cols TEXT")
+        db.commit()
+    except Exception:
+        pass  # column already exists
+
+
+# ── Months and files ───────────────────────────────────────────────────────────
+
+def month_of(ts: int) -> str:
+    return time.strftime("%Y-%m", time.gmtime(ts))
+
+
+def month_bounds(month: str) -> tuple[int, int]:
+    """[lo, hi) UTC timestamps of a 'YYYY-MM' month."""
+    year, mon = map(int, month.split("-"))
+    lo = int(datetime(year, mon, 1, tzinfo=timezone.utc).timestamp())
+    nxt = datetime(year + mon // 12, mon % 12 + 1, 1, tzinfo=timezone.utc)
+    return lo, int(nxt.timestamp())
+
+
+def path_for(db_path: str, month: str) -> str:
+    root, ext = os.path.splitext(db_path)
+    return f"{root}-{month}{ext or '.db'}"
+
+
+def alias(month: str) -> str:
+    return "p" + month.replace("-", "_")
+
+
+def columns(db) -> list[str]:
+    return [r[1] for r in db.execute("PRAGMA main.table_info(hits)")]
+
+
+# ── Query side ─────────────────────────────────────────────────────────────────
+
+def overlapping(db, start=None, end=None, skip=None):
+    """Registered partitions with rows in [start, end], minus those wholly inside skip=[lo, hi)."""
+    rows = db.execute(
+        "SELECT * FROM partitions WHERE hi > ? AND lo <= ? ORDER BY month",
+        (start or 0, end or _FOREVER),
+    ).fetchall()
+    if skip:
+        rows = [p for p in rows if not (p["lo"] >= skip[0] and p["hi"] <= skip[1])]
+    return rows
+
+
+def budget(db) -> int:
+    """Partitions that may be attached at once (one slot is left for rotate())."""
+    return db.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - 1
+
+
+def attach(db, parts, mmap_size=1024 * 1024 * 1024):
+    """Attach `parts` read-only, detaching other partitions if slots run out."""
+    current = {r[1] for r in db.execute("PRAGMA database_list") if _ALIAS_RE.match(r[1])}
+    wanted  = {alias(p["month"]) for p in parts}
+    if len(current | wanted) > budget(db):
+        for name in current - wanted:
+            db.execute(f"DETACH DATABASE {name}")
+        current &= wanted
+    for p in parts:
+        name = alias(p["month"])
+        if name in current:
+            continue
+        db.execute(f"ATTACH DATABASE ? AS {name}", (Path(p["path"]).resolve().as_uri() + "?mode=ro",))
+        db.execute(f"PRAGMA {name}.mmap_size={int(mmap_size)}")
+
+
+def main_filter(parts) -> str:
+    """SQL condition hiding main rows already copied into a draining partition."""
+    conds = [
+        f"NOT (ts >= {int(p['lo'])} AND ts < {int(p['hi'])} AND id <= {int(p['max_id'])})"
+        for p in parts if p["state"] == "draining"
+    ]
+    return " AND ".join(conds) or "1"
+
+
+def tables(db, start=None, end=None, mmap_size=1024 * 1024 * 1024):
+    """Table names holding hits in [start, end], attached; None if they cannot all be attached.
+
+    Callers join these directly (e.g. with INDEXED BY), so a draining
+    partition, whose copies must be filtered out of main, also returns None.
+    """
+    parts = overlapping(db, start, end)
+    if len(parts) > budget(db) or any(p["state"] == "draining" for p in parts):
+        return None
+    attach(db, parts, mmap_size)
+    return ["main.hits"] + [f"{alias(p['month'])}.hits" for p in parts]
+
+
+def source(db, start=None, end=None, where="1", params=(), skip=None,
+           mmap_size=1024 * 1024 * 1024, exclude=()):
+    """FROM target for hits in [start, end].
+
+    Returns "hits" when no partition overlaps, a UNION ALL subquery aliased
+    `hits` when the overlapping partitions can be attached together, or the
+    name of a temp table holding the rows matching `where` otherwise (drop it
+    with release()).  `skip` is a [lo, hi) range the caller answers from
+    rollups; partitions inside it are not read, nor are the `exclude` months
+    (answered from their columnar archives).  Call outside a transaction:
+    staging commits.
+    """
+    parts = [p for p in overlapping(db, start, end, skip) if p["month"] not in exclude]
+    if not parts:
+        return "hits"
+    cols = ", ".join(columns(db))
+    main = f"SELECT {cols} FROM main.hits WHERE {main_filter(parts)}"
+    if len(parts) <= budget(db):
+        attach(db, parts, mmap_size)
+        legs = [main] + [f"SELECT {cols} FROM {alias(p['month'])}.hits" for p in parts]
+        return "(" + " UNION ALL ".join(legs) + ") AS hits"
+
+    name = f"{STAGED_PREFIX}{next(_staged_seq)}"
+    db.execute(f"CREATE TEMP TABLE {name} AS {main} AND ({where})", list(params))
+    size = budget(db)
+    for i in range(0, len(parts), size):
+        group = parts[i:i + size]
+        attach(db, group, mmap_size)
+        with db:   # DETACH is refused inside the transaction the INSERTs open
+            for p in group:
+                db.execute(
+                    f"INSERT INTO temp.{name} SELECT {cols} FROM {alias(p['month'])}.hits WHERE {where}",
+                    list(params),
+                )
+    return name
+
+
+def release(db):
+    """Drop temp tables created by source() on this connection."""
+    for (name,) in db.execute(
+        "SELECT name FROM temp.sqlite_master WHERE type = 'table' AND name LIKE ?",
+        (STAGED_PREFIX + "%",),
+    ).fetchall():
+        db.execute(f"DROP TABLE IF EXISTS temp.{name}")
+
+
+# ── Rotation ───────────────────────────────────────────────────────────────────
+
+def rotate(db, db_path, now=None, grace=DAY, chunk=5000, echo=None):
+    """Move hits of closed months from main into partition files.
+
+    A month is closed once it ended more than `grace` seconds ago.  Returns
+    the number of rows moved.
+    """
+    now    = int(now or time.time())
+    cutoff = month_bounds(month_of(now - grace))[0]
+    for part in db.execute("SELECT * FROM partitions WHERE state = 'draining'").fetchall():
+        _drain(db, part, chunk)
+    row = db.execute("SELECT MIN(ts) FROM hits WHERE ts < ?", (cutoff,)).fetchone()
+    if row[0] is None:
+        return 0
+    moved = 0
+    month = month_of(row[0])
+    while month_bounds(month)[0] < cutoff:
+        n = _archive_month(db, db_path, month, chunk)
+        if n and echo:
+            echo(f"  {month}: {n} hits")
+        moved += n
+        month = month_of(month_bounds(month)[1])
+    return moved
+
+
+def _archive_month(db, db_path, month, chunk):
+    lo, hi = month_bounds(month)
+    part   = db.execute("SELECT * FROM partitions WHERE month = ?", (month,)).fetchone()
+    max_id = db.execute(
+        "SELECT MAX(id) FROM hits WHERE ts >= ? AND ts < ?", (lo, hi)
+    ).fetchone()[0]
+    if max_id is None:
+        return 0
+
+    path = part["path"] if part else path_for(db_path, month)
+    if part is None:
+        for suffix in ("", "-journal"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)   # left over by an interrupted rotation
+    db.execute("ATTACH DATABASE ? AS dest", (path,))
+    try:
+        if part is None:
+            db.execute("PRAGMA dest.auto_vacuum = INCREMENTAL")   # retention can shrink it
+            _create_schema(db)
+        else:
+            # Rows copied by an interrupted append were never registered
+            with db:
+                db.execute("DELETE FROM dest.hits WHERE id > ?", (part["max_id"],))
+        cols = ", ".join(r[1] for r in db.execute("PRAGMA dest.table_info(hits)"))
+        with db:
+            n = db.execute(
+                f"INSERT INTO dest.hits ({cols}) SELECT {cols} FROM main.hits "
+                f"WHERE ts >= ? AND ts < ? AND id <= ?",
+                (lo, hi, max_id),
+            ).rowcount
+        if part is None:
+            _create_indexes(db)
+    finally:
+        db.execute("DETACH DATABASE dest")
+
+    with db:
+        db.execute(
+            "INSERT INTO partitions (month, path, lo, hi, max_id, rows, state) "
+            "VALUES (?,?,?,?,?,?,'draining') "
+            "ON CONFLICT (month) DO UPDATE SET max_id = excluded.max_id, "
+            "rows = rows + excluded.rows, state = 'draining', cols = NULL",
+            (month, path, lo, hi, max_id, n),
+        )
+    _drain(db, db.execute("SELECT * FROM partitions WHERE month = ?", (month,)).fetchone(), chunk)
+    return n
+
+
+def _create_schema(db):
+    for (sql,) in db.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'hits'"
+    ).fetchall():
+        db.execute(re.sub(r"^CREATE TABLE \"?hits\"?", "CREATE TABLE dest.hits", sql))
+
+
+def _create_indexes(db):
+    for (sql,) in db.execute(
+        "SELECT sql FROM main.sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'hits' AND sql IS NOT NULL"
+    ).fetchall():
+        db.execute(re.sub(r"^CREATE INDEX (\w+)", r"CREATE INDEX dest.\1", sql))
+
+
+def _drain(db, part, chunk):
+    """Delete main rows copied into `part`, walking id ranges in short transactions."""
+    lo_id = db.execute(
+        "SELECT MIN(id) FROM hits WHERE ts >= ? AND ts < ? AND id <= ?",
+        (part["lo"], part["hi"], part["max_id"]),
+    ).fetchone()[0]
+    if lo_id is not None:
+        for a in range(lo_id, part["max_id"] + 1, chunk):
+            with db:
+                db.execute(
+                    "DELETE FROM hits WHERE id >= ? AND id < ? AND id <= ? AND ts >= ? AND ts < ?",
+                    (a, a + chunk, part["max_id"], part["lo"], part["hi"]),
+                )
+    with db:
+        db.execute("UPDATE partitions SET state = 'ready' WHERE month = ?", (part["month"],))
@@ -0,0 +1,208 @@
+import os
+import time
+
+from . import buckets, rollups
+from .sites import site_root
+
+# Raw-data retention: hits (and the per-session rows derived from them) older
+# than RETENTION_DAYS are deleted; rollups and session sketches are kept, so
+# unfiltered history stays available at daily/hourly resolution.
+#
+# RETENTION_SITES overrides the default per root site, e.g.
+# "example.com=30,shop.example.org=365" (0 = keep forever).  Cutoffs are
+# whole UTC days.  enforce() runs from the maintenance thread: it deletes in
+# short batches through the (root_site, bot, ts) index, drops monthly
+# partitions that are entirely expired, and gives the space back with
+# incremental_vacuum.
+#
+# The `retention` table records how far each site has been purged, so
+# `rebuild-rollups` leaves the rollups of purged days alone.  Nothing is
+# deleted while rollup coverage is incomplete: those rows would be lost
+# without a trace.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS retention (
+    root_site     TEXT PRIMARY KEY,
+    purged_before INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+DAY = 86400
+
+# rebuild-rollups joins hits with this to skip rows of purged days
+RETAINED_JOIN  = "LEFT JOIN retention r ON r.root_site = site_root(site)"
+RETAINED_WHERE = "ts >= COALESCE(r.purged_before, 0)"
+
+
+def init(db):
+    db.executescript(SCHEMA)
+
+
+class Policy:
+    def __init__(self, days=0, sites=None):
+        self.days  = days
+        self.sites = dict(sites or {})   # root site -> days
+
+    def __bool__(self):
+        return bool(self.days) or any(self.sites.values())
+
+    def cutoff(self, root, now):
+        """UTC midnight before which a site's raw hits expire, or None to keep them."""
+        days = self.sites.get(root, self.days)
+        if not days:
+            return None
+        t = now - days * DAY
+        return t - t % DAY
+
+
+def policy_from_config(config):
+    """Parse RETENTION_DAYS / RETENTION_SITES ("site=days,..."); an empty Policy keeps all."""
+    sites = {}
+    for item in str(config.get("RETENTION_SITES", "")).split(","):
+        name, _, days = item.strip().partition("=")
+        if name and days.strip().isdigit():
+            sites[site_root(name.strip())] = int(days)
+    return Policy(int(config.get("RETENTION_DAYS", 0)), sites)
+
+
+# ── Enforcement ────────────────────────────────────────────────────────────────
+
+def enforce(db, policy, now=None, chunk=5000, vacuum_pages=2048):
+    """Apply `policy` once; returns counts of what was removed."""
+    stats = {"hits": 0, "sessions": 0, "partitions_dropped": 0, "pages_freed": 0}
+    if not policy:
+        return stats
+    covered = db.execute(
+        f"SELECT MAX(value) FROM meta WHERE key IN ({','.join('?' * len(rollups.COVERAGE_KEYS))})",
+        rollups.COVERAGE_KEYS,
+    ).fetchone()[0]
+    if covered:
+        stats["skipped"] = "rollups do not cover old hits yet: run `flask rebuild-rollups`"
+        return stats
+    now   = int(now or time.time())
+    roots = {r[0] for r in db.execute("SELECT DISTINCT root_site FROM hits")}
+    roots |= set(policy.sites)
+
+    for part in db.execute("SELECT * FROM partitions WHERE state = 'ready' ORDER BY month").fetchall():
+        _enforce_partition(db, part, policy, now, chunk, stats)
+
+    for root in sorted(roots):
+        cutoff = policy.cutoff(root, now)
+        if cutoff is None:
+            continue
+        _mark_purged(db, root, cutoff)
+        stats["hits"]     += _delete(db, "main", root, cutoff, chunk)
+        stats["sessions"] += _delete_sessions(db, root, cutoff, chunk)
+
+    stats["pages_freed"] = _incremental_vacuum(db, "main", vacuum_pages)
+    if stats["hits"]:
+        buckets.invalidate(db)   # filtered charts read raw hits
+    return stats
+
+
+def _mark_purged(db, root, cutoff):
+    # Recorded before deleting, so a concurrent rollup rebuild already spares these days
+    with db:
+        db.execute(
+            "INSERT INTO retention (root_site, purged_before) VALUES (?, ?) "
+            "ON CONFLICT (root_site) DO UPDATE SET "
+            "purged_before = MAX(purged_before, excluded.purged_before)",
+            (root, cutoff),
+        )
+
+
+def _delete(db, schema, root, cutoff, chunk):
+    """Delete a site's hits before cutoff from one database, `chunk` rows per transaction."""
+    done = 0
+    for bot in (0, 1):
+        while True:
+            with db:
+                n = db.execute(
+                    f"DELETE FROM {schema}.hits WHERE id IN ("
+                    f"  SELECT id FROM {schema}.hits WHERE root_site = ? AND bot = ? AND ts < ? LIMIT ?"
+                    f")",
+                    (root, bot, cutoff, chunk),
+                ).rowcount
+            done += n
+            if n < chunk:
+                break
+    return done
+
+
+def _delete_sessions(db, root, cutoff, chunk):
+    done = 0
+    while True:
+        with db:
+            n = db.execute(
+                "DELETE FROM sessions WHERE (site, session) IN ("
+                "  SELECT site, session FROM sessions WHERE root_site = ? AND last_ts < ? LIMIT ?"
+                ")",
+                (root, cutoff, chunk),
+            ).rowcount
+        done += n
+        if n < chunk:
+            return done
+
+
+def _enforce_partition(db, part, policy, now, chunk, stats):
+    """Drop a wholly expired partition file, or delete the expired sites' rows from it."""
+    db.execute("ATTACH DATABASE ? AS purge", (part["path"],))
+    try:
+        roots   = [r[0] for r in db.execute("SELECT DISTINCT root_site FROM purge.hits")]
+        cutoffs = {root: policy.cutoff(root, now) for root in roots}
+        if roots and all(c is not None and c >= part["hi"] for c in cutoffs.values()):
+            expired = True
+        else:
+            expired = False
+            deleted = 0
+            for root, cutoff in cutoffs.items():
+                if cutoff is not None and cutoff > part["lo"]:
+                    _mark_purged(db, root, cutoff)
+                    deleted += _delete(db, "purge", root, cutoff, chunk)
+            if deleted:
+                with db:
+                    # The columnar copy is stale until the maintenance job rebuilds it
+                    db.execute(
+                        "UPDATE partitions SET rows = rows - ?, cols = NULL WHERE month = ?",
+                        (deleted, part["month"]),
+                    )
+                _incremental_vacuum(db, "purge", None)
+                stats["hits"] += deleted
+    finally:
+        db.execute("DETACH DATABASE purge")
+    if expired:
+        for root, cutoff in cutoffs.items():
+            _mark_purged(db, root, cutoff)
+        with db:
+            db.execute("DELETE FROM partitions WHERE month = ?", (part["month"],))
+        for path in (part["path"], part["path"] + "-journal", part["cols"]):
+            if path and os.path.exists(path):
+                os.remove(path)
+        stats["hits"] += part["rows"]
+        stats["partitions_dropped"] += 1
+
+
+def _incremental_vacuum(db, schema, pages):
+    """Return free pages to the filesystem, `pages` per step (None: all at once).
+
+    Databases created before auto_vacuum was enabled only reuse their free
+    pages; `flask apply-retention --vacuum` converts them once.
+    """
+    if db.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+        return 0
+    start = free = db.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+    while free:
+        step = free if pages is None else min(free, pages)
+        # executescript() steps the pragma to completion; execute() frees one page
+        db.executescript(f"PRAGMA {schema}.incremental_vacuum({int(step)})")
+        left = db.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+        if left >= free:
+            break
+        free = left
+    return start - free
+
+
+def vacuum(db):
+    """Rewrite the main database with auto_vacuum=INCREMENTAL (needs free disk ~ its size)."""
+    db.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+    db.execute("VACUUM")
@@ -0,0 +1,392 @@
+import time
+
+from . import buckets, hll, interning, partitions, retention
+from .sites import site_root
+
+# Pre-aggregated views/sessions per (site, bucket, dimension value).
+#
+# rollup_daily  — one row per UTC day for every dimension in DIMS, plus the
+#                 site total under dim = ''.
+# rollup_hourly — site totals per UTC hour (hourly timeseries, peak hours).
+# session_sketches — HyperLogLog sketch of session IDs per (site, UTC day), so
+#                 distinct sessions over any range come from merging sketches.
+#
+# Sessions are distinct sessions *within the bucket*, so they are exact per
+# bucket but not additive across buckets.  They are counted per root site: a
+# session seen on several hostnames of one root is counted on only one of
+# them, so summing a root's rows gives its distinct sessions (a query for a
+# single subdomain reads sessions from raw hits instead).  Ingest finds the
+# keys a session already counted from its earlier hits, through the (site,
+# session) index on the hostnames that have rollups that day.  Hits without
+# a session id all share session '', which would mean scanning every such
+# hit; `anon` counts their views per row instead, so whether '' already
+# counted a key is one primary-key probe.  Ingest keeps all tables current
+# (apply() runs in the same transaction as the hit INSERT); `flask
+# rebuild-rollups` recomputes them from raw hits.  meta.rollup_since and
+# meta.sketch_since record from which timestamp each is complete — queries
+# never read buckets before it.
+
+DAY  = 86400
+HOUR = 3600
+
+# rollup dim -> hits column
+DIMS = {
+    "path":    "path",
+    "ref":     "ref",
+    "country": "country",
+    "lang":    "lang",
+    "w":       "w",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value
+);
+
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    site      TEXT    NOT NULL,
+    root_site TEXT,
+    dim      TEXT    NOT NULL,
+    bucket   INTEGER NOT NULL,
+    value             NOT NULL,
+    views    INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    anon     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (site, dim, bucket, value)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_hourly (
+    site      TEXT    NOT NULL,
+    root_site TEXT,
+    bucket   INTEGER NOT NULL,
+    views    INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    anon     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (site, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS session_sketches (
+    site      TEXT    NOT NULL,
+    root_site TEXT,
+    bucket INTEGER NOT NULL,
+    sketch BLOB    NOT NULL,
+    PRIMARY KEY (site, bucket)
+) WITHOUT ROWID;
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_rollup_daily_root  ON rollup_daily(root_site, dim, bucket);
+CREATE INDEX IF NOT EXISTS idx_rollup_hourly_root ON rollup_hourly(root_site, bucket);
+CREATE INDEX IF NOT EXISTS idx_sketches_root      ON session_sketches(root_site, bucket);
+"""
+
+COVERAGE_KEYS = ("rollup_since", "sketch_since")
+
+# meta key set once session columns are counted per root site (see above)
+_ROOT_SESSIONS = "rollup_sessions_by_root"
+
+_UPSERT_DAILY = (
+    "INSERT INTO rollup_daily (site, root_site, dim, bucket, value, views, sessions, anon) "
+    "VALUES (?,?,?,?,?,?,?,?) "
+    "ON CONFLICT (site, dim, bucket, value) DO UPDATE SET "
+    "views = views + excluded.views, sessions = sessions + excluded.sessions, "
+    "anon = anon + excluded.anon"
+)
+_UPSERT_HOURLY = (
+    "INSERT INTO rollup_hourly (site, root_site, bucket, views, sessions, anon) VALUES (?,?,?,?,?,?) "
+    "ON CONFLICT (site, bucket) DO UPDATE SET "
+    "views = views + excluded.views, sessions = sessions + excluded.sessions, "
+    "anon = anon + excluded.anon"
+)
+
+
+def init(db):
+    """Create rollup tables; on a pre-existing database coverage starts at the next UTC day."""
+    db.executescript(SCHEMA)
+    for table in ("rollup_daily", "rollup_hourly", "session_sketches"):
+        try:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN root_site TEXT")
+        except Exception:
+            pass  # column already exists
+        with db:
+            db.execute(f"UPDATE {table} SET root_site = site_root(site) WHERE root_site IS NULL")
+    for table in ("rollup_daily", "rollup_hourly"):
+        try:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN anon INTEGER NOT NULL DEFAULT 0")
+        except Exception:
+            pass  # column already exists
+    db.executescript(INDEXES)
+    has_hits = db.execute("SELECT 1 FROM hits LIMIT 1").fetchone()
+    now      = int(time.time())
+    since    = now - now % DAY + DAY if has_hits else 0
+    with db:
+        for key in COVERAGE_KEYS:
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (key, since))
+        # Rollups counted per hostname (and without anon) are only read
+        # again after rebuild-rollups
+        if db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, 1)",
+                      (_ROOT_SESSIONS,)).rowcount and has_hits:
+            db.execute("UPDATE meta SET value = MAX(value, ?) WHERE key = 'rollup_since'", (since,))
+
+
+def _bucket_keys(ts, path, ref, lang, w, country):
+    """Rollup keys (table, dim, bucket, value) that one hit contributes to."""
+    day  = ts - ts % DAY
+    keys = [("h", "", ts - ts % HOUR, ""), ("d", "", day, "")]
+    for dim, value in (("path", path), ("ref", ref), ("country", country),
+                       ("lang", lang), ("w", w)):
+        if value is not None:
+            keys.append(("d", dim, day, value))
+    return keys
+
+
+def _hosts(db, root, day, anon=False):
+    """Hostnames of a root site with (sessionless, if `anon`) rollups on a day."""
+    return [r[0] for r in db.execute(
+        "SELECT DISTINCT site FROM rollup_hourly WHERE root_site = ? AND bucket >= ? AND bucket < ?"
+        + (" AND anon > 0" if anon else ""),
+        (root, day, day + DAY),
+    )]
+
+
+def _prior_keys(db, sites, session, day):
+    """Keys already counted for this session on this day (hits stored before the batch)."""
+    seen = set()
+    if not sites:
+        return seen
+    # +ts: look the session up by (site, session), not by the day's (site, ts) range
+    for r in db.execute(
+        f"SELECT ts, {interning.text_of(db, 'path')}, {interning.text_of(db, 'ref')}, "
+        f"{interning.text_of(db, 'lang')}, w, country FROM hits "
+        f"WHERE site IN ({','.join('?' * len(sites))}) AND session = ? "
+        "AND +ts >= ? AND +ts < ? AND bot = 0",
+        (*sites, session, day, day + DAY),
+    ):
+        seen.update(_bucket_keys(*r))
+    return seen
+
+
+class _Sessionless:
+    """Keys already counted for session '' of a root site on one day, probed in the rollups."""
+
+    def __init__(self, db, sites):
+        self.db, self.sites, self.known = db, sites, set()
+
+    def __contains__(self, key):
+        if key in self.known:
+            return True
+        table, dim, bucket, value = key
+        for site in self.sites:
+            if table == "h":
+                row = self.db.execute(
+                    "SELECT anon FROM rollup_hourly WHERE site = ? AND bucket = ?", (site, bucket)
+                ).fetchone()
+            else:
+                row = self.db.execute(
+                    "SELECT anon FROM rollup_daily WHERE site = ? AND dim = ? AND bucket = ? "
+                    "AND value = ?", (site, dim, bucket, value)
+                ).fetchone()
+            if row and row[0]:
+                self.known.add(key)
+                return True
+        return False
+
+    def add(self, key):
+        self.known.add(key)
+
+
+def apply(db, rows):
+    """Fold a batch of hit tuples (db.HIT_COLUMNS order) into the rollups.
+
+    Must run inside the write transaction and *before* the rows are inserted,
+    so the prior-hits lookup only sees earlier hits of each session.
+    """
+    deltas:   dict[tuple, list[int]] = {}
+    seen:     dict[tuple, set]        = {}   # (root, session, day) -> keys counted
+    hosts:    dict[tuple, list[str]]  = {}
+    sessions: dict[tuple, set]        = {}   # (site, day) -> sessions, for the sketches
+    for r in rows:
+        ts, site, path, ref, _ua, lang, w, session, country, bot = r[:10]
+        if bot:
+            continue
+        day = ts - ts % DAY
+        counted = None
+        if session is not None:
+            root    = site_root(site)
+            skey    = (root, session, day)
+            counted = seen.get(skey)
+            if counted is None:
+                anon  = session == ""
+                sites = hosts.get((root, day, anon))
+                if sites is None:
+                    sites = hosts[root, day, anon] = _hosts(db, root, day, anon)
+                counted = seen[skey] = (
+                    _Sessionless(db, sites) if anon else _prior_keys(db, sites, session, day)
+                )
+            sessions.setdefault((site, day), set()).add(session)
+        for key in _bucket_keys(ts, path, ref, lang, w, country):
+            d = deltas.setdefault((site, *key), [0, 0, 0])
+            d[0] += 1
+            if session == "":
+                d[2] += 1
+            if counted is not None and key not in counted:
+                counted.add(key)
+                d[1] += 1
+
+    db.executemany(_UPSERT_DAILY, [
+        (site, site_root(site), dim, bucket, value, v, s, a)
+        for (site, table, dim, bucket, value), (v, s, a) in deltas.items() if table == "d"
+    ])
+    db.executemany(_UPSERT_HOURLY, [
+        (site, site_root(site), bucket, v, s, a)
+        for (site, table, _dim, bucket, _value), (v, s, a) in deltas.items() if table == "h"
+    ])
+    # HLL adds are idempotent, so re-adding already-counted sessions is harmless
+    _add_to_sketches(db, sessions)
+
+
+def _add_to_sketches(db, sessions_by_bucket):
+    for (site, day), sessions in sessions_by_bucket.items():
+        row  = db.execute(
+            "SELECT sketch FROM session_sketches WHERE site = ? AND bucket = ?", (site, day)
+        ).fetchone()
+        regs = hll.loads(row[0]) if row else hll.new()
+        for session in sessions:
+            hll.add(regs, session)
+        db.execute(
+            "INSERT OR REPLACE INTO session_sketches (site, root_site, bucket, sketch) "
+            "VALUES (?,?,?,?)",
+            (site, site_root(site), day, hll.dumps(regs)),
+        )
+
+
+def rebuild(db, chunk_days=31, echo=None):
+    """Recompute all rollups from raw hits, one chunk of days per transaction."""
+    bounds = list(db.execute("SELECT MIN(ts), MAX(ts) FROM hits").fetchone())
+    for p in partitions.overlapping(db):
+        bounds[0] = p["lo"] if bounds[0] is None else min(bounds[0], p["lo"])
+        bounds[1] = p["hi"] - 1 if bounds[1] is None else max(bounds[1], p["hi"] - 1)
+    if bounds[0] is None:
+        _mark_complete(db)
+        return
+    lo = bounds[0] - bounds[0] % DAY
+    step = chunk_days * DAY
+    for a in range(lo, bounds[1] + 1, step):
+        b = a + step
+        hits = partitions.source(db, a, b - 1)   # attaches before the transaction
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Days whose raw hits were purged by retention keep their rollups
+            for table in ("rollup_daily", "rollup_hourly", "session_sketches"):
+                db.execute(
+                    f"DELETE FROM {table} WHERE bucket >= ? AND bucket < ? AND NOT EXISTS ("
+                    f"  SELECT 1 FROM retention r WHERE r.root_site = {table}.root_site "
+                    f"  AND {table}.bucket < r.purged_before)",
+                    (a, b),
+                )
+            hits = f"{hits} {retention.RETAINED_JOIN}"
+            live = f"ts >= ? AND ts < ? AND bot = 0 AND {retention.RETAINED_WHERE}"
+            db.execute(
+                "INSERT INTO rollup_daily (site, root_site, dim, bucket, value, views, anon) "
+                f"SELECT site, site_root(site), '', ts - ts % {DAY} AS bucket, '', COUNT(*), "
+                f"SUM(session IS '') FROM {hits} WHERE {live} GROUP BY site, bucket",
+                (a, b),
+            )
+            _rebuild_sessions(db, hits, live, (a, b), "rollup_daily", DAY, dim="")
+            for dim, col in DIMS.items():
+                # Interned columns are grouped by id; labels are looked up per group
+                key   = interning.stored(col)
+                value = interning.label(col) if col in interning.COLUMNS else key
+                db.execute(
+                    "INSERT INTO rollup_daily (site, root_site, dim, bucket, value, views, anon) "
+                    f"SELECT site, site_root(site), ?, bucket, {value}, views, anon FROM ("
+                    f"  SELECT site, ts - ts % {DAY} AS bucket, {key}, COUNT(*) AS views, "
+                    f"  SUM(session IS '') AS anon "
+                    f"  FROM {hits} WHERE {live} AND {key} IS NOT NULL GROUP BY site, bucket, {key}"
+                    f")",
+                    (dim, a, b),
+                )
+                _rebuild_sessions(db, hits, live, (a, b), "rollup_daily", DAY, dim, col)
+            db.execute(
+                "INSERT INTO rollup_hourly (site, root_site, bucket, views, anon) "
+                f"SELECT site, site_root(site), ts - ts % {HOUR} AS bucket, COUNT(*), "
+                f"SUM(session IS '') FROM {hits} WHERE {live} GROUP BY site, bucket",
+                (a, b),
+            )
+            _rebuild_sessions(db, hits, live, (a, b), "rollup_hourly", HOUR)
+            sketches: dict[tuple, list[str]] = {}
+            for site, day, session in db.execute(
+                f"SELECT site, ts - ts % {DAY} AS bucket, session FROM {hits} "
+                f"WHERE {live} AND session IS NOT NULL GROUP BY site, bucket, session",
+                (a, b),
+            ):
+                sketches.setdefault((site, day), []).append(session)
+            _add_to_sketches(db, sketches)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            partitions.release(db)
+        if echo:
+            echo(f"  {time.strftime('%Y-%m-%d', time.gmtime(a))} .. "
+                 f"{time.strftime('%Y-%m-%d', time.gmtime(min(b, bounds[1]) - 1))}")
+    _mark_complete(db)
+    buckets.invalidate(db)
+
+
+def _rebuild_sessions(db, hits, live, params, table, step, dim=None, col=None):
+    """Fill the sessions column of the rows just inserted, counting each session once per root.
+
+    A session is credited to the lowest hostname it was seen on within the
+    bucket (and dimension value), so the rows of a root site add up.
+    """
+    if table == "rollup_hourly":
+        cols, conflict, picks = "site, root_site, bucket", "site, bucket", "bucket"
+    else:
+        cols, conflict, picks = "site, root_site, dim, bucket, value", "site, dim, bucket, value", "?, bucket, ''"
+    key = ""
+    if col is not None:
+        key   = f", {interning.stored(col)}"
+        value = interning.label(col) if col in interning.COLUMNS else interning.stored(col)
+        picks = f"?, bucket, {value}"
+        live  = f"{live} AND {interning.stored(col)} IS NOT NULL"
+    db.execute(
+        f"INSERT INTO {table} ({cols}, sessions) SELECT site, site_root(site), {picks}, COUNT(*) FROM ("
+        f"  SELECT MIN(site) AS site, ts - ts % {step} AS bucket{key} FROM {hits} "
+        f"  WHERE {live} AND session IS NOT NULL GROUP BY site_root(site), bucket{key}, session"
+        f") WHERE 1 GROUP BY site, bucket{key} "
+        f"ON CONFLICT ({conflict}) DO UPDATE SET sessions = excluded.sessions",
+        ([dim] if dim is not None else []) + list(params),
+    )
+
+
+def _mark_complete(db):
+    with db:
+        for key in COVERAGE_KEYS:
+            db.execute("UPDATE meta SET value = 0 WHERE key = ?", (key,))
+
+
+# ── Query routing ──────────────────────────────────────────────────────────────
+
+def span(db, start, end, step=DAY, key="rollup_since"):
+    """Return (lo, hi): the closed, fully covered `step` buckets inside [start, end].
+
+    Rollups (or sketches, with key='sketch_since') answer ts in [lo, hi); the
+    caller reads the rest from raw hits.  Returns None when no whole closed
+    bucket falls inside the range.
+    """
+    row   = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    since = int(row[0]) if row else None
+    if since is None:
+        return None
+    now = int(time.time())
+    lo  = max(start or 0, since)
+    lo  = -(-lo // step) * step                 # first bucket starting at/after lo
+    hi  = now - now % step                      # the open (current) bucket is raw
+    if end:
+        hi = min(hi, (end + 1) - (end + 1) % step)  # end is inclusive
+    if hi <= lo:
+        return None
+    return lo, hi
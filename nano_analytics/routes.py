@@ -1,23 +1,16 @@
-import re
+import json
 import time
-import threading
-import ipaddress
-from collections import defaultdict, deque
+from contextlib import contextmanager
 from functools import wraps
-from flask import Blueprint, request, jsonify, current_app, render_template, send_from_directory
+from flask import Blueprint, Response, g, request, jsonify, current_app, render_template, send_from_directory
 
-from .db import get_db
+from . import buckets, columnar, export, geo, hll, interning, metrics, rollups, sessions
+from .db import get_db, hit_tables, hits_source, insert_hits
+from .sites import site_root
 from .auth import require_token
-from .ua_parser import device_type, browser_name, os_name
+from .ua_parser import analyze, classify
 from .openapi import SPEC
 
-# Optional offline GeoIP — bundled database, zero external calls
-try:
-    from geoip2fast import GeoIP2Fast as _GeoIP2Fast
-    _geo = _GeoIP2Fast()
-except Exception:
-    _geo = None
-
 bp = Blueprint("main", __name__)
 
 # 1×1 transparent GIF (raw bytes)
@@ -31,56 +24,122 @@ _GIF_1x1 = (
 
 # ── Bot detection ──────────────────────────────────────────────────────────────
 
-# Chrome dropped Windows 7 (NT 6.1) support after version 109.
-_WIN7_RE       = re.compile(r"Windows NT 6\.1")
-_CHROME_VER_RE = re.compile(r"Chrome/(\d+)\.")
-_BOT_UA_RE     = re.compile(
-    r"(bot|crawl|spider|slurp|HeadlessChrome|python-requests|curl|wget|axios|"
-    r"node-fetch|Go-http-client|Java/|libwww|okhttp|Scrapy)",
-    re.IGNORECASE,
-)
-
-# Per-site sliding-window rate limiter (in-process; per gunicorn worker).
-# If a site exceeds this many hits/minute within a single worker, incoming
-# hits are flagged as bot.  Real newsletter bursts rarely exceed ~100/min/worker.
-_MAX_HITS_PER_MINUTE = 300
-_hit_windows: dict[str, deque] = defaultdict(deque)
-_hit_lock = threading.Lock()
-
+# The rules live in ua_parser (is_bot); analyze() applies them in the same
+# single pass that classifies device, browser and OS.
 
 def _is_bot(ua: str) -> bool:
     """Return True if the User-Agent looks like a bot."""
-    if not ua:
-        return True
-    if _BOT_UA_RE.search(ua):
-        return True
-    # Chrome > 109 cannot run on Windows 7 (NT 6.1) — impossible combination.
-    if _WIN7_RE.search(ua):
-        m = _CHROME_VER_RE.search(ua)
-        if m and int(m.group(1)) > 109:
-            return True
-    return False
-
-
-def _is_flood(site: str) -> bool:
-    """Sliding-window check: True if this site is being hit at bot-level rates."""
-    now    = time.time()
-    cutoff = now - 60.0
-    with _hit_lock:
-        dq = _hit_windows[site]
-        while dq and dq[0] < cutoff:
-            dq.popleft()
-        dq.append(now)
-        return len(dq) > _MAX_HITS_PER_MINUTE
+    return analyze(ua)[3]
+
+
+# ── Beacon ─────────────────────────────────────────────────────────────────────
+# Shared by the Flask /hit route and the asyncio ingest server
+# (ingest_server.py), so both record a beacon the same way.
+#
+# Per-site flood detection: if a site receives more than FLOOD_MAX_PER_MINUTE
+# hits/minute across the whole instance, incoming hits are flagged as bot.
+# The counters live in shared memory (see flood.py), so every worker — and
+# the ingest server — sees the same rate.
+
+_GIF_HEADERS = {
+    "Content-Type":                "image/gif",
+    "Cache-Control":               "no-store, no-cache, must-revalidate, max-age=0",
+    "Access-Control-Allow-Origin": "*",
+}
+_SCRIPT_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Cache-Control":               "public, max-age=3600",
+}
 
 
-# ── Response cache ─────────────────────────────────────────────────────────────
-# Keyed by (endpoint_name, query_string).  TTL is long for purely historical
-# ranges (end < today) and short for ranges that include today.
+def _beacon_row(args, ua, ip, flood, ts=None):
+    """Hit tuple for one /hit beacon (db.HIT_COLUMNS order), or None without site=.
+
+    `args` is the query string as a mapping, `flood` the FloodDetector.  The
+    flood counter is bumped even for hits that are not stored, as /hit always did.
+    """
+    site    = args.get("site", "")
+    path    = args.get("path", "/")
+    ref     = args.get("ref",  "")
+    lang    = args.get("lang", "")
+    w_str   = args.get("w",    "")
+    session = args.get("s",    "")
+    w       = int(w_str) if w_str.isdigit() else None
+    ts      = ts or int(time.time())
+    country = geo.country(ip)
+    device, browser, os_, is_bot = analyze(ua)
+    bot     = 1 if (is_bot or flood.hit(site)) else 0
+    if not site:
+        return None
+    return (ts, site, path, ref, ua, lang, w, session, country, bot, device, browser, os_)
+
+
+# POST /hit/batch: a JSON array (or NDJSON, one object per line) of events with
+# the /hit fields, plus "ago" = seconds since the event happened, for events a
+# page queued before sending.  UA and client IP come from the request.
+_BATCH_MAX_EVENTS = 100
+_BATCH_MAX_BYTES  = 64 * 1024
+_BATCH_MAX_AGE    = 3600
+_BATCH_FIELDS     = ("site", "path", "ref", "lang", "w", "s")
+_BATCH_HEADERS    = {
+    "Access-Control-Allow-Origin":  "*",
+    "Access-Control-Allow-Methods": "POST",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Cache-Control":                "no-store",
+}
+
+
+def _batch_rows(body, ua, ip, flood):
+    """(hit tuples, number of events rejected) for a /hit/batch body.
+
+    Raises ValueError if the body is not a JSON array / NDJSON, is nested too
+    deeply for the decoder, or has too many events.
+    """
+    text = body.decode("utf-8")
+    try:
+        if text.lstrip().startswith("["):
+            events = json.loads(text)
+        else:
+            events = [json.loads(line) for line in text.splitlines() if line.strip()]
+    except RecursionError:   # e.g. 20k nested '[': a client error, not a 500
+        raise ValueError("JSON nested too deeply") from None
+    if len(events) > _BATCH_MAX_EVENTS:
+        raise ValueError(f"at most {_BATCH_MAX_EVENTS} events per batch")
+    now = int(time.time())
+    rows, rejected = [], 0
+    for event in events:
+        args = _batch_args(event)
+        row  = None
+        if args is not None:
+            ago = event.get("ago", 0)
+            ago = min(max(ago, 0), _BATCH_MAX_AGE) if type(ago) is int else 0
+            row = _beacon_row(args, ua, ip, flood, now - ago)
+        if row is None:
+            rejected += 1
+        else:
+            rows.append(row)
+    return rows, rejected
+
+
+def _batch_args(event):
+    """An event's fields as /hit query args (strings), or None if it is malformed."""
+    if not isinstance(event, dict):
+        return None
+    args = {}
+    for key in _BATCH_FIELDS:
+        value = event.get(key)
+        if value is None:
+            continue
+        if type(value) not in (str, int):
+            return None
+        args[key] = str(value)
+    return args
 
-_RESP_CACHE: dict[str, tuple[float, object]] = {}
-_CACHE_LOCK = threading.Lock()
 
+# ── Response cache ─────────────────────────────────────────────────────────────
+# Keyed by (endpoint_name, query_string).  TTL is long for purely historical
+# ranges (end < today) and short for ranges that include today.  The backend
+# (app.extensions["response_cache"], see cache.py) is shared by all workers.
 
 def _cache_ttl(end: int | None) -> int:
     today_start = int(time.time() // 86400 * 86400)  # UTC midnight today
@@ -93,24 +152,16 @@ def cache_response(fn):
     """Cache jsonify'd responses; safe to stack inside @require_token."""
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        key = f"{fn.__name__}:{request.query_string.decode()}"
-        with _CACHE_LOCK:
-            entry = _RESP_CACHE.get(key)
-            if entry and time.time() < entry[0]:
-                return jsonify(entry[1])
-            # Evict expired entries when cache grows large
-            if len(_RESP_CACHE) > 1000:
-                now = time.time()
-                expired = [k for k, v in _RESP_CACHE.items() if now >= v[0]]
-                for k in expired:
-                    del _RESP_CACHE[k]
+        cache = current_app.extensions["response_cache"]
+        key   = f"{fn.__name__}:{request.query_string.decode()}"
+        data  = cache.get(key)
+        if data is not None:
+            return jsonify(data)
         resp = fn(*args, **kwargs)
         data = resp.get_json(silent=True)
         if data is not None:
             end = request.args.get("end", type=int)
-            ttl = _cache_ttl(end)
-            with _CACHE_LOCK:
-                _RESP_CACHE[key] = (time.time() + ttl, data)
+            cache.set(key, data, _cache_ttl(end))
         return resp
     return wrapper
 
@@ -119,23 +170,13 @@ def cache_response(fn):
 
 def _client_ip():
     """Return the real client IP, respecting X-Forwarded-For from reverse proxies."""
-    xff = request.headers.get("X-Forwarded-For", "")
-    if xff:
-        return xff.split(",")[0].strip()
-    return request.remote_addr or ""
+    return _forwarded_ip(request.headers.get("X-Forwarded-For", ""), request.remote_addr)
 
 
-def _get_country(ip):
-    """Return a 2-letter ISO country code, or None for private/unknown IPs."""
-    if not ip or not _geo:
-        return None
-    try:
-        if ipaddress.ip_address(ip).is_private:
-            return None
-        result = _geo.lookup(ip)
-        return result.country_code or None
-    except Exception:
-        return None
+def _forwarded_ip(xff, remote_addr):
+    if xff:
+        return xff.split(",")[0].strip()
+    return remote_addr or ""
 
 
 def _query_params():
@@ -143,9 +184,21 @@ def _query_params():
     start = request.args.get("start", type=int)
     end   = request.args.get("end",   type=int)
     limit = request.args.get("limit", 10, type=int)
+    if g.get("_range") is not None:
+        start, end = g._range   # a bucketed panel computing part of the range
     return site, start, end, min(limit, 500)
 
 
+@contextmanager
+def _request_range(start, end):
+    """Run panel code for [start, end] instead of the request's start/end."""
+    saved, g._range = g.get("_range"), (start, end)
+    try:
+        yield
+    finally:
+        g._range = saved
+
+
 def _root_domain(site):
     """Strip www. prefix so queries match all subdomains of the root."""
     if site.startswith("www."):
@@ -161,7 +214,20 @@ _FILTER_COLS = {
 }
 
 
-def _where(site, start, end):
+def _site_clause(site):
+    """SQL matching the root domain and all its subdomains (hits and rollups).
+
+    The root_site equality drives an index range scan; the site/LIKE pair
+    then keeps the exact "this host and its subdomains" semantics.
+    """
+    root = _root_domain(site)
+    return (
+        "root_site = ? AND (site = ? OR site LIKE ?)",
+        [site_root(root), root, f"%.{root}"],
+    )
+
+
+def _where(site, start, end, bots=False):
     """Build a WHERE clause matching the root domain and all its subdomains.
 
     e.g. site='flaskvibe.com' matches flaskvibe.com, www.flaskvibe.com,
@@ -169,27 +235,56 @@ def _where(site, start, end):
 
     Reads additive dimension filters from the current request via
     filter_<field> params (filter_path, filter_referrer, filter_country,
-    filter_language). Multiple filters are ANDed together.
+    filter_language). Multiple filters are ANDed together.  Hits flagged as
+    bot are excluded unless `bots` is set.
     """
-    root = _root_domain(site)
-    clauses = ["(site = ? OR site LIKE ?)", "(bot IS NULL OR bot = 0)"]
-    params  = [root, f"%.{root}"]
+    site_sql, params = _site_clause(site)
+    clauses = [site_sql] if bots else [site_sql, "bot = 0"]
     if start:
         clauses.append("ts >= ?")
         params.append(start)
     if end:
         clauses.append("ts <= ?")
         params.append(end)
+    for col, op, value in _filters():
+        clause, args = _filter_clause(col, op, value)
+        clauses.append(clause)
+        params.extend(args)
+    return " AND ".join(clauses), params
+
+
+def _filter_clause(col, op, value):
+    """(SQL, params) for one filter."""
+    # Interned columns: match the lookup table once, not every hit's text
+    if col not in interning.COLUMNS:
+        return f"{col} {op} ?", [value]
+    if op == "LIKE":
+        return interning.like(col, value)
+    return interning.matching(col, op), [value]
+
+
+def _filters():
+    """Active filter_* params as (column, operator, value) triples."""
+    out = []
     for fname, (col, op) in _FILTER_COLS.items():
         fv = request.args.get(f"filter_{fname}", "").strip()
         if fv:
-            if op == "LIKE":
-                clauses.append(f"{col} LIKE ?")
-                params.append(f"%{fv}%")
-            else:
-                clauses.append(f"{col} = ?")
-                params.append(fv.upper())
-    return " AND ".join(clauses), params
+            out.append((col, op, f"%{fv}%" if op == "LIKE" else fv.upper()))
+    return out
+
+
+def _has_filters():
+    return any(request.args.get(f"filter_{f}", "").strip() for f in _FILTER_COLS)
+
+
+def _rollup_span(start, end, step=rollups.DAY, src="hits"):
+    """Rollup-covered [lo, hi) of the requested range, or None to use raw rows only.
+
+    Rollups are per single dimension, so any filter_* param forces raw hits.
+    """
+    if src != "hits" or _has_filters():
+        return None
+    return rollups.span(get_db(), start, end, step)
 
 
 # ── Public routes ──────────────────────────────────────────────────────────────
@@ -202,31 +297,45 @@ def health():
 @bp.route("/hit")
 def hit():
     """Beacon endpoint. Inserts a hit row and returns a 1×1 GIF."""
-    site    = request.args.get("site", "")
-    path    = request.args.get("path", "/")
-    ref     = request.args.get("ref",  "")
-    lang    = request.args.get("lang", "")
-    w_str   = request.args.get("w",    "")
-    session = request.args.get("s",    "")
-    ua      = request.headers.get("User-Agent", "")
-    w       = int(w_str) if w_str.isdigit() else None
-    ts      = int(time.time())
-    country = _get_country(_client_ip())
-    bot     = 1 if (_is_bot(ua) or _is_flood(site)) else 0
-
-    if site:
-        db = get_db()
-        db.execute(
-            "INSERT INTO hits (ts, site, path, ref, ua, lang, w, session, country, bot) "
-            "VALUES (?,?,?,?,?,?,?,?,?,?)",
-            (ts, site, path, ref, ua, lang, w, session, country, bot),
-        )
-        db.commit()
+    row = _beacon_row(
+        request.args, request.headers.get("User-Agent", ""), _client_ip(),
+        current_app.extensions["flood"],
+    )
+    if row is not None:
+        writer = current_app.extensions.get("hit_writer")
+        # Buffered mode: hand off to the background writer; when its queue is
+        # full, fall back to a direct insert so the burst is slowed, not lost.
+        if writer is None or not writer.submit(row):
+            insert_hits(get_db(), [row])
+        current_app.extensions["live"].record([row])
 
     resp = current_app.make_response(_GIF_1x1)
-    resp.headers["Content-Type"]               = "image/gif"
-    resp.headers["Cache-Control"]              = "no-store, no-cache, must-revalidate, max-age=0"
-    resp.headers["Access-Control-Allow-Origin"] = "*"
+    resp.headers.update(_GIF_HEADERS)
+    return resp
+
+
+@bp.route("/hit/batch", methods=["POST", "OPTIONS"])
+def hit_batch():
+    """Batched beacon: validates the events and inserts them in one transaction."""
+    if request.method == "OPTIONS":
+        resp = current_app.make_response(("", 204))
+        resp.headers.update(_BATCH_HEADERS)
+        return resp
+    request.max_content_length = _BATCH_MAX_BYTES
+    try:
+        rows, rejected = _batch_rows(
+            request.get_data(cache=False), request.headers.get("User-Agent", ""),
+            _client_ip(), current_app.extensions["flood"],
+        )
+    except ValueError as e:   # includes JSONDecodeError / UnicodeDecodeError
+        resp = jsonify({"error": f"invalid batch: {e}"})
+        resp.status_code = 400
+    else:
+        if rows:
+            insert_hits(get_db(), rows)
+            current_app.extensions["live"].record(rows)
+        resp = jsonify({"accepted": len(rows), "rejected": rejected})
+    resp.headers.update(_BATCH_HEADERS)
     return resp
 
 
@@ -236,8 +345,7 @@ def beacon_js():
     resp = send_from_directory(
         current_app.static_folder, "a.js", mimetype="application/javascript"
     )
-    resp.headers["Access-Control-Allow-Origin"] = "*"
-    resp.headers["Cache-Control"]               = "public, max-age=3600"
+    resp.headers.update(_SCRIPT_HEADERS)
     return resp
 
 
@@ -262,20 +370,531 @@ def mcp():
     return render_template("mcp.html", base_url=base_url)
 
 
+# ── Stats panels ───────────────────────────────────────────────────────────────
+# Each _panel_* computes one endpoint's payload from `src`: "hits" (answered
+# from rollups where possible, raw hits for the rest) or the /api/report temp
+# table, which already holds only the request's filtered range.
+
+_REPORT_TABLE = "report_hits"
+
+
+def _source(src):
+    """WHERE clause selecting the request's rows from a panel source."""
+    if src == "hits":
+        site, start, end, _ = _query_params()
+        return _where(site, start, end)
+    return "1", []
+
+
+def _table(src="hits", skip=None, exclude=()):
+    """FROM target for `src`: the request's hits across partitions, or the report table.
+
+    `skip` is the [lo, hi) range a caller answers from rollups, so partitions
+    wholly inside it are not attached; `exclude` lists months answered from
+    columnar archives.
+    """
+    if src != "hits":
+        return src
+    site, start, end, _ = _query_params()
+    where, params = _where(site, start, end)
+    return hits_source(start, end, where, params, skip, exclude)
+
+
+def _archived(src="hits"):
+    """(scans, FROM target): columnar scans of archived months, and the table for the rest.
+
+    Archives replace raw reads of `hits` only; elsewhere scans is empty.
+    Panels merge the scans' partial aggregates into their SQL through
+    _archive_rows(), the way they merge rollup rows.
+    """
+    if src != "hits" or not current_app.config.get("COLUMNAR_ARCHIVES"):
+        return [], _table(src)
+    site, start, end, _ = _query_params()
+    root  = _root_domain(site)
+    found = columnar.scans(get_db(), site_root(root), root, start, end, _filters())
+    return found, _table(src, exclude={s.month for s in found})
+
+
+def _archive_rows(*cols):
+    """SELECT over a JSON array of archive result rows, bound as the next parameter."""
+    picks = ", ".join(f"json_extract(value, '$[{i}]') AS {c}" for i, c in enumerate(cols))
+    return f"SELECT {picks} FROM json_each(?)"
+
+
+def _archive_json(scans, fn):
+    return json.dumps([row for scan in scans for row in fn(scan)])
+
+
+def _panel_pageviews(src="hits"):
+    site, start, end, _ = _query_params()
+    where, params = _source(src)
+    db   = get_db()
+    span = None
+    if src == "hits" and request.args.get("exact") != "1" and not _has_filters():
+        span = rollups.span(db, start, end, key="sketch_since")
+    if span is None:
+        scans, hits = _archived(src)
+        if not scans:
+            row = db.execute(
+                f"SELECT COUNT(*) AS views, COUNT(DISTINCT session) AS sessions "
+                f"FROM {hits} WHERE {where}",
+                params,
+            ).fetchone()
+            return {"views": row["views"], "sessions": row["sessions"], "mode": "exact", "error": 0}
+        # A session may span archived and live months: union the ids exactly
+        views = db.execute(f"SELECT COUNT(*) FROM {hits} WHERE {where}", params).fetchone()[0]
+        seen  = {r[0] for r in db.execute(
+            f"SELECT DISTINCT session FROM {hits} WHERE {where} AND session IS NOT NULL", params
+        )}
+        for scan in scans:
+            views += scan.count()
+            seen.update(scan.distinct("session"))
+        return {"views": views, "sessions": len(seen), "mode": "exact", "error": 0}
+
+    site_sql, site_params = _site_clause(site)
+    views = db.execute(
+        f"SELECT COALESCE(SUM(views), 0) FROM rollup_daily "
+        f"WHERE {site_sql} AND dim = '' AND bucket >= ? AND bucket < ?",
+        site_params + [*span],
+    ).fetchone()[0]
+    hits   = _table(src, skip=span)
+    views += db.execute(
+        f"SELECT COUNT(*) FROM {hits} WHERE {where} AND (ts < ? OR ts >= ?)",
+        params + [*span],
+    ).fetchone()[0]
+    regs = hll.merge(
+        hll.loads(r[0]) for r in db.execute(
+            f"SELECT sketch FROM session_sketches "
+            f"WHERE {site_sql} AND bucket >= ? AND bucket < ?",
+            site_params + [*span],
+        )
+    )
+    for r in db.execute(
+        f"SELECT DISTINCT session FROM {hits} WHERE {where} "
+        f"AND (ts < ? OR ts >= ?) AND session IS NOT NULL",
+        params + [*span],
+    ):
+        hll.add(regs, r[0])
+    return {"views": views, "sessions": hll.estimate(regs), "mode": "sketch", "error": hll.ERROR}
+
+
+def _raw_counts(col, hits, where):
+    """SELECT of (col, views) from raw rows.
+
+    Interned columns are grouped by id and labelled per group afterwards.
+    """
+    if col not in interning.COLUMNS:
+        return f"SELECT {col}, COUNT(*) AS views FROM {hits} WHERE {where} GROUP BY {col}"
+    key = interning.stored(col)
+    return (f"SELECT {interning.label(col)} AS {col}, views FROM ("
+            f"SELECT {key}, COUNT(*) AS views FROM {hits} WHERE {where} GROUP BY {key})")
+
+
+def _top_values(col, dim, extra="", extra_params=(), src="hits"):
+    """Top values of a hits column by views, from daily rollups plus raw edges.
+
+    `extra` is an AND-clause on `col` applied after merging both sources.
+    dim '' reads the site totals, i.e. groups by hostname.
+    """
+    site, start, end, limit = _query_params()
+    where, params = _source(src)
+    extra_params  = list(extra_params)
+    span = _rollup_span(start, end, src=src)
+    if span is None:
+        scans, hits = _archived(src)
+        if scans:
+            sql = (
+                f"SELECT {col}, SUM(views) AS views FROM ("
+                f"  {_raw_counts(col, hits, where)}"
+                f"  UNION ALL {_archive_rows(col, 'views')}"
+                f") WHERE 1 {extra} GROUP BY {col} ORDER BY views DESC LIMIT ?"
+            )
+            params = params + [_archive_json(scans, lambda s: s.group_counts(col))]
+        else:
+            sql = (f"SELECT {col}, views FROM ({_raw_counts(col, hits, where)}) "
+                   f"WHERE 1 {extra} ORDER BY views DESC LIMIT ?")
+        rows = get_db().execute(sql, params + extra_params + [limit]).fetchall()
+        return [dict(r) for r in rows]
+    site_sql, site_params = _site_clause(site)
+    value = "site" if dim == "" else "value"
+    sql = (
+        f"SELECT {col}, SUM(views) AS views FROM ("
+        f"  SELECT {value} AS {col}, views FROM rollup_daily "
+        f"  WHERE {site_sql} AND dim = ? AND bucket >= ? AND bucket < ?"
+        f"  UNION ALL"
+        f"  {_raw_counts(col, _table(src, skip=span), f'{where} AND (ts < ? OR ts >= ?)')}"
+        f") WHERE 1 {extra} GROUP BY {col} ORDER BY views DESC LIMIT ?"
+    )
+    rows = get_db().execute(
+        sql, site_params + [dim, *span] + params + [*span] + extra_params + [limit]
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _panel_pages(src="hits"):
+    return _top_values("path", "path", src=src)
+
+
+def _panel_referrers(src="hits"):
+    root = _root_domain(request.args.get("site", ""))
+    return _top_values("ref", "ref", "AND ref != '' AND ref NOT LIKE ?", [f"%{root}%"], src=src)
+
+
+def _panel_languages(src="hits"):
+    return _top_values("lang", "lang", "AND lang != ''", src=src)
+
+
+def _panel_countries(src="hits"):
+    return _top_values("country", "country", "AND country IS NOT NULL AND country != ''", src=src)
+
+
+def _panel_hostnames(src="hits"):
+    return _top_values("site", "", src=src)
+
+
+def _panel_screen_widths(src="hits"):
+    return _top_values("w", "w", "AND w IS NOT NULL", src=src)
+
+
+def _bucketed(granularity, src="hits"):
+    """Timeseries rows for the request, assembled from per-day cached rows where possible.
+
+    See buckets.py; only `hits` ranges with a start are split up.
+    """
+    site, start, end, _ = _query_params()
+    if src != "hits" or not start or not current_app.config.get("BUCKET_CACHE"):
+        return _timeseries_rows(granularity, src)
+    key = (f"buckets:{granularity}:{buckets.generation(get_db())}:{_root_domain(site)}:"
+           f"{json.dumps(_filters(), separators=(',', ':'))}")
+
+    def compute(lo, hi):
+        with _request_range(lo, hi):
+            return _timeseries_rows(granularity, src)
+
+    return buckets.assemble(current_app.extensions["response_cache"], key, start, end, compute,
+                            label=lambda row: row[granularity])
+
+
+def _panel_timeseries(src="hits"):
+    granularity = "hour" if request.args.get("granularity", "day") == "hour" else "day"
+    return _bucketed(granularity, src)
+
+
+def _timeseries_rows(granularity, src="hits"):
+    site, start, end, _ = _query_params()
+    where, params = _source(src)
+    if granularity == "hour":
+        fmt, label, table, step = "'%Y-%m-%d %H:00'", "hour", "rollup_hourly", rollups.HOUR
+        total = ""
+    else:
+        fmt, label, table, step = "'%Y-%m-%d'", "day", "rollup_daily", rollups.DAY
+        total = "AND dim = ''"
+    root = _root_domain(site)
+    # Rollup sessions are counted per root site: a subdomain's own are raw
+    span = _rollup_span(start, end, step, src) if root == site_root(root) else None
+    scans, hits = _archived(src) if span is None else ([], _table(src, skip=span))
+    raw = (f"SELECT strftime({fmt}, ts, 'unixepoch') AS {label}, COUNT(*) AS views, "
+           f"COUNT(DISTINCT session) AS sessions FROM {hits} WHERE {where}")
+    if scans:
+        # Buckets never straddle months, so per-bucket session counts add up
+        rows = get_db().execute(
+            f"SELECT {label}, SUM(views) AS views, SUM(sessions) AS sessions FROM ("
+            f"  {raw} GROUP BY {label}"
+            f"  UNION ALL {_archive_rows(label, 'views', 'sessions')}"
+            f") GROUP BY {label} ORDER BY {label}",
+            params + [_archive_json(scans, lambda s: s.buckets(step, fmt.strip("'")))],
+        ).fetchall()
+        return [dict(r) for r in rows]
+    if span is None:
+        rows = get_db().execute(
+            f"{raw} GROUP BY {label} ORDER BY {label}", params
+        ).fetchall()
+        return [dict(r) for r in rows]
+    # Buckets are UTC-aligned, so each one comes wholly from rollups or from hits
+    site_sql, site_params = _site_clause(site)
+    rows = get_db().execute(
+        f"SELECT {label}, SUM(views) AS views, SUM(sessions) AS sessions FROM ("
+        f"  SELECT strftime({fmt}, bucket, 'unixepoch') AS {label}, views, sessions "
+        f"  FROM {table} WHERE {site_sql} {total} AND bucket >= ? AND bucket < ?"
+        f"  UNION ALL"
+        f"  {raw} AND (ts < ? OR ts >= ?) GROUP BY {label}"
+        f") GROUP BY {label} ORDER BY {label}",
+        site_params + [*span] + params + [*span],
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _ua_breakdown(col, counts=None, src="hits"):
+    """Pageview counts grouped by a materialized UA column (device/browser/os).
+
+    Rows stored before the column existed (NULL until `flask backfill-ua`)
+    are classified here, grouped by distinct UA so memory stays bounded.
+    """
+    where, params = _source(src)
+    scans, hits = _archived(src)
+    db     = get_db()
+    counts = dict(counts or {})
+    for scan in scans:
+        for value, n in scan.ua_counts(col).items():
+            counts[value] = counts.get(value, 0) + n
+    for r in db.execute(
+        f"SELECT {col} AS value, COUNT(*) AS n FROM {hits} WHERE {where} "
+        f"AND {col} IS NOT NULL GROUP BY {col}",
+        params,
+    ):
+        counts[r["value"]] = counts.get(r["value"], 0) + r["n"]
+    idx = ("device", "browser", "os").index(col)
+    for r in db.execute(
+        f"SELECT {interning.label('ua')} AS ua, n FROM ("
+        f"  SELECT ua_id, COUNT(*) AS n FROM {hits} WHERE {where} AND {col} IS NULL GROUP BY ua_id"
+        f")",
+        params,
+    ):
+        value = classify(r["ua"])[idx]
+        counts[value] = counts.get(value, 0) + r["n"]
+    return counts
+
+
+def _panel_browsers(src="hits"):
+    return _ua_breakdown("browser", src=src)
+
+
+def _panel_os(src="hits"):
+    return _ua_breakdown("os", src=src)
+
+
+def _panel_devices(src="hits"):
+    return _ua_breakdown("device", {"mobile": 0, "tablet": 0, "desktop": 0, "unknown": 0}, src)
+
+
+def _session_split(src):
+    """Split a per-session panel between the sessions table and raw hits.
+
+    Returns (raw_from, raw_where, raw_params, inside, inside_params).  Raw
+    hits are read only for sessions crossing the range edges; sessions wholly
+    inside it come from the sessions table via the `inside` WHERE clause.
+    `inside` is None when the panel must run on raw rows alone: filters, the
+    /api/report temp table, or a range older than the sessions table.
+    """
+    where, params = _source(src)
+    if src != "hits" or _has_filters():
+        return _table(src), where, params, None, []
+    site, start, end, _ = _query_params()
+    tables = hit_tables(start, end)
+    if tables is None or not sessions.covers(get_db(), start):
+        return _table(src), where, params, None, []
+    lo, hi = sessions.bounds(start, end)
+    site_sql, site_params = _site_clause(site)
+    edge_sql, edge_params = sessions.straddling(site_sql, site_params, lo, hi)
+    # One indexed (site, session) lookup per partition holding the range
+    raw_from = "(" + " UNION ALL ".join(
+        f"SELECT h.site, h.root_site, h.bot, h.session, h.path_id, h.ts "
+        f"FROM ({edge_sql}) AS edge CROSS JOIN {table} AS h INDEXED BY idx_site_session "
+        f"ON h.site = edge.s_site AND h.session = edge.s_session"
+        for table in tables
+    ) + ") AS hits"
+    inside = f"{site_sql} AND {sessions.INSIDE}"
+    return (raw_from, where, edge_params * len(tables) + params,
+            inside, site_params + [lo, hi])
+
+
+# Session panels count per path_id; the sessions table stores paths as text,
+# so its counts are grouped by text first and mapped to ids once per path.
+_STATIC = interning.matching("path", "LIKE", "'/static/%'")
+
+
+def _stored_paths(col, inside, cond=""):
+    return (
+        f"UNION ALL SELECT {interning.id_of('path', col)}, COUNT(*) FROM sessions "
+        f"WHERE {inside} {cond} GROUP BY {col}"
+        if inside else ""
+    )
+
+
+def _panel_entry_pages(src="hits"):
+    *_, limit = _query_params()
+    raw_from, where, params, inside, inside_params = _session_split(src)
+    rows = get_db().execute(
+        f"""WITH filtered AS (
+              SELECT session, path_id, ts FROM {raw_from} WHERE {where}
+            ),
+            session_first AS (
+              SELECT session, MIN(ts) AS first_ts FROM filtered GROUP BY session
+            ),
+            entries AS (
+              SELECT f.path_id, COUNT(*) AS n FROM filtered f
+              JOIN session_first sf ON f.session = sf.session AND f.ts = sf.first_ts
+              GROUP BY f.path_id
+              {_stored_paths("entry_path", inside)}
+            )
+            SELECT {interning.label("path")} AS path, SUM(n) AS entries
+            FROM entries
+            GROUP BY path_id ORDER BY entries DESC LIMIT ?""",
+        params + inside_params + [limit],
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _panel_peak_hours(src="hits"):
+    site, start, end, _ = _query_params()
+    if src == "hits" and start and current_app.config.get("BUCKET_CACHE"):
+        # Sum of the hourly series, whose closed days are cached
+        views = {}
+        for row in _bucketed("hour"):
+            hour = int(row["hour"][11:13])
+            views[hour] = views.get(hour, 0) + row["views"]
+        top = sorted(views.items(), key=lambda hv: (-hv[1], hv[0]))[:10]
+        return [{"hour": h, "views": v} for h, v in top]
+    where, params = _source(src)
+    hour_of = "CAST(strftime('%H', {}, 'unixepoch') AS INTEGER)"
+    span = _rollup_span(start, end, rollups.HOUR, src)
+    if span is None:
+        scans, hits = _archived(src)
+        raw = (f"SELECT {hour_of.format('ts')} AS hour, "
+               f"COUNT(*) AS views FROM {hits} WHERE {where} GROUP BY hour")
+        if scans:
+            raw = (f"SELECT hour, SUM(views) AS views FROM ("
+                   f"  {raw} UNION ALL {_archive_rows('hour', 'views')}"
+                   f") GROUP BY hour")
+            params = params + [_archive_json(scans, lambda s: s.hours())]
+        rows = get_db().execute(f"{raw} ORDER BY views DESC LIMIT 10", params).fetchall()
+        return [dict(r) for r in rows]
+    site_sql, site_params = _site_clause(site)
+    rows = get_db().execute(
+        f"SELECT hour, SUM(views) AS views FROM ("
+        f"  SELECT {hour_of.format('bucket')} AS hour, views FROM rollup_hourly "
+        f"  WHERE {site_sql} AND bucket >= ? AND bucket < ?"
+        f"  UNION ALL"
+        f"  SELECT {hour_of.format('ts')} AS hour, COUNT(*) AS views "
+        f"  FROM {_table(src, skip=span)} WHERE {where} AND (ts < ? OR ts >= ?) GROUP BY hour"
+        f") GROUP BY hour ORDER BY views DESC LIMIT 10",
+        site_params + [*span] + params + [*span],
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _panel_bounce_rates(src="hits"):
+    *_, limit = _query_params()
+    raw_from, where, params, inside, inside_params = _session_split(src)
+    total_where, total_params = _source(src)
+    rows = get_db().execute(
+        f"""WITH filtered AS (
+              SELECT session, path_id FROM {raw_from} WHERE {where} AND NOT {_STATIC}
+            ),
+            session_sizes AS (
+              SELECT session, COUNT(*) AS hit_count FROM filtered GROUP BY session
+            ),
+            bounced AS (
+              SELECT f.path_id, COUNT(*) AS n FROM filtered f
+              JOIN session_sizes ss ON f.session = ss.session
+              WHERE ss.hit_count = 1
+              GROUP BY f.path_id
+              {_stored_paths("page_path", inside, "AND page_hits = 1")}
+            ),
+            bounces AS (
+              SELECT path_id, SUM(n) AS bounces FROM bounced GROUP BY path_id
+            ),
+            page_visits AS (
+              SELECT path_id, COUNT(DISTINCT session) AS total_sessions
+              FROM {_table(src)} WHERE {total_where} AND NOT {_STATIC}
+              GROUP BY path_id
+            )
+            SELECT {interning.label("path", "pv.path_id")} AS path,
+                   pv.total_sessions,
+                   ROUND(100.0 * COALESCE(b.bounces, 0) / pv.total_sessions, 1) AS bounce_rate
+            FROM page_visits pv
+            LEFT JOIN bounces b ON b.path_id = pv.path_id
+            WHERE pv.total_sessions >= 3
+            ORDER BY bounce_rate DESC
+            LIMIT ?""",
+        params + inside_params + total_params + [limit],
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _panel_exit_pages(src="hits"):
+    *_, limit = _query_params()
+    raw_from, where, params, inside, inside_params = _session_split(src)
+    rows = get_db().execute(
+        f"""WITH filtered AS (
+              SELECT session, path_id, ts FROM {raw_from} WHERE {where}
+            ),
+            session_last AS (
+              SELECT session, MAX(ts) AS last_ts FROM filtered GROUP BY session
+            ),
+            exits AS (
+              SELECT f.path_id, COUNT(*) AS n FROM filtered f
+              JOIN session_last sl ON f.session = sl.session AND f.ts = sl.last_ts
+              GROUP BY f.path_id
+              {_stored_paths("exit_path", inside)}
+            )
+            SELECT {interning.label("path")} AS path, SUM(n) AS exits
+            FROM exits
+            GROUP BY path_id ORDER BY exits DESC LIMIT ?""",
+        params + inside_params + [limit],
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _panel_session_duration(src="hits"):
+    raw_from, where, params, inside, inside_params = _session_split(src)
+    stored = (
+        f"UNION ALL SELECT session, last_ts - first_ts FROM sessions "
+        f"WHERE {inside} AND hits > 1"
+        if inside else ""
+    )
+    row = get_db().execute(
+        f"""WITH session_times AS (
+              SELECT session, MAX(ts) - MIN(ts) AS duration_s
+              FROM {raw_from} WHERE {where}
+              GROUP BY session
+              HAVING COUNT(*) > 1
+              {stored}
+            )
+            SELECT AVG(duration_s) AS avg_seconds, COUNT(*) AS sessions
+            FROM session_times
+            WHERE duration_s <= 1800""",
+        params + inside_params,
+    ).fetchone()
+    avg = round(row["avg_seconds"], 1) if row["avg_seconds"] else 0
+    return {"avg_seconds": avg, "sessions": row["sessions"]}
+
+
+# /api/report panel name -> panel function (same names as the /api/* endpoints)
+_PANELS = {
+    "pageviews":        _panel_pageviews,
+    "pages":            _panel_pages,
+    "referrers":        _panel_referrers,
+    "timeseries":       _panel_timeseries,
+    "devices":          _panel_devices,
+    "languages":        _panel_languages,
+    "hostnames":        _panel_hostnames,
+    "countries":        _panel_countries,
+    "entry-pages":      _panel_entry_pages,
+    "peak-hours":       _panel_peak_hours,
+    "bounce-rates":     _panel_bounce_rates,
+    "exit-pages":       _panel_exit_pages,
+    "screen-widths":    _panel_screen_widths,
+    "browsers":         _panel_browsers,
+    "os":               _panel_os,
+    "session-duration": _panel_session_duration,
+}
+_BUCKETED = {"timeseries", "peak-hours"}   # served per day by buckets.assemble
+
+
 # ── Protected stats API ────────────────────────────────────────────────────────
 
 @bp.route("/api/pageviews")
 @require_token
 @cache_response
 def pageviews():
-    """Total pageviews and unique sessions."""
-    site, start, end, _ = _query_params()
-    where, params = _where(site, start, end)
-    row = get_db().execute(
-        f"SELECT COUNT(*) AS views, COUNT(DISTINCT session) AS sessions FROM hits WHERE {where}",
-        params,
-    ).fetchone()
-    return jsonify({"views": row["views"], "sessions": row["sessions"]})
+    """Total pageviews and unique sessions.
+
+    Sessions over closed days are estimated by merging the per-day
+    HyperLogLog sketches (mode "sketch", relative standard error in "error");
+    pass ?exact=1 to force COUNT(DISTINCT session) over raw hits.
+    """
+    return jsonify(_panel_pageviews())
 
 
 @bp.route("/api/pages")
@@ -283,14 +902,7 @@ def pageviews():
 @cache_response
 def pages():
     """Top pages by view count."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT path, COUNT(*) AS views FROM hits WHERE {where} "
-        f"GROUP BY path ORDER BY views DESC LIMIT ?",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_pages())
 
 
 @bp.route("/api/referrers")
@@ -298,16 +910,7 @@ def pages():
 @cache_response
 def referrers():
     """Top external referrer domains (own-domain self-referrals excluded)."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    root = _root_domain(site)
-    rows = get_db().execute(
-        f"SELECT ref, COUNT(*) AS views FROM hits WHERE {where} "
-        f"AND ref != '' AND ref NOT LIKE ? "
-        f"GROUP BY ref ORDER BY views DESC LIMIT ?",
-        params + [f"%{root}%", limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_referrers())
 
 
 @bp.route("/api/timeseries")
@@ -315,22 +918,7 @@ def referrers():
 @cache_response
 def timeseries():
     """Daily (or hourly) pageviews and sessions. Pass ?granularity=hour for hourly breakdown."""
-    site, start, end, _ = _query_params()
-    granularity = request.args.get("granularity", "day")
-    where, params = _where(site, start, end)
-    if granularity == "hour":
-        bucket_expr = "strftime('%Y-%m-%d %H:00', ts, 'unixepoch')"
-        label       = "hour"
-    else:
-        bucket_expr = "date(ts, 'unixepoch')"
-        label       = "day"
-    rows = get_db().execute(
-        f"SELECT {bucket_expr} AS {label}, COUNT(*) AS views, "
-        f"COUNT(DISTINCT session) AS sessions "
-        f"FROM hits WHERE {where} GROUP BY {label} ORDER BY {label}",
-        params,
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_timeseries())
 
 
 @bp.route("/api/browsers")
@@ -338,16 +926,7 @@ def timeseries():
 @cache_response
 def browsers():
     """Pageview breakdown by browser (Chrome / Firefox / Safari / Edge / other)."""
-    site, start, end, _ = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT ua FROM hits WHERE {where}", params
-    ).fetchall()
-    counts: dict[str, int] = {}
-    for r in rows:
-        b = browser_name(r["ua"])
-        counts[b] = counts.get(b, 0) + 1
-    return jsonify(counts)
+    return jsonify(_panel_browsers())
 
 
 @bp.route("/api/os")
@@ -355,16 +934,7 @@ def browsers():
 @cache_response
 def operating_systems():
     """Pageview breakdown by OS (Windows / macOS / Linux / iOS / Android / other)."""
-    site, start, end, _ = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT ua FROM hits WHERE {where}", params
-    ).fetchall()
-    counts: dict[str, int] = {}
-    for r in rows:
-        o = os_name(r["ua"])
-        counts[o] = counts.get(o, 0) + 1
-    return jsonify(counts)
+    return jsonify(_panel_os())
 
 
 @bp.route("/api/devices")
@@ -372,15 +942,7 @@ def operating_systems():
 @cache_response
 def devices():
     """Pageview breakdown by device type (mobile / tablet / desktop / unknown)."""
-    site, start, end, _ = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT ua FROM hits WHERE {where}", params
-    ).fetchall()
-    counts = {"mobile": 0, "tablet": 0, "desktop": 0, "unknown": 0}
-    for r in rows:
-        counts[device_type(r["ua"])] += 1
-    return jsonify(counts)
+    return jsonify(_panel_devices())
 
 
 @bp.route("/api/languages")
@@ -388,14 +950,7 @@ def devices():
 @cache_response
 def languages():
     """Top browser languages."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT lang, COUNT(*) AS views FROM hits WHERE {where} AND lang != '' "
-        f"GROUP BY lang ORDER BY views DESC LIMIT ?",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_languages())
 
 
 @bp.route("/api/countries")
@@ -403,45 +958,93 @@ def languages():
 @cache_response
 def countries():
     """Top countries by pageview count (ISO 3166-1 alpha-2 codes)."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT country, COUNT(*) AS views FROM hits WHERE {where} "
-        f"AND country IS NOT NULL AND country != '' "
-        f"GROUP BY country ORDER BY views DESC LIMIT ?",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_countries())
 
 
 @bp.route("/api/active")
 @require_token
 def active():
-    """Active unique sessions in the last N seconds (default 300 = 5 min), grouped by country."""
+    """Active unique sessions in the last N seconds (default 300 = 5 min), grouped by country.
+
+    Answered from the shared live tracker (live.py), not from hits.
+    """
     site   = request.args.get("site", "")
     window = min(int(request.args.get("window", 300)), 3600)
-    since  = int(time.time()) - window
-    root   = _root_domain(site)
+    return jsonify(_active_payload(current_app.extensions["live"], site, window))
 
-    total = get_db().execute(
-        "SELECT COUNT(DISTINCT session) AS n FROM hits "
-        "WHERE (site = ? OR site LIKE ?) AND ts >= ? AND (bot IS NULL OR bot = 0)",
-        [root, f"%.{root}", since],
-    ).fetchone()["n"]
 
-    rows = get_db().execute(
-        "SELECT country, COUNT(DISTINCT session) AS sessions FROM hits "
-        "WHERE (site = ? OR site LIKE ?) AND ts >= ? "
-        "AND country IS NOT NULL AND country != '' "
-        "AND (bot IS NULL OR bot = 0) "
-        "GROUP BY country ORDER BY sessions DESC",
-        [root, f"%.{root}", since],
-    ).fetchall()
-
-    return jsonify({
+def _active_payload(tracker, site, window):
+    total, countries = tracker.active(site, window)
+    return {
         "active":          total,
         "window_seconds":  window,
-        "countries":       [dict(r) for r in rows],
+        "countries":       [
+            {"country": c, "sessions": n}
+            for c, n in sorted(countries.items(), key=lambda kv: (-kv[1], kv[0]))
+        ],
+    }
+
+
+# /api/live: Server-Sent Events for the dashboard's live box.  `active` events
+# carry the /api/active payload whenever it changes; `hits` events list the
+# site's hits recorded since the previous event.  The tracker's sequence
+# number is checked every LIVE_POLL seconds, and counts are recomputed at
+# least every LIVE_REFRESH seconds so sessions leaving the window show up
+# without new traffic.  A stream ends after LIVE_STREAM_SECONDS; the client
+# reconnects.  It never touches SQLite.
+
+LIVE_POLL      = 0.25
+LIVE_REFRESH   = 5.0
+LIVE_KEEPALIVE = 15.0
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@bp.route("/api/live")
+@require_token
+def live_events():
+    """Stream active-session counts and recent hits for a site as they change (SSE)."""
+    site     = request.args.get("site", "")
+    window   = min(request.args.get("window", 300, type=int), 3600)
+    tracker  = current_app.extensions["live"]
+    duration = current_app.config["LIVE_STREAM_SECONDS"]
+    if not site:
+        return jsonify({"error": "site is required"}), 400
+
+    def events():
+        yield "retry: 1000\n\n"
+        deadline = time.monotonic() + duration
+        seq      = tracker.seq()
+        payload  = None
+        computed = wrote = 0.0
+        while True:
+            now = time.monotonic()
+            cur = tracker.seq()
+            out = []
+            if cur != seq:
+                recent = tracker.recent(site, after=seq)
+                seq    = cur
+                if recent:
+                    out.append(_sse("hits", recent))
+            if payload is None or out or now - computed >= LIVE_REFRESH:
+                fresh, computed = _active_payload(tracker, site, window), now
+                if fresh != payload:
+                    payload = fresh
+                    out.insert(0, _sse("active", payload))
+            if not out and now - wrote >= LIVE_KEEPALIVE:
+                out.append(": keep-alive\n\n")
+            if out:
+                wrote = now
+                yield "".join(out)
+            if now >= deadline:
+                return
+            time.sleep(LIVE_POLL)
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control":     "no-store",
+        "X-Accel-Buffering": "no",
     })
 
 
@@ -450,14 +1053,7 @@ def active():
 @cache_response
 def hostnames():
     """Pageview breakdown by exact hostname (subdomain breakdown)."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT site, COUNT(*) AS views FROM hits WHERE {where} "
-        f"GROUP BY site ORDER BY views DESC LIMIT ?",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_hostnames())
 
 
 @bp.route("/api/entry-pages")
@@ -465,25 +1061,7 @@ def hostnames():
 @cache_response
 def entry_pages():
     """Top entry pages — first path seen in each session."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"""WITH filtered AS (
-              SELECT session, path, ts FROM hits WHERE {where}
-            ),
-            session_first AS (
-              SELECT session, MIN(ts) AS first_ts FROM filtered GROUP BY session
-            ),
-            entries AS (
-              SELECT f.path FROM filtered f
-              JOIN session_first sf ON f.session = sf.session AND f.ts = sf.first_ts
-            )
-            SELECT path, COUNT(*) AS entries
-            FROM entries
-            GROUP BY path ORDER BY entries DESC LIMIT ?""",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_entry_pages())
 
 
 @bp.route("/api/peak-hours")
@@ -491,15 +1069,7 @@ def entry_pages():
 @cache_response
 def peak_hours():
     """Pageview count grouped by hour of day (0–23, UTC), top 10 busiest."""
-    site, start, end, _ = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT CAST(strftime('%H', ts, 'unixepoch') AS INTEGER) AS hour, "
-        f"COUNT(*) AS views FROM hits WHERE {where} "
-        f"GROUP BY hour ORDER BY views DESC LIMIT 10",
-        params,
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_peak_hours())
 
 
 @bp.route("/api/bounce-rates")
@@ -507,33 +1077,7 @@ def peak_hours():
 @cache_response
 def bounce_rates():
     """Bounce rate per page — % of sessions that only ever viewed that one page."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"""WITH filtered AS (
-              SELECT session, path FROM hits WHERE {where} AND path NOT LIKE '/static/%'
-            ),
-            session_sizes AS (
-              SELECT session, COUNT(*) AS hit_count FROM filtered GROUP BY session
-            ),
-            page_visits AS (
-              SELECT f.path,
-                     COUNT(DISTINCT f.session) AS total_sessions,
-                     SUM(CASE WHEN ss.hit_count = 1 THEN 1 ELSE 0 END) AS bounces
-              FROM filtered f
-              JOIN session_sizes ss ON f.session = ss.session
-              GROUP BY f.path
-            )
-            SELECT path,
-                   total_sessions,
-                   ROUND(100.0 * bounces / total_sessions, 1) AS bounce_rate
-            FROM page_visits
-            WHERE total_sessions >= 3
-            ORDER BY bounce_rate DESC
-            LIMIT ?""",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_bounce_rates())
 
 
 @bp.route("/api/exit-pages")
@@ -541,25 +1085,7 @@ def bounce_rates():
 @cache_response
 def exit_pages():
     """Top exit pages — last path seen in each session."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"""WITH filtered AS (
-              SELECT session, path, ts FROM hits WHERE {where}
-            ),
-            session_last AS (
-              SELECT session, MAX(ts) AS last_ts FROM filtered GROUP BY session
-            ),
-            exits AS (
-              SELECT f.path FROM filtered f
-              JOIN session_last sl ON f.session = sl.session AND f.ts = sl.last_ts
-            )
-            SELECT path, COUNT(*) AS exits
-            FROM exits
-            GROUP BY path ORDER BY exits DESC LIMIT ?""",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_exit_pages())
 
 
 @bp.route("/api/screen-widths")
@@ -567,14 +1093,7 @@ def exit_pages():
 @cache_response
 def screen_widths():
     """Pageview breakdown by screen width bucket."""
-    site, start, end, limit = _query_params()
-    where, params = _where(site, start, end)
-    rows = get_db().execute(
-        f"SELECT w, COUNT(*) AS views FROM hits WHERE {where} AND w IS NOT NULL "
-        f"GROUP BY w ORDER BY views DESC LIMIT ?",
-        params + [limit],
-    ).fetchall()
-    return jsonify([dict(r) for r in rows])
+    return jsonify(_panel_screen_widths())
 
 
 @bp.route("/api/session-duration")
@@ -582,22 +1101,79 @@ def screen_widths():
 @cache_response
 def session_duration():
     """Average session duration in seconds (sessions with > 1 hit only)."""
+    return jsonify(_panel_session_duration())
+
+
+@bp.route("/api/report")
+@require_token
+@cache_response
+def report():
+    """Several dashboard panels in one request: ?panels=pageviews,pages,... (default: all).
+
+    The filtered range is scanned once into a temp table and every panel is
+    computed from it, instead of each endpoint re-running _where() over hits.
+    Takes the same site/start/end/limit/filter_* params; unknown panel names
+    are ignored.
+    """
     site, start, end, _ = _query_params()
+    wanted = [p for p in request.args.get("panels", "").split(",") if p in _PANELS]
+    wanted = wanted or list(_PANELS)
+    # Bucketed panels read their closed days from the per-day cache instead
+    data   = {p: _PANELS[p]() for p in wanted if p in _BUCKETED}
+    wanted = [p for p in wanted if p not in _BUCKETED]
+    if not wanted:
+        return jsonify(data)
     where, params = _where(site, start, end)
-    row = get_db().execute(
-        f"""WITH session_times AS (
-              SELECT session, MAX(ts) - MIN(ts) AS duration_s
-              FROM hits WHERE {where}
-              GROUP BY session
-              HAVING COUNT(*) > 1
-            )
-            SELECT AVG(duration_s) AS avg_seconds, COUNT(*) AS sessions
-            FROM session_times
-            WHERE duration_s <= 1800""",
-        params,
-    ).fetchone()
-    avg = round(row["avg_seconds"], 1) if row["avg_seconds"] else 0
-    return jsonify({"avg_seconds": avg, "sessions": row["sessions"]})
+    db = get_db()
+    # Spill the temp table to a temp file rather than RAM on large ranges;
+    # changing temp_store drops temp tables, so it is restored afterwards.
+    db.execute("PRAGMA temp_store=FILE")
+    try:
+        db.execute(
+            f"CREATE TEMP TABLE {_REPORT_TABLE} AS "
+            f"SELECT ts, site, path_id, ref_id, lang_id, w, session, country, device, browser, os, "
+            f"CASE WHEN device IS NULL THEN ua_id END AS ua_id "
+            f"FROM {hits_source(start, end, where, params)} WHERE {where}",
+            params,
+        )
+        db.execute(f"CREATE INDEX temp.{_REPORT_TABLE}_session ON {_REPORT_TABLE}(session, ts)")
+        data.update({p: _PANELS[p](_REPORT_TABLE) for p in wanted})
+    finally:
+        db.execute(f"DROP TABLE IF EXISTS temp.{_REPORT_TABLE}")
+        db.execute("PRAGMA temp_store=MEMORY")
+    return jsonify(data)
+
+
+@bp.route("/api/system")
+@require_token
+def system():
+    """Runtime internals of this worker, for tuning: connection pool, ingest queue, cache, GeoIP."""
+    writer      = current_app.extensions.get("hit_writer")
+    maintenance = current_app.extensions.get("maintenance")
+    parts       = get_db().execute(
+        "SELECT month, rows, state FROM partitions ORDER BY month"
+    ).fetchall()
+    return jsonify({
+        "db_pool":     current_app.extensions["db_pool"].stats(),
+        "ingest":      writer.stats() if writer else None,
+        "cache":       current_app.extensions["response_cache"].stats(),
+        "maintenance": maintenance.stats() if maintenance else None,
+        "geoip":       geo.resolver.stats(),
+        "partitions":  [dict(p) for p in parts],
+    })
+
+
+@bp.route("/metrics")
+@require_token
+def prometheus_metrics():
+    """Prometheus text format: request latency, SQLite work, cache, ingest and GeoIP counters.
+
+    Summed over every worker and the ingest server (see metrics.py).
+    """
+    if current_app.extensions.get("metrics") is None:
+        return jsonify({"error": "metrics are disabled (METRICS=0)"}), 404
+    return Response(metrics.scrape(current_app),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @bp.route("/api/filter-values")
@@ -621,14 +1197,67 @@ def filter_values():
 
     extra_clause = ""
     extra_params: list = []
-    if q:
-        extra_clause = f"AND {col} LIKE ?"
+    inner_clause = ""
+    inner_params: list = []
+    if q and col in interning.COLUMNS:
+        # Narrow the ids before counting (trigram index for path/ref)
+        inner_clause, inner_params = interning.like(col, f"%{q}%")
+        inner_clause = f"AND {inner_clause}"
+    elif q:
+        extra_clause = "AND value LIKE ?"
         extra_params = [f"%{q}%"]
 
+    # Interned columns: count per id, then label each group
+    key   = interning.stored(col)
+    value = interning.label(col) if col in interning.COLUMNS else key
     rows = get_db().execute(
-        f"SELECT {col} AS value, COUNT(*) AS n FROM hits "
-        f"WHERE {where} AND {col} IS NOT NULL AND {col} != '' "
-        f"{extra_clause} GROUP BY {col} ORDER BY n DESC",
-        params + extra_params,
+        f"SELECT value, n FROM ("
+        f"  SELECT {value} AS value, n FROM ("
+        f"    SELECT {key}, COUNT(*) AS n FROM {hits_source(start, end, where, params)} "
+        f"    WHERE {where} AND {key} IS NOT NULL {inner_clause} GROUP BY {key}"
+        f"  )"
+        f") WHERE value != '' {extra_clause} ORDER BY n DESC",
+        params + inner_params + extra_params,
     ).fetchall()
     return jsonify([dict(r) for r in rows])
+
+
+@bp.route("/api/export")
+@require_token
+def export_hits():
+    """Stream raw hits for a site and range as NDJSON or CSV, in id order.
+
+    Resume with after=<last id received>; a response ends after `limit` rows
+    or EXPORT_MAX_SECONDS, so repeat until one holds no rows.  Gzipped when
+    the client accepts it.  Bot-flagged hits are included with bots=1.
+    """
+    site, start, end, _ = _query_params()
+    fmt   = request.args.get("format", "ndjson")
+    after = request.args.get("after", 0, type=int)
+    limit = request.args.get("limit", type=int)
+    if not site:
+        return jsonify({"error": "site is required"}), 400
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(export.FORMATS)}"}), 400
+
+    where, params = _where(site, start, end, bots=request.args.get("bots") == "1")
+    gzip    = "gzip" in request.accept_encodings
+    cfg     = current_app.config
+    body    = export.stream(
+        cfg["DB_PATH"], where, params, fmt, start, end, after,
+        limit=limit if limit and limit > 0 else None,
+        gzip=gzip,
+        writer=current_app.extensions.get("hit_writer"),
+        chunk=cfg["EXPORT_CHUNK_ROWS"],
+        max_seconds=cfg["EXPORT_MAX_SECONDS"],
+        mmap_size=cfg["PARTITION_MMAP_SIZE"],
+    )
+    headers = {
+        "Content-Disposition": f'attachment; filename="{_root_domain(site)}-hits.{fmt}"',
+        "Cache-Control":       "no-store",
+        "X-Accel-Buffering":   "no",   # let nginx pass chunks through as they come
+        "Vary":                "Accept-Encoding",
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype=export.FORMATS[fmt][0], headers=headers)
@@ -0,0 +1,160 @@
+import time
+
+from . import interning, partitions
+from .sites import site_root
+
+# One row per (site, session), upserted by ingest in the same transaction as
+# the hit INSERT, so the entry/exit/bounce/duration endpoints aggregate over
+# sessions instead of grouping hits by session and joining back.
+#
+# Only non-bot hits are folded in.  page_hits/page_path ignore /static/ paths,
+# matching the bounce-rate definition.  meta.sessions_since records from which
+# timestamp the table is complete; `flask rebuild-sessions` replays history.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    site       TEXT    NOT NULL,
+    root_site  TEXT,
+    session    TEXT    NOT NULL,
+    first_ts   INTEGER NOT NULL,
+    last_ts    INTEGER NOT NULL,
+    entry_path TEXT,
+    exit_path  TEXT,
+    hits       INTEGER NOT NULL DEFAULT 0,
+    page_hits  INTEGER NOT NULL DEFAULT 0,
+    page_path  TEXT,
+    country    TEXT,
+    device     TEXT,
+    PRIMARY KEY (site, session)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_sessions_root_first ON sessions(root_site, first_ts);
+CREATE INDEX IF NOT EXISTS idx_sessions_root_last  ON sessions(root_site, last_ts);
+CREATE INDEX IF NOT EXISTS idx_sessions_root_anon  ON sessions(root_site) WHERE session = '';
+"""
+
+_UPSERT = """
+INSERT INTO sessions (site, root_site, session, first_ts, last_ts, entry_path, exit_path,
+                      hits, page_hits, page_path, country, device)
+VALUES (?,?,?,?,?,?,?,1,?,?,?,?)
+ON CONFLICT (site, session) DO UPDATE SET
+    entry_path = CASE WHEN excluded.first_ts < first_ts THEN excluded.entry_path ELSE entry_path END,
+    exit_path  = CASE WHEN excluded.last_ts >= last_ts  THEN excluded.exit_path  ELSE exit_path  END,
+    first_ts   = MIN(first_ts, excluded.first_ts),
+    last_ts    = MAX(last_ts,  excluded.last_ts),
+    hits       = hits + 1,
+    page_hits  = page_hits + excluded.page_hits,
+    page_path  = COALESCE(page_path, excluded.page_path),
+    country    = COALESCE(country, excluded.country),
+    device     = COALESCE(device,  excluded.device)
+"""
+
+# Upper bound for open-ended ranges
+_FOREVER = 1 << 62
+
+
+def init(db):
+    db.executescript(SCHEMA)
+    has_hits = db.execute("SELECT 1 FROM hits LIMIT 1").fetchone()
+    now      = int(time.time())
+    since    = now - now % 86400 + 86400 if has_hits else 0
+    with db:
+        db.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('sessions_since', ?)", (since,)
+        )
+
+
+def apply(db, rows):
+    """Upsert a batch of hit tuples (db.HIT_COLUMNS order); runs inside the write transaction."""
+    params = []
+    for r in rows:
+        ts, site, path, _ref, _ua, _lang, _w, session, country, bot, device = r[:11]
+        if bot or session is None:
+            continue
+        is_page = not path.startswith("/static/")
+        params.append((
+            site, site_root(site), session, ts, ts, path, path,
+            1 if is_page else 0, path if is_page else None, country, device,
+        ))
+    db.executemany(_UPSERT, params)
+
+
+def rebuild(db, chunk=5000, echo=None):
+    """Replay all hits through apply(), partitions first, one transaction per chunk."""
+    # Hits stored after the DELETE are folded in by ingest, so only replay up
+    # to the last id that existed at that point.
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute("DELETE FROM sessions")
+        max_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM hits").fetchone()[0]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    parts = partitions.overlapping(db)
+    for part in parts:
+        partitions.attach(db, [part])
+        _replay(db, f"{partitions.alias(part['month'])}.hits", "1", part["max_id"], chunk, echo)
+    _replay(db, "main.hits", partitions.main_filter(parts), max_id, chunk, echo)
+    with db:
+        db.execute("UPDATE meta SET value = 0 WHERE key = 'sessions_since'")
+
+
+def _replay(db, table, cond, max_id, chunk, echo):
+    last_id = 0
+    while last_id < max_id:
+        rows = db.execute(
+            # apply() reads no ref/ua/lang, so only path is looked up
+            f"SELECT id, ts, site, {interning.label('path')} AS path, NULL, NULL, NULL, "
+            f"w, session, country, bot, device "
+            f"FROM {table} WHERE id > ? AND id <= ? AND {cond} ORDER BY id LIMIT ?",
+            (last_id, max_id, chunk),
+        ).fetchall()
+        if not rows:
+            break
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            apply(db, [tuple(r)[1:] for r in rows])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        last_id = rows[-1][0]
+        if echo:
+            echo(f"  {table}: up to hit #{last_id}")
+
+
+def covers(db, start):
+    """True if the sessions table is complete for ranges starting at `start`."""
+    row = db.execute("SELECT value FROM meta WHERE key = 'sessions_since'").fetchone()
+    return row is not None and int(row[0]) <= (start or 0)
+
+
+def bounds(start, end):
+    """Closed [lo, hi] ts bounds for a request's optional start/end."""
+    return start or 0, end or _FOREVER
+
+
+# Sessions wholly inside [lo, hi] come from the sessions table.  Sessions
+# crossing either boundary only count their in-range hits, so the caller
+# recomputes them from raw hits restricted to these (site, session) pairs.
+# Hits without a session ID (s='') are grouped together across subdomains by
+# the raw queries, so they always take the raw path as well.
+INSIDE = "first_ts >= ? AND +last_ts <= ? AND session != ''"   # scan by first_ts
+STRADDLING = (
+    "SELECT site AS s_site, session AS s_session FROM sessions WHERE {site_sql} "
+    "AND last_ts >= ? AND first_ts < ? "
+    "UNION "
+    "SELECT site, session FROM sessions WHERE {site_sql} "
+    "AND last_ts > ? AND first_ts <= ? "
+    "UNION "
+    "SELECT site, session FROM sessions WHERE {site_sql} AND session = ''"
+)
+
+
+def straddling(site_sql, site_params, lo, hi):
+    """SQL + params selecting (s_site, s_session) pairs that need raw hits."""
+    return (
+        STRADDLING.format(site_sql=site_sql),
+        site_params + [lo, lo] + site_params + [hi, hi] + site_params,
+    )
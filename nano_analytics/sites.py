@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+# Hostname → registrable root, stored at ingest as hits.root_site so every
+# site query starts with an index range scan on (root_site, bot, ts) instead
+# of a leading-wildcard LIKE.  The exact `site = ? OR site LIKE '%.root'`
+# match still runs as a residual filter, so results do not change.
+#
+# Without a public-suffix list the root is the last two labels, or three when
+# the second-to-last is a common second-level label (example.co.uk).  A wrong
+# guess only makes the index prefix less selective, never wrong.
+
+_SECOND_LEVEL = {"co", "com", "net", "org", "gov", "edu", "ac", "ne", "or", "go", "gob"}
+
+
+@lru_cache(maxsize=8192)
+def site_root(host: str | None) -> str:
+    if not host:
+        return ""
+    host   = host.lower().rstrip(".")
+    labels = host.split(".")
+    if len(labels) <= 2 or labels[-1].isdigit() or ":" in host:
+        return host   # bare domain, localhost, IPv4/IPv6 literal
+    if labels[-2] in _SECOND_LEVEL and len(labels[-1]) == 2:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
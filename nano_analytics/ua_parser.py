@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 # Check tablet before mobile — many tablet UAs also contain "Android" / "Mobi"
 _TABLET = re.compile(r"(iPad|Tablet|PlayBook|Silk)", re.IGNORECASE)
@@ -64,3 +65,159 @@ def os_name(ua: str | None) -> str:
     if _LINUX.search(ua):
         return "linux"
     return "other"
+
+
+# Bot detection
+_BOT_UA_RE     = re.compile(
+    r"(bot|crawl|spider|slurp|HeadlessChrome|python-requests|curl|wget|axios|"
+    r"node-fetch|Go-http-client|Java/|libwww|okhttp|Scrapy)",
+    re.IGNORECASE,
+)
+# Chrome dropped Windows 7 (NT 6.1) support after version 109.
+_WIN7_RE       = re.compile(r"Windows NT 6\.1")
+_CHROME_VER_RE = re.compile(r"Chrome/(\d+)\.")
+
+
+def is_bot(ua: str | None) -> bool:
+    if not ua:
+        return True
+    if _BOT_UA_RE.search(ua):
+        return True
+    # Chrome > 109 cannot run on Windows 7 (NT 6.1) — impossible combination.
+    if _WIN7_RE.search(ua):
+        m = _CHROME_VER_RE.search(ua)
+        if m and int(m.group(1)) > 109:
+            return True
+    return False
+
+
+# ── Single pass ────────────────────────────────────────────────────────────────
+# The functions above are the definition; analyze() gives the same answers
+# (python -m bench.ua checks it) from one scan of the string.
+#
+# Every pattern they search for is a token of one alternation.  The scan
+# resumes one character after the start of each match, so tokens inside or
+# overlapping others are still seen (the "Chrome" in "HeadlessChrome", the
+# "Mobile" in "IEMobile"), in string order.  Where two tokens start at the
+# same position the longer one comes first and carries the flags of both.
+# The precedence rules are then applied to the set of flags.
+#
+# ASCII UAs (nearly all) are lowered once and scanned case-sensitively, which
+# is several times faster than re.IGNORECASE; others use the IGNORECASE
+# pattern so Unicode case folding matches the reference exactly.
+
+CACHE_SIZE = 8192
+
+(_TABLET_F, _MOBILE_F, _ANDROID_F, _EDGE_F, _OPERA_F, _SAMSUNG_F, _FIREFOX_F, _CHROME_F,
+ _SAFARI_F, _IOS_F, _WINDOWS_F, _MACOS_F, _LINUX_F, _BOT_F, _WIN7_F) = (1 << i for i in range(15))
+
+# (pattern, flags); each is one group of the scan pattern, in this order
+_TOKENS = [
+    ("ipad",              _TABLET_F | _IOS_F),
+    ("tablet",            _TABLET_F),
+    ("playbook",          _TABLET_F),
+    ("silk",              _TABLET_F),
+    ("android",           _ANDROID_F | _MOBILE_F),
+    ("iemobile",          _MOBILE_F),
+    ("mobile",            _MOBILE_F),   # also ends an "Android" for the tablet rule
+    ("mobi",              _MOBILE_F),
+    ("iphone",            _MOBILE_F | _IOS_F),
+    ("ipod",              _MOBILE_F | _IOS_F),
+    ("blackberry",        _MOBILE_F),
+    ("opera mini",        _MOBILE_F | _OPERA_F),
+    ("opera",             _OPERA_F),
+    ("opr",               _OPERA_F),
+    ("edge",              _EDGE_F),
+    ("edg/",              _EDGE_F),
+    ("samsungbrowser",    _SAMSUNG_F),
+    ("firefox",           _FIREFOX_F),
+    (r"chrome/\d+\.",     _CHROME_F),   # keeps the version for the Windows 7 rule
+    ("chrome",            _CHROME_F),
+    ("safari",            _SAFARI_F),
+    (r"windows nt 6\.1",  _WINDOWS_F | _WIN7_F),
+    ("windows",           _WINDOWS_F),
+    ("macintosh",         _MACOS_F),
+    ("mac os x",          _MACOS_F),
+    ("linux",             _LINUX_F),
+    ("headlesschrome",    _BOT_F),
+    ("python-requests",   _BOT_F),
+    ("node-fetch",        _BOT_F),
+    ("go-http-client",    _BOT_F),
+    ("java/",             _BOT_F),
+    ("libwww",            _BOT_F),
+    ("okhttp",            _BOT_F),
+    ("scrapy",            _BOT_F),
+    ("bot",               _BOT_F),
+    ("crawl",             _BOT_F),
+    ("spider",            _BOT_F),
+    ("slurp",             _BOT_F),
+    ("curl",              _BOT_F),
+    ("wget",              _BOT_F),
+    ("axios",             _BOT_F),
+]
+# Groups would disable re's fast literal prefix scan, so the ASCII pattern has
+# none and its tokens are looked up by text; the rare other UAs use groups.
+_SCAN_RE     = re.compile("|".join(p for p, _ in _TOKENS))
+_SCAN_RE_I   = re.compile("|".join(f"({p})" for p, _ in _TOKENS), re.IGNORECASE)
+_TOKEN_FLAGS = [None] + [f for _, f in _TOKENS]   # by token number (group)
+_TOKEN_GROUP = {p.replace(r"\.", "."): i for i, (p, _) in enumerate(_TOKENS, 1)}
+_ANDROID_G   = _TOKEN_GROUP["android"]
+_MOBILE_G    = _TOKEN_GROUP["mobile"]
+_CHROME_G    = _TOKEN_GROUP[r"chrome/\d+."]
+_WIN7_G      = _TOKEN_GROUP["windows nt 6.1"]
+
+_BROWSERS = ((_EDGE_F, "edge"), (_OPERA_F, "opera"), (_SAMSUNG_F, "samsung"),
+             (_FIREFOX_F, "firefox"), (_CHROME_F, "chrome"), (_SAFARI_F, "safari"))
+_OSES     = ((_IOS_F, "ios"), (_ANDROID_F, "android"), (_WINDOWS_F, "windows"),
+             (_MACOS_F, "macos"), (_LINUX_F, "linux"))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def analyze(ua: str | None) -> tuple[str, str, str, bool]:
+    """Return (device, browser, os, bot) for a UA from one scan. Memoized."""
+    if not ua:
+        return "unknown", "other", "other", True
+    flags, chrome, android_open = 0, None, False
+    if ua.isascii():
+        search, text = _SCAN_RE.search, ua.lower()
+    else:
+        search, text = _SCAN_RE_I.search, ua
+    m = search(text)
+    while m is not None:
+        # Text not in _TOKEN_GROUP: the only pattern token, chrome/<version>.
+        group = m.lastindex or _TOKEN_GROUP.get(m.group(), _CHROME_G)
+        f     = _TOKEN_FLAGS[group]
+        if group == _ANDROID_G:
+            android_open = True
+        elif group == _MOBILE_G:
+            android_open = False
+        elif group == _CHROME_G:
+            # The version check is case-sensitive, like _CHROME_VER_RE
+            match = ua[m.start():m.end()]
+            if chrome is None and match.startswith("Chrome/"):
+                chrome = int(match[7:-1])
+        elif group == _WIN7_G and ua[m.start():m.end()] != "Windows NT 6.1":
+            f = _WINDOWS_F
+        flags |= f
+        m = search(text, m.start() + 1)
+
+    if flags & _TABLET_F or android_open:   # Android without "Mobile" after it
+        device = "tablet"
+    elif flags & _MOBILE_F:
+        device = "mobile"
+    else:
+        device = "desktop"
+    browser = next((name for f, name in _BROWSERS if flags & f), "other")
+    os_     = next((name for f, name in _OSES if flags & f), "other")
+    bot     = bool(flags & _BOT_F) or bool(flags & _WIN7_F and chrome is not None and chrome > 109)
+    return device, browser, os_, bot
+
+
+def analyze_many(uas) -> dict:
+    """{ua: (device, browser, os, bot)} for an iterable of UAs, each distinct one analyzed once."""
+    return {ua: analyze(ua) for ua in set(uas)}
+
+
+def classify(ua: str | None) -> tuple[str, str, str]:
+    """Return (device, browser, os) for a UA. Memoized — distinct UAs are few."""
+    return analyze(ua)[:3]
@@ -1,11 +1,12 @@
 // NanoAnalytics beacon — https://github.com/callmefredcom/NanoAnalytics
-// Intentionally kept small (< 400 bytes). No cookies. No external calls.
+// Intentionally kept small. No cookies. No external calls.
 // Session ID lives in sessionStorage only — no GDPR banner needed.
 (() => {
   const s = sessionStorage.ab
     || (sessionStorage.ab = Math.random().toString(36).slice(2, 10));
 
-  const origin = new URL(document.currentScript.src).origin;
+  const me     = document.currentScript;
+  const origin = new URL(me.src).origin;
 
   function send(path) {
     fetch(
@@ -20,13 +21,41 @@
     );
   }
 
+  // Batch mode (<script data-batch ...>): SPA navigations are queued and sent
+  // in one POST /hit/batch via sendBeacon when the page is hidden or unloaded.
+  let queue = [];
+
+  function flush() {
+    if (!queue.length) return;
+    const now = Date.now();
+    navigator.sendBeacon(`${origin}/hit/batch`, JSON.stringify(queue.map(e => ({
+      site: location.hostname, path: e.path, ref: document.referrer,
+      lang: navigator.language, w: screen.width, s,
+      ago: Math.round((now - e.t) / 1000),
+    }))));
+    queue = [];
+  }
+
+  function enqueue(path) {
+    queue.push({ path, t: Date.now() });
+    if (queue.length >= 50) flush();
+  }
+
+  const nav = 'batch' in me.dataset && navigator.sendBeacon ? enqueue : send;
+  if (nav === enqueue) {
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'hidden') flush();
+    });
+    window.addEventListener('pagehide', flush);
+  }
+
   send(location.pathname);
 
   // SPA support: intercept history.pushState for client-side navigation
   const _push = history.pushState.bind(history);
   history.pushState = function(state, title, url) {
     _push(state, title, url);
-    if (url) send(new URL(url, location.href).pathname);
+    if (url) nav(new URL(url, location.href).pathname);
   };
-  window.addEventListener('popstate', () => send(location.pathname));
+  window.addEventListener('popstate', () => nav(location.pathname));
 })();